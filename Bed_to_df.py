@@ -9,124 +9,69 @@ Created on Tue Apr 23 17:50:07 2024
 '''
 Opens {FbID}.SLAC.UniProt.bed files and parses as a .tsv. This is then
 converted into a pandas dataframe and merged with solvent accessbility and
-packing density outputs from the DSSP_output.py and WCN_output.py scripts
+packing density outputs from the DSSP_output.py and calc_wcn.py scripts
 '''
 
 # %% Initialize
 
-import pandas as pd
-from DSSP_output import get_dssp, make_dssp_df 
-from WCN_output import get_wcn, make_wcn_df 
-from matplotlib import pyplot as plt
-import seaborn as sns
-from sklearn.linear_model import LinearRegression
-
-fit_model = LinearRegression()
-sns.set_theme(style="darkgrid")
-
-
+import os
+from bootstrap import corr_intervals
+from join_engine import gene_task
 
 file_dnds = './FBgn0000015/FBgn0000015.SLAC.UniProt.bed'
 file_pdb = './FBgn0000015/refprot/FBgn0000015.pdb'
-name_pdb = 'ADBD_DROME'
 
 #file_dnds = './FBgn0000018/FBgn0000018.SLAC.UniProt.bed'
 #file_pdb = './FBgn0000018/refprot/FBgn0000018.pdb'
-#name_pdb = 'Q9VKM4_DROME'
-
-
-# %% Parse
-
-frame = []
-
-labels = ['UniProt_ID',
-          'Unknown',
-          'AA_pos',
-          'Codon_pos',
-          'E[S]',
-          'E[N]',
-          'DS',
-          'DN',
-          '8',
-          '9',
-          '10',
-          '11',
-          '12',
-          '13',
-          '14',]
-
-with open(file_dnds) as read:
-    for line in read:
-        entry = line.split() # Split by tabs
-        data = entry[-1].split(":") # Split data entry by :
-        data = [data[0]] + data[1].split(",") # Split data entry by ,
-        
-        entry = entry[:-1] + data # Stitch together
-        
-        if len(entry) != len(labels):# In case of missing data
-            raise ValueError
-        
-        frame.append(entry)
-
-df_dnds = pd.DataFrame(frame, columns = labels)
-
-# %% Get DSSP data
-sander, wilke, miller = get_dssp(name_pdb, file_pdb)
-df_dssp = make_dssp_df(sander, wilke, miller)
-
-# %% Get WCN data
-output = get_wcn(name_pdb, file_pdb)
-df_wcn = make_wcn_df(output)
-
-# %% Clean and merge
+
+
+# %% Parse, get structure data and merge
 '''
 Merges df_dnds with df_dssp and df_wcn. df_dnds will have fewer entries as not
 all residues have coverage. df_dssp and df_wcn will be matched to df_dnds by
-amino acid position
+amino acid position, see join_engine.join_gene. The FBgn id, which names the
+mask and features files, is taken from the SLAC file name if not given.
 '''
+def get_gene_df(file_dnds = file_dnds, file_pdb = file_pdb, fb_id = None):
+    if fb_id is None:
+        fb_id = os.path.basename(file_dnds).split('.')[0]
+    return gene_task(fb_id, file_dnds, file_pdb)
 
-# Clean dssp by pulling only RASA_Wilke and renaming index
-df_dssp_sub = df_dssp[['DSSP_Index', 'AA', 'Sec_Struct', 'RASA_Wilke']]
-df_dssp_sub.rename(columns = {'DSSP_Index' : 'AA_pos', 'AA' : 'DSSP_AA'}, inplace = True)
-df_dssp_sub['AA_pos'] = df_dssp_sub['AA_pos'].astype(int)
-
-# Clean wcn by pulling only wcn_ca, wcn_sc and renaming index
-df_wcn_sub = df_wcn[['pdb_aa', 'pdb_position', 'wcn_ca', 'wcn_sc']]
-df_wcn_sub.rename(columns = {'pdb_position' : 'AA_pos', 'pdb_AA' : 'WCN_AA'}, inplace = True)
-df_wcn_sub['AA_pos'] = df_wcn_sub['AA_pos'].astype(int)
-
-# Clean dnds but dropping irrelevant entries
-df_dnds_sub = df_dnds[['UniProt_ID', 'Codon_pos', 'AA_pos', 'E[S]', 'E[N]', 'DS', 'DN']] 
-df_dnds_sub['AA_pos'] = df_dnds_sub[['AA_pos']].astype(int) 
-df_dnds_sub[['E[S]', 'E[N]', 'DS', 'DN']] = df_dnds_sub[['E[S]', 'E[N]', 'DS', 'DN']].astype(float)
-
-# Merge
-df = pd.merge(df_dnds_sub, df_dssp_sub, how = 'left', on = 'AA_pos')
-df = pd.merge(df, df_wcn_sub, how = 'left', on = 'AA_pos')
-df['dN/dS'] = (df['DN']/df['E[N]'])/(df['DS']/df['E[S]'])
-        
-# %% dN/dS manhattan plot
-df.plot('AA_pos','dN/dS')
-
-# %% Hist for RASA
-sns.histplot(data = df, x = 'RASA_Wilke')
+# %% Plots
+def plot_gene(df):
+    from matplotlib import pyplot as plt
+    import seaborn as sns
 
-# %% Hist for wcn_ca
-sns.histplot(data = df, x = 'wcn_ca')
+    sns.set_theme(style="darkgrid")
 
-# %% Hist for wcn_sc
-sns.histplot(data = df, x = 'wcn_sc')
+    # dN/dS manhattan plot
+    df.plot('AA_pos','dN/dS')
 
-# %% Scatter for wcn_ca
-sns.scatterplot(data = df, x = 'wcn_ca', y = 'dN/dS')
+    # Hist for RASA, wcn_ca, wcn_sc
+    for x in ['RASA_Wilke', 'wcn_ca', 'wcn_sc']:
+        plt.figure()
+        sns.histplot(data = df, x = x)
 
-# %% Scatter for wcn_sc
-sns.scatterplot(data = df, x = 'wcn_sc', y = 'dN/dS')
+    # Scatter for wcn_ca, wcn_sc, RASA_Wilke
+    for x in ['wcn_ca', 'wcn_sc', 'RASA_Wilke']:
+        plt.figure()
+        sns.scatterplot(data = df, x = x, y = 'dN/dS')
 
-# %% Scatter for RASA_Wilke
-sns.scatterplot(data = df, x = 'RASA_Wilke', y = 'dN/dS')
+    plt.show()
 
 # %% Correlations
-df_sub = df[['dN/dS','wcn_sc','wcn_ca','RASA_Wilke']]
-corr_matrix = df_sub.corr()['dN/dS']
-print(corr_matrix)
+def gene_corr(df):
+    df_sub = df[['dN/dS','wcn_sc','wcn_ca','RASA_Wilke']]
+    corr_matrix = df_sub.corr()['dN/dS']
+    return corr_matrix
+
+# Pearson and Spearman correlations with bootstrap intervals, see bootstrap.py
+def gene_corr_ci(df, n_reps = 1000, seed = 0, alpha = 0.05):
+    return corr_intervals(df, 'dN/dS', ['wcn_sc', 'wcn_ca', 'RASA_Wilke'],
+                          n_reps, seed, alpha)
+
+if __name__ == '__main__':
+    df = get_gene_df()
+    plot_gene(df)
+    print(gene_corr(df))
+    print(gene_corr_ci(df))
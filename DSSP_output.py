@@ -7,18 +7,24 @@ Created on Mon Apr 22 12:34:40 2024
 """
 
 # %% Initialize
-from Bio.PDB import PDBParser
-from Bio.PDB.DSSP import DSSP
-from matplotlib import pyplot as plt
+import os
+import re
+import tempfile
+import subprocess
+from functools import lru_cache
+from Bio.Data.PDBData import protein_letters_1to3
+import numpy as np
 import pandas as pd
 
-p = PDBParser()
-
 file = './FBgn0000015/refprot/FBgn0000015.pdb'
 name = 'ADBD_DROME'
 
  # %% Getting all dssp methods
 def get_dssp(name, file):
+    from Bio.PDB import PDBParser
+    from Bio.PDB.DSSP import DSSP
+
+    p = PDBParser()
     structure = p.get_structure(name, file)
     model = structure[0]
     dssp_sander = DSSP(model, file, dssp = 'mkdssp', acc_array = 'Sander')
@@ -64,14 +70,103 @@ def make_dssp_df(dssp_sander, dssp_wilke, dssp_miller):
 
     return df
 
-# %% Run
-sander, wilke, miller = get_dssp(name, file)
-df_ADBD = make_dssp_df(sander, wilke, miller)
+# %% Single DSSP run with all normalizations
+@lru_cache(maxsize = None)
+def dssp_version(dssp = 'mkdssp'):
+    '''
+    Returns the version number of the dssp executable, as Bio.PDB.DSSP does.
+    '''
+    version_string = subprocess.check_output([dssp, '--version'], text = True)
+    return re.search(r'\s*([\d.]+)', version_string).group(1)
+
+def run_dssp_df(file, dssp = 'mkdssp', min_plddt = None):
+    '''
+    Returns the same dataframe as make_dssp_df(*get_dssp(name, file)), but runs
+    dssp once instead of three times. The raw ASA column of the DSSP output is
+    normalized against the Sander, Wilke and Miller tables in one vectorized
+    step per table. file may be a str or path-like, and may also be an existing
+    .dssp output file.
+    
+    If min_plddt is given, residues of an AlphaFold model with pLDDT below it
+    are removed before dssp runs, so they neither get rows nor shield other
+    residues. DSSP_Index then holds PDB residue numbers, which DSSP's own
+    sequential index no longer matches once residues are removed.
+    '''
+    from Bio.PDB.DSSP import dssp_dict_from_pdb_file, make_dssp_dict, residue_max_acc
+
+    file = os.fspath(file)
+    if file.lower().endswith('.dssp'):
+        dssp_dict, keys = make_dssp_dict(file)
+    elif min_plddt is not None:
+        from pdb_reader import write_confident_pdb
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, 'confident.pdb')
+            write_confident_pdb(file, tmp_path, min_plddt)
+            dssp_dict, keys = dssp_dict_from_pdb_file(tmp_path, dssp, 
+                                                      dssp_version(dssp))
+    else:
+        dssp_dict, keys = dssp_dict_from_pdb_file(file, dssp, dssp_version(dssp))
+    
+    # Records are (aa, ss, acc, phi, psi, dssp_index, H-bonds...)
+    records = [dssp_dict[key] for key in keys]
+    frame = [list(column) for column in zip(*records)]
+    if len(frame) == 0:
+        frame = [[] for i in range(14)]
+    
+    # DSSP renames C in C-bridges to a,b,c,d,...  - we rename it back to 'C'
+    aa = ['C' if letter.islower() else letter for letter in frame[0]]
+    resname = pd.Series([protein_letters_1to3.get(letter, letter) for letter in aa])
+    acc = np.array(frame[2], dtype = float)
+    
+    # Relative accessibility, capped at 1 and 'NA' for unknown residues
+    rasa = {}
+    for scale in ['Sander', 'Wilke', 'Miller']:
+        max_acc = resname.map(residue_max_acc[scale]).to_numpy(dtype = float)
+        rel_acc = np.minimum(acc/max_acc, 1.0)
+        if np.isnan(max_acc).any():
+            rel_acc = np.where(np.isnan(max_acc), 'NA', rel_acc.astype(object))
+        rasa[scale] = rel_acc
+    
+    dssp_index = frame[5]
+    if min_plddt is not None:
+        dssp_index = [key[1][1] for key in keys]
+    
+    df = pd.DataFrame({'DSSP_Index': dssp_index,
+                       'AA': aa,
+                       'Sec_Struct': frame[1],
+                       'RASA_Sander': rasa['Sander'],
+                       'Phi': frame[3],
+                       'Psi': frame[4],
+                       'NH->O_1_relidx': frame[6],
+                       'NH–>O_1_energy': frame[7],
+                       'O–>NH_1_relidx': frame[8],
+                       'O–>NH_1_energy': frame[9],
+                       'NH–>O_2_relidx': frame[10],
+                       'NH–>O_2_energy': frame[11],
+                       'O–>NH_2_relidx': frame[12],
+                       'O–>NH_2_energy': frame[13],
+                       'RASA_Wilke': rasa['Wilke'],
+                       'RASA_Miller': rasa['Miller']})
+    
+    return df
 
 # %% Check correlation of different ASA normalization methods
-df_ADBD.plot("RASA_Sander","RASA_Wilke",'scatter')
-df_ADBD.plot("RASA_Sander","RASA_Miller",'scatter')
-df_ADBD.plot("RASA_Wilke","RASA_Miller",'scatter')
-df_ADBD.hist("RASA_Wilke")
-df_ADBD.hist('RASA_Sander')
-df_ADBD.hist('RASA_Miller')
\ No newline at end of file
+def plot_dssp(file = file):
+    '''
+    Demo: runs DSSP on one structure and compares the RASA normalizations.
+    '''
+    from matplotlib import pyplot as plt
+
+    df_ADBD = run_dssp_df(file)
+    df_ADBD.plot("RASA_Sander","RASA_Wilke",'scatter')
+    df_ADBD.plot("RASA_Sander","RASA_Miller",'scatter')
+    df_ADBD.plot("RASA_Wilke","RASA_Miller",'scatter')
+    df_ADBD.hist("RASA_Wilke")
+    df_ADBD.hist('RASA_Sander')
+    df_ADBD.hist('RASA_Miller')
+    plt.show()
+
+    return df_ADBD
+
+if __name__ == '__main__':
+    plot_dssp()
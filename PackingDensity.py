@@ -6,16 +6,291 @@ Created on Tue Apr 23 13:57:36 2024
 @author: alansu
 """
 
+'''
+Per-residue packing metrics of a structure, all derived from one neighbour
+list. The alpha-carbons and sidechain centers of calc_wcn's residue table are
+put in one KD-tree and every pair of points within the list radius is found
+with a single query; the CA-CA and sidechain-sidechain pairs are kept with
+their distances. Each metric is then a masked bincount over the pair list,
+so no distance is computed twice:
+
+    cn_<r>         number of CA within r Angstroms of the CA, for each r in
+                   CN_CUTOFFS
+    hse_up/down    half-sphere exposure: CA within HSE_RADIUS on the
+                   sidechain side of the CA (up) and on the other side (down)
+    wcn_sc_<w>     sidechain WCN over pairs closer than NEIGHBOR_CUTOFF,
+                   weighted by 1/r^2 (inv_sq, calc_wcn's weighting), 1/r
+                   (inv) or a Gaussian of width GAUSS_SIGMA (gauss)
+    atom_density   heavy atoms per cubic Angstrom within ATOM_RADIUS of the
+                   sidechain center, counted over the atoms of the residue
+                   and of its sidechain neighbours in the list
+
+The sidechain direction used by HSE is CA -> sidechain center. Residues with
+no sidechain (glycine) use the direction away from their chain neighbours'
+CA, as in the HSE-alpha of Hamelryck (2005), or NaN at chain ends.
+
+An atom within ATOM_RADIUS of a sidechain center belongs to a residue whose
+own sidechain center is at most ATOM_RADIUS plus that residue's reach (the
+largest distance of its atoms from its sidechain center) away. The list
+radius is therefore the largest of the metric radii and ATOM_RADIUS plus the
+largest reach, so the pair list holds every residue whose atoms can count.
+
+Positions are the pdb_position strings of the residue table (1-based), so the
+table joins on the same key as the WCN table.
+'''
+
 # %% Initialize
-from Bio.PDB import PDBParser
-from Bio.PDB.DSSP import DSSP
-from matplotlib import pyplot as plt
+import numpy as np
 import pandas as pd
 
-p = PDBParser()
-
 file = './FBgn0000015/refprot/FBgn0000015.pdb'
 name = 'ADBD_DROME'
-structure = p.get_structure(name, file)
-model = structure[0]
 
+CN_CUTOFFS = [8, 10, 12, 14]
+HSE_RADIUS = 13
+GAUSS_SIGMA = 4
+ATOM_RADIUS = 10
+NEIGHBOR_CUTOFF = 16 # Largest distance counted by wcn_sc_<w>
+PAIR_BLOCK = 2**16 # Residue pairs expanded to atoms at once in atom_density
+
+WCN_WEIGHTS = {'inv_sq': lambda dist: 1/dist**2,
+               'inv': lambda dist: 1/dist,
+               'gauss': lambda dist: np.exp(-dist**2/(2*GAUSS_SIGMA**2))}
+
+def load_model(name = name, file = file):
+    from Bio.PDB import PDBParser
+
+    p = PDBParser()
+    structure = p.get_structure(name, file)
+    model = structure[0]
+    return model
+
+# %% Neighbour list
+def neighbor_list(coord_ca, coord_sc, cutoff = NEIGHBOR_CUTOFF):
+    '''
+    Returns the CA-CA and sidechain-sidechain pairs of N residues closer than
+    cutoff, as a dict of 'ca' and 'sc' entries (i, j, distance) with i < j.
+    Both point sets go in one KD-tree of 2N points and are searched with one
+    query; mixed CA-sidechain pairs are dropped.
+    '''
+    from scipy.spatial import cKDTree
+
+    n = len(coord_ca)
+    points = np.concatenate([coord_ca, coord_sc]).astype(np.float64)
+    pairs = cKDTree(points).query_pairs(cutoff, output_type = 'ndarray')
+    diff = points[pairs[:, 0]] - points[pairs[:, 1]]
+    dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+    output = {}
+    for label, is_sc in [('ca', False), ('sc', True)]:
+        keep = ((pairs[:, 0] >= n) == is_sc) & ((pairs[:, 1] >= n) == is_sc)
+        i, j = np.sort(pairs[keep] - is_sc*n, axis = 1).T
+        output[label] = (i, j, dist[keep])
+    return output
+
+def pair_sum(pairs, n, weights_i, weights_j = None):
+    '''
+    Sums weights over the pairs of every residue: pair (i, j) adds weights_i
+    to residue i and weights_j (by default the same) to residue j.
+    '''
+    i, j, dist = pairs
+    weights_j = weights_i if weights_j is None else weights_j
+    return np.bincount(i, weights = weights_i, minlength = n) \
+        + np.bincount(j, weights = weights_j, minlength = n)
+
+# %% Metrics
+def sidechain_direction(coord_ca, coord_sc, chain):
+    '''
+    Returns the (N,3) CA -> sidechain center vector of every residue. Where it
+    is zero, the direction away from the previous and next CA of the same
+    chain is used instead; residues at chain ends get NaN.
+    '''
+    coord_ca = coord_ca.astype(np.float64)
+    direction = coord_sc - coord_ca
+    missing = ~direction.any(axis = 1)
+
+    chain = np.asarray(chain, dtype = str)
+    inner = np.zeros(len(chain), dtype = bool)
+    inner[1:-1] = (chain[1:-1] == chain[:-2]) & (chain[1:-1] == chain[2:])
+    pseudo = np.full(coord_ca.shape, np.nan)
+    pseudo[1:-1] = 2*coord_ca[1:-1] - coord_ca[:-2] - coord_ca[2:]
+    pseudo[~inner] = np.nan
+
+    direction[missing] = pseudo[missing]
+    return direction
+
+def contact_numbers(pairs, n, cutoffs = CN_CUTOFFS):
+    '''
+    Returns {cutoff: CA contact number} from the CA pairs of neighbor_list.
+    '''
+    dist = pairs[2]
+    return {cutoff: pair_sum(pairs, n, (dist < cutoff).astype(float))
+            for cutoff in cutoffs}
+
+def half_sphere_exposure(pairs, coord_ca, direction, radius = HSE_RADIUS):
+    '''
+    Returns (up, down) CA counts within radius, split by the sign of the
+    projection of the CA -> CA vector on each residue's direction. Residues
+    with a NaN direction get NaN.
+    '''
+    i, j, dist = pairs
+    near = dist < radius
+    i, j = i[near], j[near]
+    diff = (coord_ca[j] - coord_ca[i]).astype(np.float64)
+    up_i = np.einsum('ij,ij->i', diff, direction[i]) > 0
+    up_j = np.einsum('ij,ij->i', -diff, direction[j]) > 0
+
+    n = len(coord_ca)
+    near_pairs = (i, j, dist[near])
+    up = pair_sum(near_pairs, n, up_i.astype(float), up_j.astype(float))
+    down = pair_sum(near_pairs, n, (~up_i).astype(float), (~up_j).astype(float))
+    undefined = np.isnan(direction).any(axis = 1)
+    up[undefined], down[undefined] = np.nan, np.nan
+    return up, down
+
+def weighted_wcn(pairs, n, weights = WCN_WEIGHTS, cutoff = NEIGHBOR_CUTOFF):
+    '''
+    Returns {name: WCN} from the sidechain pairs of neighbor_list closer than
+    cutoff, one entry per weighting function of distance.
+    '''
+    near = pairs[2] < cutoff
+    near_pairs = tuple(values[near] for values in pairs)
+    with np.errstate(divide = 'ignore'):
+        return {label: pair_sum(near_pairs, n, weight(near_pairs[2]))
+                for label, weight in weights.items()}
+
+def atom_reach(coord_sc, atom_coords, atom_residue):
+    '''
+    Returns the largest distance of every residue's atoms from its sidechain
+    center, 0 for residues without atoms.
+    '''
+    reach = np.zeros(len(coord_sc))
+    diff = atom_coords - coord_sc[atom_residue]
+    np.maximum.at(reach, atom_residue, np.sqrt(np.einsum('ij,ij->i', diff, diff)))
+    return reach
+
+def atom_density(pairs, coord_sc, atom_coords, atom_residue,
+                 radius = ATOM_RADIUS):
+    '''
+    Returns the number of atoms per cubic Angstrom within radius of every
+    sidechain center, from the sidechain pairs of neighbor_list. atom_residue
+    is the residue of every atom. The list must reach radius plus the
+    largest atom_reach. Each residue is paired with itself and both
+    directions of its pairs; pairs that cannot reach are dropped by the
+    triangle inequality, and the rest are expanded to the atoms of the
+    neighbour, PAIR_BLOCK pairs at a time.
+    '''
+    n = len(coord_sc)
+    order = np.argsort(atom_residue, kind = 'stable')
+    atom_coords, atom_residue = atom_coords[order], atom_residue[order]
+    n_atoms = np.bincount(atom_residue, minlength = n)
+    starts = np.cumsum(n_atoms) - n_atoms
+    reach = atom_reach(coord_sc, atom_coords, atom_residue)
+
+    i, j, dist = pairs
+    source = np.concatenate([np.arange(n), i, j])
+    target = np.concatenate([np.arange(n), j, i])
+    dist = np.concatenate([np.zeros(n), dist, dist])
+    near = dist <= radius + reach[target]
+    source, target = source[near], target[near]
+
+    counts = np.zeros(n)
+    for start in range(0, len(source), PAIR_BLOCK):
+        block_source = source[start:start + PAIR_BLOCK]
+        block_target = target[start:start + PAIR_BLOCK]
+        size = n_atoms[block_target]
+        offsets = np.cumsum(size) - size
+        atom = np.repeat(starts[block_target] - offsets, size) + np.arange(size.sum())
+        center = np.repeat(block_source, size)
+        diff = atom_coords[atom] - coord_sc[center]
+        inside = np.einsum('ij,ij->i', diff, diff) <= radius**2
+        counts += np.bincount(center[inside], minlength = n)
+
+    return counts/(4/3*np.pi*radius**3)
+
+# %% Packing table
+def calculate_packing(residues, atom_coords, atom_residue, min_plddt = None,
+                      cutoffs = CN_CUTOFFS, weights = WCN_WEIGHTS):
+    '''
+    Adds the packing metrics to a calc_wcn residue table, given the (M,3)
+    coordinates of its heavy atoms and the row of the residue table each
+    atom belongs to. As in calc_wcn.calculate_wcn, residues with pLDDT below
+    min_plddt are left out entirely, with their atoms: their metrics are NaN
+    and they are not neighbours of other residues.
+    '''
+    n = len(residues['pdb_position'])
+    keep = np.ones(n, dtype = bool)
+    if min_plddt is not None:
+        keep = residues['pLDDT'] >= min_plddt
+    coord_ca = residues['coord_ca'][keep]
+    coord_sc = residues['sidechain_center'][keep].astype(np.float64)
+    m = len(coord_ca)
+
+    # Atoms of kept residues, renumbered to the kept rows
+    atom_residue = np.asarray(atom_residue, dtype = np.int64)
+    atom_keep = keep[atom_residue]
+    atom_coords = np.asarray(atom_coords, dtype = np.float64).reshape(-1, 3)[atom_keep]
+    atom_residue = (np.cumsum(keep) - 1)[atom_residue[atom_keep]]
+
+    metrics = {}
+    if m > 0:
+        reach = atom_reach(coord_sc, atom_coords, atom_residue).max(initial = 0)
+        pairs = neighbor_list(coord_ca, coord_sc, max([NEIGHBOR_CUTOFF, HSE_RADIUS,
+                                                       ATOM_RADIUS + reach]
+                                                      + list(cutoffs)))
+        for cutoff, values in contact_numbers(pairs['ca'], m, cutoffs).items():
+            metrics['cn_' + str(cutoff)] = values
+        direction = sidechain_direction(coord_ca, coord_sc,
+                                        np.asarray(residues['chain'])[keep])
+        metrics['hse_up'], metrics['hse_down'] = half_sphere_exposure(pairs['ca'],
+                                                                      coord_ca, direction)
+        for label, values in weighted_wcn(pairs['sc'], m, weights).items():
+            metrics['wcn_sc_' + label] = values
+        metrics['atom_density'] = atom_density(pairs['sc'], coord_sc, atom_coords,
+                                               atom_residue)
+    else:
+        labels = ['cn_' + str(cutoff) for cutoff in cutoffs] + ['hse_up', 'hse_down'] \
+            + ['wcn_sc_' + label for label in weights] + ['atom_density']
+        metrics = {label: np.empty(0) for label in labels}
+
+    for label, values in metrics.items():
+        residues[label] = np.full(n, np.nan, dtype = np.float32)
+        residues[label][keep] = values
+
+    return residues
+
+def get_packing(name, file, min_plddt = None):
+    '''
+    Returns the residue table of a PDB file (optionally gzipped) with the
+    packing metrics added. The file is read once with pdb_reader; the heavy
+    atoms of its amino acid residues are used for atom_density.
+    '''
+    from Bio.PDB import is_aa
+    from calc_wcn import residues_from_atoms
+    from pdb_reader import read_atoms, residue_index
+
+    atoms = read_atoms(file)
+    residues = residues_from_atoms(atoms)
+
+    # Same residues, in the same order, as residues_from_atoms
+    amino = [resname for resname in np.unique(atoms['resname']) if is_aa(resname)]
+    keep = np.isin(atoms['resname'], amino)
+    atoms = {label: values[keep] for label, values in atoms.items()}
+    heavy = atoms['element'] != 'H'
+
+    return calculate_packing(residues, atoms['coord'][heavy],
+                             residue_index(atoms)[heavy], min_plddt)
+
+def make_packing_df(residues):
+    '''
+    Returns the packing metrics of a residue table as a dataframe keyed like
+    calc_wcn.make_wcn_df (pdb_aa, pdb_position, chain), with pLDDT and one
+    float32 column per metric.
+    '''
+    labels = ['pdb_aa', 'pdb_position', 'chain', 'pLDDT']
+    labels += [label for label in residues if label.startswith(('cn_', 'hse_', 'wcn_sc_'))
+               or label == 'atom_density']
+    return pd.DataFrame({label: residues[label] for label in labels})
+
+if __name__ == '__main__':
+    print(make_packing_df(get_packing(name, file)))
@@ -6,15 +6,32 @@ Created on Thu May  2 16:27:36 2024
 @author: alansu
 """
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
+import numpy as np
 import pandas as pd
-from pnps_calc import get_poly_vals
+from asym_mk import MK_LABELS, N_BINS, get_mk_arrays, mk_df
+from bootstrap import N_REPS, PNPS_SUMS, bootstrap_ratios, proteome_ratio
+from branch_subst import BRANCH_COUNT_LABELS, SUBST_COLS, add_branch_ratios, \
+    get_branch_arrays
+from column_store import write_columns
+from inventory import KIND_BITS, scan_inventory, select_genes
+from lineage import LINEAGE_LABELS, get_lineage_arrays, lineage_df, scan_lineages
+from manifest import gene_records, load_manifest, load_result, remove_result, \
+    same_content, save_manifest, save_result
+from pnps_calc import PNPS_LABELS, SPECIES_LABELS, add_ratios, count_pnps, \
+    get_poly_arrays, get_species_arrays, masked_poly_paths, pnps_df, poly_paths
 
 # Check files are there
-def file_check(dir_path = os.getcwd()):
+'''
+Returns one row per gene with a 1/0 flag for each important file, read from
+the inventory (see inventory.scan_inventory), which is scanned if not given.
+'''
+def file_check(dir_path = os.getcwd(), inventory = None, n_workers = 8):
     
-    fb_id = sorted([filename for filename in os.listdir(dir_path) if 'FBgn' in filename])
-    
-    frame = []
+    if inventory is None:
+        inventory = scan_inventory(dir_path, n_workers)
     
     labels = ['FBgn_id',
               'synonymous.Poly?',
@@ -23,82 +40,255 @@ def file_check(dir_path = os.getcwd()):
               'features?',
               'SLAC?',
               'pdb?']
+    kinds = ['synonymous.Poly', 'missense.Poly', 'codonStats', 'features', 'SLAC', 'pdb']
     
     # Checking all important files and outputting 1/0.
-    for entry in fb_id:
-        syn = int(os.path.isfile(dir_path + '/' + entry + '/' 
-                               + entry + '.synonymous.Poly.UniProt.bed'))
-        mis = int(os.path.isfile(dir_path + '/' + entry + '/' 
-                               + entry + '.missense.Poly.UniProt.bed'))
-        cstat = int(os.path.isfile(dir_path + '/' + entry + '/' 
-                               + entry + '.codonStats.UniProt.bed'))
-        features = int(os.path.isfile(dir_path + '/' + entry + '/' 
-                               + entry + '.features.UniProt.bed'))
-        dnds = int(os.path.isfile(dir_path + '/' + entry + '/' 
-                               + entry + '.SLAC.UniProt.bed'))
-        pdb = int(os.path.isfile(dir_path + '/' + entry + '/' + 'refprot' + '/'
-                               + entry + '.pdb'))
-        
-        frame.append([entry, syn, mis, cstat, features, dnds, pdb])
+    frame = [[entry] + [int(record['mask'] & KIND_BITS[kind] > 0) for kind in kinds]
+             for entry, record in inventory.items()]
     
     df = pd.DataFrame(frame, columns = labels)
     
     return df
     
-# Aggregate pnps:
-def aggregate_pnps(dir_path = os.getcwd()):
+# Run a per-gene task over genes
+'''
+Runs task(fb_id, dir_path) for each gene and returns the results in fb_ids
+order. If n_workers > 1 the tasks are run in a process pool and submitted in
+chunks of chunksize genes.
+'''
+def map_genes(task, fb_ids, dir_path, n_workers = 1, chunksize = 16):
     
-    frame = []
+    if n_workers > 1 and len(fb_ids) > 0:
+        with ProcessPoolExecutor(n_workers) as executor:
+            return list(executor.map(task, fb_ids, 
+                                     repeat(dir_path, len(fb_ids)),
+                                     chunksize = chunksize))
     
-    check_df = file_check(dir_path) # Generate file checking dataframe for all genes
-    check_df['pNpS_calc'] = 0 # Set indicator to 'uncalculated', so zero, by default
+    return [task(entry, dir_path) for entry in fb_ids]
+
+# Run a per-gene task, reusing results of unchanged genes
+'''
+Same as map_genes, but results are cached in manifest_dir under kind. A gene
+is recomputed only if the files returned by input_paths(fb_id, dir_path) have
+changed since its result was stored, see manifest.py. Results of genes no
+longer in fb_ids are removed.
+'''
+def update_genes(task, kind, input_paths, fb_ids, dir_path, manifest_dir,
+                 n_workers = 1, chunksize = 16):
     
+    manifest = load_manifest(manifest_dir)
+    old_records = manifest.get(kind, {})
     
-    for entry in check_df.FBgn_id:
-        
-        file_count = check_df.loc[check_df.FBgn_id == entry, 'synonymous.Poly?'].item() \
-            + check_df.loc[check_df.FBgn_id == entry, 'missense.Poly?'].item() \
-            + check_df.loc[check_df.FBgn_id == entry, 'codonStats?'].item()
-            
-        if file_count == 3:
-            entry_data = get_poly_vals(entry, dir_path)
-            if len(entry_data) > 0: # Adding an additional checker for empty files
-                check_df.loc[check_df.FBgn_id == entry, 'pNpS_calc'] = 1
-            frame += entry_data
-            
+    records = {}
+    results = {}
+    todo = []
+    for entry in fb_ids:
+        records[entry] = gene_records(input_paths(entry, dir_path), 
+                                      old_records.get(entry))
+        result = None
+        if same_content(records[entry], old_records.get(entry)):
+            result = load_result(manifest_dir, kind, entry)
+        if result is None:
+            todo.append(entry)
         else:
-            continue
+            results[entry] = result
     
-    # Calculate additional values and make df
+    for entry, result in zip(todo, map_genes(task, todo, dir_path, 
+                                             n_workers, chunksize)):
+        save_result(manifest_dir, kind, entry, result)
+        results[entry] = result
     
-    labels = ['UniProt_ID', 
-          'AA_pos', 
-          'Codon_index',
-          'Species_count',
-          'E[N]', 
-          'E[S]', 
-          'PN', 
-          'PS']
+    for entry in set(old_records) - set(fb_ids):
+        remove_result(manifest_dir, kind, entry)
     
-    df = pd.DataFrame(frame, columns = labels)
-    df = df.astype({'AA_pos': int,
-                    'Species_count': int,
-                    'E[N]': float, 
-                    'E[S]': float, 
-                    'PN': float,
-                    'PS': float})
+    manifest[kind] = records
+    save_manifest(manifest_dir, manifest)
     
-    df['pN'] = df['PN'] / df['E[N]']
-    df['pS'] = df['PS'] / df['E[S]']
-    df['pN/pS'] = df.pN / df.pS
+    return [results[entry] for entry in fb_ids]
+
+# Aggregate pnps:
+'''
+Genes are counted with get_poly_arrays, one task per gene, see map_genes. 
+Results come back in FBgn_id order either way, so the output does not depend
+on n_workers. If manifest_dir is given, only genes whose input files changed
+since the last run with the same manifest_dir are recounted. With
+exclude_masked, positions in each gene's mask.UniProt.bed are left out. With
+adjusted, PN and PS are weighted counts from the ADJ.Poly files, and genes
+without them are not counted.
+'''
+def aggregate_pnps(dir_path = os.getcwd(), n_workers = 1, chunksize = 16,
+                   manifest_dir = None, exclude_masked = False, adjusted = False):
+    
+    inventory = scan_inventory(dir_path)
+    check_df = file_check(dir_path, inventory) # Generate file checking dataframe for all genes
+    check_df['pNpS_calc'] = 0 # Set indicator to 'uncalculated', so zero, by default
+    
+    # Only genes with all three files are counted
+    kinds = ['synonymous.Poly', 'missense.Poly', 'codonStats']
+    if adjusted:
+        kinds = ['synonymous.ADJ.Poly', 'missense.ADJ.Poly', 'codonStats']
+    fb_ids = select_genes(inventory, kinds)
+    
+    task = partial(get_poly_arrays, exclude_masked = exclude_masked, 
+                   adjusted = adjusted)
+    input_paths = partial(masked_poly_paths if exclude_masked else poly_paths,
+                          adjusted = adjusted)
+    kind = 'pnps' + ('_adj' if adjusted else '') + ('_masked' if exclude_masked else '')
+    
+    if manifest_dir is None:
+        frame = map_genes(task, fb_ids, dir_path, n_workers, chunksize)
+    else:
+        frame = update_genes(task, kind, input_paths, fb_ids, dir_path,
+                             manifest_dir, n_workers, chunksize)
+    
+    # Adding an additional checker for empty files
+    calculated = [entry for entry, columns in zip(fb_ids, frame) 
+                  if len(columns['AA_pos']) > 0]
+    check_df.loc[check_df.FBgn_id.isin(calculated), 'pNpS_calc'] = 1
+    
+    # Calculate additional values and make df
+    if len(frame) == 0:
+        frame = [count_pnps(pd.DataFrame(), pd.DataFrame(), pd.DataFrame())]
+        
+    columns = {label : np.concatenate([entry[label] for entry in frame])
+               for label in PNPS_LABELS}
+    df = pnps_df(columns)
     
     return df, check_df
 
+# Aggregate pnps with bootstrap intervals:
+'''
+Per-gene pN/pS (ratio of the summed PN, E[N], PS, E[S]) with bootstrap
+intervals over residues, and the proteome-wide pN/pS with an interval over
+genes as (ratio, low, high), see bootstrap.py. Other arguments are passed to
+aggregate_pnps.
+'''
+def aggregate_pnps_ci(dir_path = os.getcwd(), n_reps = N_REPS, seed = 0, alpha = 0.05,
+                      n_workers = 1, **kwargs):
+    
+    df, check_df = aggregate_pnps(dir_path, n_workers, **kwargs)
+    gene_df = bootstrap_ratios(df, 'UniProt_ID', PNPS_SUMS, n_reps, seed, alpha,
+                               n_workers)
+    
+    return gene_df, proteome_ratio(gene_df, PNPS_SUMS, n_reps, seed, alpha)
+
+# Aggregate per-species pnps:
+'''
+Weighted PN, PS, E[N] and E[S] per (gene, species, position) from the ADJ.Poly
+and codonStats files, see pnps_calc.count_species_pnps. Only genes with all
+three files are counted.
+'''
+def aggregate_species_pnps(dir_path = os.getcwd(), n_workers = 1, chunksize = 16,
+                           exclude_masked = False):
+    
+    fb_ids = select_genes(scan_inventory(dir_path), 
+                          ['synonymous.ADJ.Poly', 'missense.ADJ.Poly', 'codonStats'])
+    
+    task = partial(get_species_arrays, exclude_masked = exclude_masked)
+    frame = map_genes(task, fb_ids, dir_path, n_workers, chunksize)
+    
+    columns = {label : np.concatenate([entry[label] for entry in frame] 
+                                      + [np.array([])])
+               for label in SPECIES_LABELS}
+    df = pd.DataFrame(columns)
+    df = df.astype({'AA_pos': int, 'Species': str, 'UniProt_ID': str})
+    
+    return add_ratios(df)
+
+# Aggregate pnps and dnds per lineage:
+'''
+pN/pS and dN/dS of every group of every gene ('all' for the top-level files
+and each group/<clade> directory), in one long table indexed by
+(FBgn_id, Group, AA_pos). The gene tree is listed once by
+inventory.scan_inventory and each gene is one task, so all groups are counted
+in a single pass. See lineage.get_lineage_arrays for exclude_masked and
+with_features.
+'''
+def aggregate_lineages(dir_path = os.getcwd(), n_workers = 1, chunksize = 16,
+                       exclude_masked = False, with_features = False):
+    
+    inventory = scan_inventory(dir_path)
+    entries = list(scan_lineages(dir_path, inventory).items())
+    task = partial(get_lineage_arrays, exclude_masked = exclude_masked,
+                   with_features = with_features)
+    frame = map_genes(task, entries, dir_path, n_workers, chunksize)
+    
+    labels = LINEAGE_LABELS + (['Features'] if with_features else [])
+    columns = {label : np.concatenate([entry[label] for entry in frame] 
+                                      + [np.array([])])
+               for label in labels}
+    
+    return lineage_df(columns)
+
+# Aggregate per-branch substitutions:
+'''
+Substitutions and per-branch counts from every gene's
+macse/branch/variant_inRefProt.tsv, one task per gene, see map_genes and
+branch_subst.count_branches. Returns the long substitution table, indexed by
+(FBgn_id, AA_pos, Branch), and the per-branch table with dN, dS and dN/dS,
+indexed by (FBgn_id, Branch).
+'''
+def aggregate_branches(dir_path = os.getcwd(), n_workers = 1, chunksize = 16,
+                       exclude_masked = False):
+    
+    fb_ids = select_genes(scan_inventory(dir_path), ['branch.variant'])
+    
+    task = partial(get_branch_arrays, exclude_masked = exclude_masked)
+    frame = map_genes(task, fb_ids, dir_path, n_workers, chunksize)
+    
+    tables = []
+    for i, labels in enumerate([SUBST_COLS + ['Species'], BRANCH_COUNT_LABELS]):
+        columns = {label : np.concatenate([entry[i][label] for entry in frame] 
+                                          + [np.array([])])
+                   for label in labels}
+        columns['FBgn_id'] = np.repeat(fb_ids, [len(entry[i]['Branch']) 
+                                                for entry in frame]).astype(str)
+        tables.append(pd.DataFrame(columns))
+    
+    subst_df, branch_df = tables
+    subst_df = subst_df.astype({'AA_pos': int, 'N': float, 'S': float})
+    subst_df = subst_df.set_index(['FBgn_id', 'AA_pos', 'Branch'])
+    branch_df = branch_df.astype({'Positions': int})
+    branch_df = add_branch_ratios(branch_df).set_index(['FBgn_id', 'Branch'])
+    
+    return subst_df, branch_df
+
+# Aggregate asymMK residue tables:
+'''
+Per-residue divergence (SLAC DN, DS) and AF-binned polymorphism counts of
+every gene with SLAC and both Poly files, one task per gene, see
+asym_mk.count_mk. Group the result with asym_mk.subset_mk.
+'''
+def aggregate_mk(dir_path = os.getcwd(), n_workers = 1, chunksize = 16,
+                 n_bins = N_BINS):
+    
+    fb_ids = select_genes(scan_inventory(dir_path), 
+                          ['SLAC', 'synonymous.Poly', 'missense.Poly'])
+    
+    task = partial(get_mk_arrays, n_bins = n_bins)
+    frame = map_genes(task, fb_ids, dir_path, n_workers, chunksize)
+    
+    columns = {label : np.concatenate([entry[label] for entry in frame])
+               if len(frame) > 0 else np.zeros((0, n_bins) if label in ['PN', 'PS'] else 0)
+               for label in MK_LABELS}
+    columns['FBgn_id'] = np.repeat(fb_ids, [len(entry['AA_pos']) for entry in frame])
+    
+    return mk_df(columns)
+
 # Run and save pnps and checker dataframes as csv.
-def test():
+'''
+With store = True they are also written as column stores keyed by UniProt_ID
+and FBgn_id, so one gene or one column is loaded with column_store.read_gene
+or read_column without parsing text. A store left by an earlier run is
+replaced.
+'''
+def test(store = False):
     df, check_df = aggregate_pnps()
     df.to_csv('pNpS_aggegate.csv')
     check_df.to_csv('file_checker.csv')
+    if store:
+        write_columns('pNpS_aggregate', df, key = 'UniProt_ID')
+        write_columns('file_checker', check_df, key = 'FBgn_id')
     
 if __name__ == '__main__':
     pass
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Asymptotic McDonald-Kreitman test (Messer & Petrov 2013, Haller & Messer
+2017) for arbitrary sets of residues. Divergence is the per-position N and S
+substitution counts of the SLAC files (the DN and DS columns); polymorphism is
+the missense and synonymous Poly variants binned by their AF INFO field. Each
+gene is reduced once to a residue table with DN, DS and per-bin PN and PS
+counts, so alpha can be recomputed for any grouping of residues (e.g. buried
+vs. exposed, helix vs. coil) without rerunning the external tool that writes
+the *.asymMK.UniProt.stats files.
+
+For each group, alpha(x) = 1 - (Ds/Dn)(Pn(x)/Ps(x)) is computed in every
+frequency bin x and fitted with alpha(x) = a + b*exp(-c*x) over the bins in
+x_range; the asymptotic alpha is the fit at x = 1. c is kept positive, so
+the fit levels off rather than growing without bound when extrapolated; small
+c approaches a linear fit. For a fixed c the model is
+linear in a and b, so all groups are fitted at once: the least-squares a and
+b and the error are computed in closed form for every (group, c) on a grid
+of c, and the best c is kept for each group. A best c at either end of the
+grid is not a fitted optimum (at the small end a and b grow large and cancel,
+at the large end the curve is a step), so such fits are flagged with
+c_at_bound and get no asymptotic alpha, as asymptoticMK rejects them.
+
+AF is the frequency of the ALT allele. REF and ALT are the same allele in
+these files, so polarity cannot be checked per variant and AF is used as the
+derived allele frequency. Variants with missing AF, or AF of 0 or 1, are not
+binned. Positions are 0-based like the Poly files; SLAC rows are matched by
+their BED start.
+'''
+
+import numpy as np
+import pandas as pd
+from bed_parser import read_slac_bed, read_var_bed
+from pnps_calc import poly_paths
+
+N_BINS = 20
+X_RANGE = (0.1, 0.9)
+C_GRID = np.logspace(-2, 2.5, 181)
+
+MK_LABELS = ['AA_pos', 'DN', 'DS', 'PN', 'PS']
+
+# %% Per-gene residue table
+def af_bins(af, n_bins = N_BINS):
+    '''
+    Returns the frequency bin of every AF, 0 to n_bins - 1, and -1 for
+    missing AF or AF outside (0, 1).
+    '''
+    af = np.asarray(af, dtype = float)
+    polymorphic = (af > 0) & (af < 1)
+    bins = np.full(len(af), -1, dtype = np.int64)
+    bins[polymorphic] = np.minimum((af[polymorphic]*n_bins).astype(np.int64), n_bins - 1)
+    return bins
+
+def count_mk(slac_df, mis_df, syn_df, n_bins = N_BINS):
+    '''
+    Returns the MK_LABELS arrays of one gene at the union of the SLAC and
+    Poly positions: DN and DS, and PN and PS as (positions, n_bins) matrices
+    of variant counts per frequency bin, each filled with one bincount over
+    position*n_bins + bin.
+    '''
+    slac_pos = slac_df.Unknown.to_numpy(dtype = np.int64)
+    var_pos = [df.AA_pos.to_numpy(dtype = np.int64) for df in [mis_df, syn_df]]
+    positions = np.unique(np.concatenate([slac_pos] + var_pos))
+
+    output = {'AA_pos': positions}
+    index = np.searchsorted(positions, slac_pos)
+    for label in ['DN', 'DS']:
+        output[label] = np.bincount(index, minlength = len(positions),
+                                    weights = slac_df[label].to_numpy(dtype = float))
+
+    for label, df, pos in zip(['PN', 'PS'], [mis_df, syn_df], var_pos):
+        bins = af_bins(df.AF.to_numpy(dtype = float), n_bins)
+        binned = bins >= 0
+        key = np.searchsorted(positions, pos[binned])*n_bins + bins[binned]
+        output[label] = np.bincount(key, minlength = len(positions)*n_bins) \
+            .reshape(len(positions), n_bins)
+
+    return output
+
+def get_mk_arrays(fb_id, dir_path, n_bins = N_BINS):
+    '''
+    Per-gene task for aggregate.aggregate_mk: reads the SLAC file and the AF
+    field of the missense and synonymous Poly files and counts them with
+    count_mk.
+    '''
+    syn_path, mis_path = poly_paths(fb_id, dir_path)[:2]
+    slac_path = dir_path + '/' + fb_id + '/' + fb_id + '.SLAC.UniProt.bed'
+
+    slac_df = read_slac_bed(slac_path, ['Unknown', 'DN', 'DS'])
+    mis_df, syn_df = [read_var_bed(path, ['AA_pos'], info_keys = ['AF'],
+                                   info_dtypes = {'AF': 'float64'})
+                      for path in [mis_path, syn_path]]
+
+    return count_mk(slac_df, mis_df, syn_df, n_bins)
+
+def mk_df(columns):
+    '''
+    Makes the residue table from concatenated MK_LABELS arrays (plus FBgn_id),
+    with one PN_i and PS_i column per frequency bin i.
+    '''
+    df = pd.DataFrame({label: columns[label] for label in ['FBgn_id', 'AA_pos', 'DN', 'DS']})
+    for label in ['PN', 'PS']:
+        counts = columns[label]
+        for i in range(counts.shape[1]):
+            df[label + '_' + str(i)] = counts[:, i]
+    return df.astype({'FBgn_id': str, 'AA_pos': int})
+
+def bin_columns(df, label):
+    '''
+    Returns the per-bin columns of label ('PN' or 'PS') in bin order.
+    '''
+    columns = [column for column in df.columns if column.startswith(label + '_')]
+    return sorted(columns, key = lambda column: int(column[len(label) + 1:]))
+
+# %% Asymptotic fit
+def grid_fit(w, y, x, c):
+    '''
+    Least-squares fit of y = a + b*exp(-c*x) with bin weights w (G, n_bins)
+    for every c of a (1 or G, K) grid, in closed form since the model is
+    linear in a and b for a fixed c. The basis is scaled to a maximum of 1
+    for conditioning. Returns the a, b, c and error of the best c of every
+    group.
+    '''
+    f = np.exp(-c[:, :, None]*x)
+    f /= f.max(axis = 2, keepdims = True)
+    Sw = w.sum(axis = 1)[:, None]
+    Sy = y.sum(axis = 1)[:, None]
+    Syy = (y*y).sum(axis = 1)[:, None]
+    if len(c) == 1:
+        Sf, Sff, Sfy = w @ f[0].T, w @ (f[0]*f[0]).T, y @ f[0].T
+    else:
+        Sf = np.einsum('gb,gkb->gk', w, f)
+        Sff = np.einsum('gb,gkb->gk', w, f*f)
+        Sfy = np.einsum('gb,gkb->gk', y, f)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        b = (Sw*Sfy - Sf*Sy) / (Sw*Sff - Sf*Sf)
+        a = (Sy - b*Sf) / Sw
+    sse = Syy - a*Sy - b*Sfy
+    sse[~np.isfinite(sse)] = np.inf
+
+    best = np.argmin(sse, axis = 1)
+    rows = np.arange(len(w))
+    c_best = np.broadcast_to(c, sse.shape)[rows, best]
+    b_best = b[rows, best] / np.exp(-np.outer(c_best, x)).max(axis = 1)
+    return a[rows, best], b_best, c_best, sse[rows, best]
+
+def fit_asymptotic(Dn, Ds, Pn, Ps, x_range = X_RANGE, c_grid = C_GRID):
+    '''
+    Fits alpha(x) = a + b*exp(-c*x) for G groups at once. Dn and Ds are (G,)
+    divergence sums, Pn and Ps (G, n_bins) polymorphism counts. Bins are
+    represented by their midpoints; only bins in x_range with Ps > 0 are
+    used, and groups with fewer than 3 such bins get NaN. c is searched on
+    c_grid for all groups together and then refined per group on a finer
+    grid around the best value, within the range of c_grid. Returns a dict
+    of (G,) arrays: alpha (the standard MK alpha over all bins), the
+    asymptotic alpha a + b*exp(-c), a, b, c, and c_at_bound, True where the
+    best c is an end of c_grid; the asymptotic alpha of those fits is NaN.
+    '''
+    Dn, Ds = np.asarray(Dn, dtype = float), np.asarray(Ds, dtype = float)
+    Pn, Ps = np.asarray(Pn, dtype = float), np.asarray(Ps, dtype = float)
+    n_bins = Pn.shape[1]
+    x = (np.arange(n_bins) + 0.5) / n_bins
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        alpha = 1 - (Ds / Dn)*(Pn.sum(axis = 1) / Ps.sum(axis = 1))
+        alpha_x = 1 - (Ds / Dn)[:, None]*(Pn / Ps)
+    used = (x >= x_range[0]) & (x <= x_range[1]) & np.isfinite(alpha_x)
+    w = used.astype(float)
+    y = np.where(used, alpha_x, 0)
+
+    # Coarse grid shared by all groups, then a finer grid around each group's c
+    a, b, c, sse = grid_fit(w, y, x, c_grid[None, :])
+    step = np.log(c_grid[1] / c_grid[0]) if len(c_grid) > 1 else 0
+    fine = c[:, None]*np.exp(np.linspace(-step, step, 21))[None, :]
+    fine = np.clip(fine, c_grid.min(), c_grid.max())
+    a, b, c, sse = grid_fit(w, y, x, fine)
+
+    fitted = w.sum(axis = 1) >= 3
+    at_bound = fitted & ((c <= c_grid.min()) | (c >= c_grid.max()))
+    output = {'alpha': alpha,
+              'alpha_asymptotic': np.where(fitted & ~at_bound, a + b*np.exp(-c), np.nan),
+              'a': np.where(fitted, a, np.nan),
+              'b': np.where(fitted, b, np.nan),
+              'c': np.where(fitted, c, np.nan),
+              'c_at_bound': at_bound}
+    return output
+
+def subset_mk(df, by, x_range = X_RANGE, c_grid = C_GRID):
+    '''
+    Asymptotic MK for every group of residues of a residue table (see
+    mk_df), e.g. by = ['FBgn_id', 'Sec_Struct'] for per-gene secondary
+    structure classes or by = 'RASA_bin' across all genes, with the class
+    columns joined on. Rows with a missing class are left out. Divergence
+    and per-bin polymorphism are summed per group with one bincount per
+    column, then all groups are fitted together with fit_asymptotic.
+    '''
+    by = [by] if isinstance(by, str) else list(by)
+    keys = df[by].astype(str).where(df[by].notna().all(axis = 1))
+    keys = keys.dropna()
+    rows = df.loc[keys.index]
+    code, groups = pd.MultiIndex.from_frame(keys).factorize(sort = True)
+
+    sums = {label: np.bincount(code, weights = rows[label].to_numpy(dtype = float),
+                               minlength = len(groups))
+            for label in ['DN', 'DS']}
+    for label in ['PN', 'PS']:
+        sums[label] = np.column_stack([np.bincount(code, minlength = len(groups),
+                                                   weights = rows[column].to_numpy(dtype = float))
+                                       for column in bin_columns(df, label)])
+
+    output = groups.to_frame(index = False)
+    output.columns = by
+    output['n_pos'] = np.bincount(code, minlength = len(groups))
+    output['Dn'], output['Ds'] = sums['DN'], sums['DS']
+    output['Pn'], output['Ps'] = sums['PN'].sum(axis = 1), sums['PS'].sum(axis = 1)
+    fit = fit_asymptotic(sums['DN'], sums['DS'], sums['PN'], sums['PS'],
+                         x_range, c_grid)
+    for label, values in fit.items():
+        output[label] = values
+
+    return output
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Shared parser for the {FbID}.*.UniProt.bed files. Files are read in chunks of
+lines and handed to the pandas C parser, so fields go straight into typed
+columns instead of lists of strings. Payloads of the form codon_N:a,b,c are
+split into their own columns, key=value; INFO payloads can be unpacked into
+typed columns for selected keys, and usecols restricts which columns are
+materialized at all.
+'''
+
+import io
+import re
+from functools import lru_cache
+from itertools import islice
+import numpy as np
+import pandas as pd
+
+CHUNKSIZE = 100000 # Lines per chunk
+
+# Columns and types of each file format. Payload fields follow the BED fields.
+VAR_LABELS = ['UniProt_ID',
+              'AA_pos',
+              'AA_pos_end',
+              'Data']
+
+VAR_DTYPES = {'UniProt_ID': str,
+              'AA_pos': 'int64',
+              'AA_pos_end': 'int64',
+              'Data': str}
+
+# ADJ.Poly files carry a per-variant weight before the INFO payload
+ADJ_VAR_LABELS = ['UniProt_ID',
+                  'AA_pos',
+                  'AA_pos_end',
+                  'Weight',
+                  'Data']
+
+ADJ_VAR_DTYPES = {'UniProt_ID': str,
+                  'AA_pos': 'int64',
+                  'AA_pos_end': 'int64',
+                  'Weight': 'float64',
+                  'Data': str}
+
+# INFO keys of ADJ.Poly files: ancestral/derived allele counts and species
+ADJ_INFO_KEYS = ['ANC', 'DER', 'SP']
+
+ADJ_INFO_DTYPES = {'ANC': 'Int64',
+                   'DER': 'Int64',
+                   'SP': str}
+
+CSTAT_LABELS = ['UniProt_ID',
+                'AA_pos',
+                'AA_pos_end',
+                'Species',
+                'Codon_index',
+                'AA',
+                'Codon',
+                'E[N]',
+                'E[S]']
+
+CSTAT_DTYPES = {'UniProt_ID': str,
+                'AA_pos': 'int64',
+                'AA_pos_end': 'int64',
+                'Species': str,
+                'Codon_index': str,
+                'AA': str,
+                'Codon': str,
+                'E[N]': 'float64',
+                'E[S]': 'float64'}
+
+SLAC_LABELS = ['UniProt_ID',
+               'Unknown',
+               'AA_pos',
+               'Codon_pos',
+               'E[S]',
+               'E[N]',
+               'DS',
+               'DN',
+               '8',
+               '9',
+               '10',
+               '11',
+               '12',
+               '13',
+               '14']
+
+SLAC_DTYPES = {'UniProt_ID': str,
+               'Unknown': 'int64',
+               'AA_pos': 'int64',
+               'Codon_pos': str}
+SLAC_DTYPES.update({label: 'float64' for label in SLAC_LABELS[4:]})
+
+# macse/branch/*_inRefProt.tsv files: one substitution per (position, branch),
+# with the branch's amino acid and codon and its N and S substitution counts
+BRANCH_LABELS = ['Gene',
+                 'AA_pos',
+                 'Codon_index',
+                 'Branch',
+                 'AA',
+                 'Codon',
+                 'N',
+                 'S']
+
+BRANCH_DTYPES = {'Gene': str,
+                 'AA_pos': 'int64',
+                 'Codon_index': str,
+                 'Branch': str,
+                 'AA': str,
+                 'Codon': str,
+                 'N': 'float64',
+                 'S': 'float64'}
+
+# Interval files: 0-based, end-exclusive amino acid ranges
+MASK_LABELS = ['UniProt_ID',
+               'AA_start',
+               'AA_end']
+
+MASK_DTYPES = {'UniProt_ID': str,
+               'AA_start': 'int64',
+               'AA_end': 'int64'}
+
+FEATURE_LABELS = ['UniProt_ID',
+                  'AA_start',
+                  'AA_end',
+                  'Feature_type',
+                  'Description']
+
+FEATURE_DTYPES = {'UniProt_ID': str,
+                  'AA_start': 'Int64',
+                  'AA_end': 'Int64',
+                  'Feature_type': str,
+                  'Description': str}
+
+# INFO keys of allPoly files used for per-species counts. ANN_effect is the
+# consequence of the first ANN annotation, e.g. missense_variant
+ALLPOLY_INFO_KEYS = ['SP', 'AF', 'AN', 'ANN_effect']
+
+ALLPOLY_INFO_DTYPES = {'SP': str,
+                       'AF': 'float64',
+                       'AN': 'Int64',
+                       'ANN_effect': str}
+
+# Fields derived from the value of an INFO key: (key, pattern of the value)
+INFO_FIELDS = {'ANN_effect': ('ANN', re.compile(r'[^|,]*\|([^|,]*)'))}
+
+# Payload separators are turned into tabs before the C parser sees the text
+PAYLOAD_TABLE = str.maketrans({':': '\t', ',': '\t'})
+
+# %% Chunked reader
+def iter_bed(file_path, labels, dtypes, usecols = None, split_payload = False,
+             chunksize = CHUNKSIZE):
+    '''
+    Yields a typed dataframe for every chunksize lines of a tab-separated file.
+    If split_payload is True, ':' and ',' in each line are treated as field
+    separators so a trailing codon_N:a,b,c payload becomes separate columns.
+    Only the columns in usecols (all labels by default) are kept.
+    '''
+    usecols = labels if usecols is None else usecols
+    dtype = {label: dtypes[label] for label in usecols if label in dtypes}
+
+    with open(file_path) as read:
+        while True:
+            lines = list(islice(read, chunksize))
+            if len(lines) == 0:
+                break
+            # Blank lines (e.g. at the end of features files) are skipped
+            lines = [line for line in lines if line.strip('\r\n') != '']
+            if len(lines) == 0:
+                continue
+            text = ''.join(lines)
+            if split_payload:
+                text = text.translate(PAYLOAD_TABLE)
+
+            # In case of missing data, a line is short of separators. Tabs are
+            # counted per line by assigning each tab to the next newline.
+            raw = np.frombuffer(text.encode(), dtype = np.uint8)
+            line_of_tab = np.searchsorted(np.flatnonzero(raw == 10),
+                                          np.flatnonzero(raw == 9))
+            n_tabs = np.bincount(line_of_tab, minlength = len(lines))
+            bad = np.flatnonzero(n_tabs != len(labels) - 1)
+            if len(bad) > 0:
+                raise ValueError('Missing data in ' + file_path + ': '
+                                 + repr(lines[bad[0]][:80]))
+
+            df = pd.read_csv(io.StringIO(text),
+                             sep = '\t',
+                             header = None,
+                             names = labels,
+                             usecols = usecols,
+                             dtype = dtype,
+                             float_precision = 'round_trip')
+
+            yield df[list(usecols)]
+
+# %% Whole file reader
+def read_bed(file_path, labels, dtypes, usecols = None, split_payload = False,
+             chunksize = CHUNKSIZE):
+    '''
+    Reads a whole file with iter_bed and returns a single dataframe. Empty files
+    return an empty dataframe with the same columns and types.
+    '''
+    usecols = labels if usecols is None else usecols
+    frame = list(iter_bed(file_path, labels, dtypes, usecols, split_payload,
+                          chunksize))
+
+    if len(frame) == 0:
+        return pd.DataFrame({label: pd.Series(dtype = dtypes.get(label, str))
+                             for label in usecols})
+
+    return pd.concat(frame, ignore_index = True)
+
+# %% INFO payloads
+@lru_cache(maxsize = None)
+def info_scanner(keys):
+    '''
+    Returns a compiled pattern matching ';key=value' for any of the INFO keys
+    read by the fields in keys (a tuple). The matched key is the group index
+    of the match, see scan_info.
+    '''
+    info_keys = list(dict.fromkeys(INFO_FIELDS.get(key, (key,))[0] for key in keys))
+    pattern = ';(?:' + '|'.join(re.escape(key) + '=([^;]*)' for key in info_keys) + ')'
+    return re.compile(pattern), info_keys
+
+def scan_info(info, keys):
+    '''
+    Returns {field: value} for the fields in keys (a tuple) of one INFO
+    string. The line is scanned once for all keys together; the rest of the
+    payload is never split. Only the first occurrence of a key is kept.
+    '''
+    scanner, info_keys = info_scanner(keys)
+    values = {}
+    for match in scanner.finditer(';' + info):
+        values.setdefault(info_keys[match.lastindex - 1], match.group(match.lastindex))
+
+    for key in keys:
+        if key in INFO_FIELDS:
+            info_key, pattern = INFO_FIELDS[key]
+            match = pattern.match(values.get(info_key, ''))
+            values[key] = None if match is None else match.group(1)
+    return values
+
+def parse_info(info, keys, dtypes = None):
+    '''
+    Extracts the values of the given keys from a series of key=value; INFO
+    strings and returns them as a dataframe with one column per key. Besides
+    plain INFO keys, keys can be fields derived from one (see INFO_FIELDS).
+    Keys that are absent or empty in a line are NaN. Values are cast with
+    dtypes, if given, and kept as strings otherwise.
+    '''
+    dtypes = {} if dtypes is None else dtypes
+    keys = tuple(keys)
+
+    rows = [scan_info(line, keys) for line in info.tolist()]
+    df = pd.DataFrame.from_records(rows, columns = list(keys), index = info.index)
+    columns = {}
+    for key in keys:
+        values = df[key].astype(str).mask(df[key].isna() | (df[key] == ''))
+        if key in dtypes:
+            values = values.astype(dtypes[key])
+        columns[key] = values
+
+    return pd.DataFrame(columns, index = info.index)
+
+# %% Format readers
+def read_info_bed(file_path, labels, dtypes, usecols = None, info_keys = None,
+                  info_dtypes = None, chunksize = CHUNKSIZE):
+    '''
+    Reads a BED file whose last column is a key=value; INFO payload. If
+    info_keys is given, those keys are unpacked from the payload into extra
+    columns and the raw Data column is dropped unless it is in usecols.
+    '''
+    usecols = labels if usecols is None else usecols
+    if info_keys is None:
+        return read_bed(file_path, labels, dtypes, usecols,
+                        chunksize = chunksize)
+
+    read_cols = [label for label in labels
+                 if label in usecols or label == 'Data']
+    frame = []
+    for df in iter_bed(file_path, labels, dtypes, read_cols,
+                       chunksize = chunksize):
+        info = parse_info(df['Data'], info_keys, info_dtypes)
+        frame.append(pd.concat([df[list(usecols)], info], axis = 1))
+
+    if len(frame) == 0:
+        empty = read_bed(file_path, labels, dtypes, usecols)
+        info = parse_info(pd.Series([], dtype = str), info_keys, info_dtypes)
+        return pd.concat([empty, info], axis = 1)
+
+    return pd.concat(frame, ignore_index = True)
+
+def read_var_bed(file_path, usecols = None, info_keys = None, info_dtypes = None,
+                 chunksize = CHUNKSIZE):
+    '''
+    Reads a {FbID}.missense/synonymous.Poly.UniProt.bed file, see read_info_bed.
+    '''
+    return read_info_bed(file_path, VAR_LABELS, VAR_DTYPES, usecols, info_keys,
+                         info_dtypes, chunksize)
+
+def read_adj_var_bed(file_path, usecols = None, info_keys = ADJ_INFO_KEYS,
+                     info_dtypes = ADJ_INFO_DTYPES, chunksize = CHUNKSIZE):
+    '''
+    Reads a {FbID}.missense/synonymous.ADJ.Poly.UniProt.bed file with the
+    variant Weight column. By default the ANC and DER allele counts and the
+    SP species are unpacked from INFO; pass info_keys = None to skip INFO
+    parsing when only positions and weights are needed.
+    '''
+    return read_info_bed(file_path, ADJ_VAR_LABELS, ADJ_VAR_DTYPES, usecols,
+                         info_keys, info_dtypes, chunksize)
+
+def read_allpoly_bed(file_path, usecols = None, info_keys = ALLPOLY_INFO_KEYS,
+                     info_dtypes = ALLPOLY_INFO_DTYPES, chunksize = CHUNKSIZE):
+    '''
+    Reads a {FbID}.allPoly.UniProt.bed file. By default only the SP species,
+    AF and AN allele frequency and count, and the first ANN consequence are
+    taken from its long INFO payload.
+    '''
+    return read_info_bed(file_path, VAR_LABELS, VAR_DTYPES, usecols, info_keys,
+                         info_dtypes, chunksize)
+
+def read_cstat_bed(file_path, usecols = None, chunksize = CHUNKSIZE):
+    '''
+    Reads a {FbID}.codonStats.UniProt.bed file, splitting the codon_N:AA,Codon,
+    E[N],E[S] payload into columns.
+    '''
+    return read_bed(file_path, CSTAT_LABELS, CSTAT_DTYPES, usecols,
+                    split_payload = True, chunksize = chunksize)
+
+def read_slac_bed(file_path, usecols = None, chunksize = CHUNKSIZE):
+    '''
+    Reads a {FbID}.SLAC.UniProt.bed file, splitting the codon_N:... payload of
+    SLAC statistics into columns.
+    '''
+    return read_bed(file_path, SLAC_LABELS, SLAC_DTYPES, usecols,
+                    split_payload = True, chunksize = chunksize)
+
+def read_branch_tsv(file_path, usecols = None, chunksize = CHUNKSIZE):
+    '''
+    Reads a macse/branch/variant_inRefProt.tsv or nonsynonymous_inRefProt.tsv
+    file, splitting the codon-N,branch,AA,codon,N,S payload into columns.
+    '''
+    return read_bed(file_path, BRANCH_LABELS, BRANCH_DTYPES, usecols,
+                    split_payload = True, chunksize = chunksize)
+
+def read_mask_bed(file_path, usecols = None, chunksize = CHUNKSIZE):
+    '''
+    Reads a {FbID}.mask.UniProt.bed file of masked amino acid ranges.
+    '''
+    return read_bed(file_path, MASK_LABELS, MASK_DTYPES, usecols,
+                    chunksize = chunksize)
+
+def read_features_bed(file_path, usecols = None, chunksize = CHUNKSIZE):
+    '''
+    Reads a {FbID}.features.UniProt.bed file of UniProt features. Genes
+    without features have a single placeholder line (start -1, no end), which
+    is dropped. Features without a description get an empty string.
+    '''
+    df = read_bed(file_path, FEATURE_LABELS, FEATURE_DTYPES, usecols,
+                  chunksize = chunksize)
+    if 'AA_end' in df:
+        df = df[df.AA_end.notna()].reset_index(drop = True)
+    df = df.astype({label: 'int64' for label in ['AA_start', 'AA_end'] 
+                    if label in df})
+    if 'Description' in df:
+        df['Description'] = df['Description'].fillna('')
+    return df
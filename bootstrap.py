@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Bootstrap confidence intervals for ratio-of-sums statistics (pN/pS, dN/dS)
+and for correlations of per-residue values. Resampled indices are drawn as
+one integer matrix of shape (replicates, residues), and the statistic of
+every replicate is computed at once with NumPy, with no Python loop over
+replicates.
+
+Per-gene intervals resample the residues (codons) of each gene. Genes are
+processed in chunks that keep the index matrix under max_bytes, and each
+chunk is drawn from a generator seeded from (seed, first gene of the chunk),
+so results depend only on seed and max_bytes, not on n_workers. Proteome
+intervals resample whole genes. Intervals are percentile intervals.
+'''
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+PNPS_SUMS = ['PN', 'E[N]', 'PS', 'E[S]']
+DNDS_SUMS = ['DN', 'E[N]', 'DS', 'E[S]']
+
+N_REPS = 1000
+MAX_BYTES = 2**28 # Working memory of the replicates of one chunk
+
+# Peak number of (replicates, residues) arrays alive in corr_replicates
+CORR_ARRAYS = {'pearson': 4, 'spearman': 11}
+
+# %% Replicate statistics
+def ratio_of_sums(sums):
+    '''
+    Returns (x0/x1)/(x2/x3) from sums of the four columns of PNPS_SUMS or
+    DNDS_SUMS along the last axis.
+    '''
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return (sums[..., 0] / sums[..., 1]) / (sums[..., 2] / sums[..., 3])
+
+def rank_rows(values):
+    '''
+    Returns the ranks of every row of a 2D array, 1-based, with ties given
+    their average rank. All rows are ranked together: one argsort along the
+    rows, then tie groups of the flattened array are averaged with bincount.
+    '''
+    n_rows, n = values.shape
+    order = np.argsort(values, axis = 1, kind = 'stable')
+    sorted_values = np.take_along_axis(values, order, axis = 1)
+
+    new = np.ones((n_rows, n), dtype = bool)
+    new[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    group = np.cumsum(new.ravel()) - 1
+    positions = np.tile(np.arange(1, n + 1, dtype = float), n_rows)
+    average = np.bincount(group, weights = positions) / np.bincount(group)
+
+    ranks = np.empty((n_rows, n))
+    np.put_along_axis(ranks, order, average[group].reshape(n_rows, n), axis = 1)
+    return ranks
+
+def pearson_rows(x, y):
+    '''
+    Returns the Pearson correlation of every row of x with the same row of y.
+    '''
+    x = x - x.mean(axis = 1, keepdims = True)
+    y = y - y.mean(axis = 1, keepdims = True)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return (x*y).sum(axis = 1) / np.sqrt((x*x).sum(axis = 1)*(y*y).sum(axis = 1))
+
+def spearman_rows(x, y):
+    '''
+    Returns the Spearman correlation of every row of x with the same row of y.
+    '''
+    return pearson_rows(rank_rows(x), rank_rows(y))
+
+def percentile_interval(replicates, alpha = 0.05):
+    '''
+    Returns the (low, high) percentile interval of replicates along the last
+    axis. Undefined replicates (NaN) are ignored.
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low, high = np.nanpercentile(replicates, [100*alpha/2, 100*(1 - alpha/2)],
+                                     axis = -1)
+    return low, high
+
+# %% Per-gene intervals
+def chunk_genes(n_pos, n_reps, max_bytes = MAX_BYTES):
+    '''
+    Splits genes into consecutive chunks whose replicate arrays fit in
+    max_bytes. gene_replicates holds two (n_reps, residues) 8-byte arrays at
+    once (the index matrix and one gathered column), so each gets half the
+    budget. A gene larger than max_bytes is a chunk of its own. Returns the
+    (start, stop) gene range of every chunk.
+    '''
+    limit = max(max_bytes // (2*8*n_reps), 1)
+    chunks = []
+    start, size = 0, 0
+    for i, n in enumerate(n_pos):
+        if size + n > limit and i > start:
+            chunks.append((start, i))
+            start, size = i, 0
+        size += n
+    if len(n_pos) > start:
+        chunks.append((start, len(n_pos)))
+    return chunks
+
+def gene_replicates(values, n_pos, n_reps, seed, first_gene = 0):
+    '''
+    Returns the (genes, n_reps, columns) replicate sums of consecutive genes
+    whose residues are the rows of values, n_pos[g] > 0 residues for gene g.
+    Every replicate of a gene resamples that gene's residues with
+    replacement. One uniform matrix is drawn for all genes of the chunk and
+    turned into gene-local indices in place, and the sums of every gene are
+    taken with one reduceat along the residues.
+    '''
+    n_pos = np.asarray(n_pos, dtype = np.int64)
+    starts = np.concatenate([[0], np.cumsum(n_pos)[:-1]])
+    gene = np.repeat(np.arange(len(n_pos)), n_pos)
+
+    rng = np.random.default_rng([seed, first_gene])
+    uniform = rng.random((n_reps, len(gene)))
+    uniform *= n_pos[gene]
+    indices = uniform.astype(np.int64)
+    del uniform
+    indices += starts[gene]
+
+    sums = np.empty((len(n_pos), n_reps, values.shape[1]))
+    for k in range(values.shape[1]):
+        sums[:, :, k] = np.add.reduceat(values[indices, k], starts, axis = 1).T
+    return sums
+
+def chunk_intervals(values, n_pos, n_reps, seed, first_gene, alpha):
+    '''
+    Task of one chunk of genes: returns (low, high) of the ratio of sums of
+    every gene.
+    '''
+    return percentile_interval(ratio_of_sums(gene_replicates(values, n_pos, n_reps,
+                                                             seed, first_gene)),
+                               alpha)
+
+def bootstrap_ratios(df, by = 'UniProt_ID', labels = PNPS_SUMS, n_reps = N_REPS,
+                     seed = 0, alpha = 0.05, n_workers = 1, max_bytes = MAX_BYTES):
+    '''
+    Per-gene ratio of sums with bootstrap intervals. df is a per-residue
+    table, e.g. the aggregate.aggregate_pnps table with labels = PNPS_SUMS
+    or a join_engine table with labels = DNDS_SUMS. Returns one row per gene
+    with the summed labels, n_pos, the ratio and its low and high bounds.
+    Chunks of genes are run in a process pool if n_workers > 1.
+    '''
+    df = df.sort_values(by, kind = 'stable')
+    genes, n_pos = np.unique(df[by].to_numpy(dtype = str), return_counts = True)
+    values = df[labels].to_numpy(dtype = float)
+    offsets = np.concatenate([[0], np.cumsum(n_pos)])
+
+    chunks = chunk_genes(n_pos, n_reps, max_bytes)
+    args = [(values[offsets[start]:offsets[stop]], n_pos[start:stop], n_reps, seed,
+             start, alpha) for start, stop in chunks]
+    if n_workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(n_workers) as executor:
+            results = list(executor.map(chunk_intervals, *zip(*args)))
+    else:
+        results = [chunk_intervals(*entry) for entry in args]
+
+    sums = np.add.reduceat(values, offsets[:-1], axis = 0) if len(genes) > 0 \
+        else np.empty((0, len(labels)))
+    output = pd.DataFrame(sums, columns = labels)
+    output.insert(0, by, genes)
+    output.insert(1, 'n_pos', n_pos)
+    output['ratio'] = ratio_of_sums(sums)
+    output['low'] = np.concatenate([low for low, high in results] + [[]])
+    output['high'] = np.concatenate([high for low, high in results] + [[]])
+
+    return output
+
+# %% Proteome intervals
+def proteome_ratio(gene_df, labels = PNPS_SUMS, n_reps = N_REPS, seed = 0,
+                   alpha = 0.05):
+    '''
+    Proteome-wide ratio of sums with a bootstrap interval over genes: every
+    replicate resamples the genes of gene_df (the output of
+    bootstrap_ratios) and sums their label sums. Returns (ratio, low, high).
+    '''
+    sums = gene_df[labels].to_numpy(dtype = float)
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(sums), size = (n_reps, len(sums)))
+    counts = np.bincount((indices + np.arange(n_reps)[:, None]*len(sums)).ravel(),
+                         minlength = n_reps*len(sums)).reshape(n_reps, len(sums))
+    low, high = percentile_interval(ratio_of_sums(counts @ sums), alpha)
+
+    return ratio_of_sums(sums.sum(axis = 0)), low, high
+
+# %% Correlations
+def corr_replicates(x, y, n_reps = N_REPS, seed = 0, method = 'spearman',
+                    max_bytes = MAX_BYTES):
+    '''
+    Returns the correlation of x and y and n_reps bootstrap replicates of
+    it, resampling residues. Pairs where either value is missing or infinite
+    are dropped first. Replicates are computed in blocks that keep the
+    working arrays under max_bytes: up to CORR_ARRAYS[method] (block,
+    residues) 8-byte arrays are alive while a block is correlated.
+    '''
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    corr = spearman_rows if method == 'spearman' else pearson_rows
+
+    estimate = corr(x[None, :], y[None, :])[0]
+    rng = np.random.default_rng(seed)
+    block = max(max_bytes // (CORR_ARRAYS[method]*8*max(len(x), 1)), 1)
+    replicates = []
+    for start in range(0, n_reps, block):
+        indices = rng.integers(0, max(len(x), 1), size = (min(block, n_reps - start), len(x)))
+        replicates.append(corr(x[indices], y[indices]))
+
+    return estimate, np.concatenate(replicates + [[]])
+
+def corr_intervals(df, target, columns, n_reps = N_REPS, seed = 0, alpha = 0.05,
+                   methods = ('pearson', 'spearman')):
+    '''
+    Correlations of target with each of columns (e.g. dN/dS with wcn_sc,
+    wcn_ca and RASA_Wilke), with bootstrap intervals. Returns one row per
+    (column, method) with r, low and high.
+    '''
+    frame = []
+    for column in columns:
+        x = pd.to_numeric(df[column], errors = 'coerce')
+        for method in methods:
+            estimate, replicates = corr_replicates(df[target], x, n_reps, seed, method)
+            low, high = percentile_interval(replicates, alpha)
+            frame.append([column, method, estimate, low, high])
+
+    return pd.DataFrame(frame, columns = ['column', 'method', 'r', 'low', 'high'])
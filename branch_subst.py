@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Per-branch substitution counts from the macse/branch/*_inRefProt.tsv files.
+Each line is one substitution on one branch of the gene tree, mapped to a
+reference protein position: 'codon-14,Node116,L,TTG,1,1' is codon 14 of the
+alignment, branch Node116, the branch's amino acid and codon, and its N and S
+substitution counts (fractional where several paths between codons are
+averaged). nonsynonymous_inRefProt.tsv holds the lines of
+variant_inRefProt.tsv with N > 0. Positions are 0-based like the Poly and
+codonStats files.
+
+Terminal branches are named after their species and gene model (e.g.
+D_nasuta_g4083, D_willistoni_gene_LOC6641922), internal branches NodeN.
+Expected sites of a terminal branch are the E[N] and E[S] of its species in
+the codonStats file; internal branches have none.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+from bed_parser import read_branch_tsv
+from intervals import in_intervals, interval_paths, load_mask
+from pnps_calc import cstat_parser
+
+SUBST_COLS = ['AA_pos', 'Codon_index', 'Branch', 'AA', 'Codon', 'N', 'S']
+
+BRANCH_COUNT_LABELS = ['Branch',
+                       'Species',
+                       'Positions',
+                       'N',
+                       'S',
+                       'E[N]',
+                       'E[S]']
+
+# %% Input files
+def branch_paths(fb_id, dir_path):
+
+    branch_dir = dir_path + '/' + fb_id + '/macse/branch/'
+    variant_path = branch_dir + 'variant_inRefProt.tsv'
+    nonsyn_path = branch_dir + 'nonsynonymous_inRefProt.tsv'
+
+    return variant_path, nonsyn_path
+
+def branch_species(branches):
+    '''
+    Returns the codonStats species name of every terminal branch
+    (D_nasuta_g4083 -> D.nasuta) and '' for internal NodeN branches.
+    '''
+    parts = pd.Series(np.asarray(branches, dtype = str), dtype = str) \
+        .str.extract(r'^([A-Za-z]+)_([A-Za-z0-9]+)(?:_|$)')
+    species = (parts[0] + '.' + parts[1]).fillna('')
+    return np.where(species.str.startswith('Node'), '', species.to_numpy(dtype = str))
+
+# %% Per-gene counts
+def count_branches(subst_df, cstat_df, mask = None):
+    '''
+    Returns (substitutions, branches) dicts of arrays for one gene.
+    substitutions has the SUBST_COLS of every substitution plus the Species
+    of its branch; branches has the BRANCH_COUNT_LABELS of every branch: the
+    number of positions with a substitution and the summed N and S, reduced
+    with one bincount over the branch codes, and the summed codonStats E[N]
+    and E[S] of the branch's species. As in pnps_calc.count_pnps, AA_pos = 0
+    and masked positions are dropped from both the substitutions and the
+    expected sites.
+    '''
+    subst_pos = subst_df.AA_pos.to_numpy()
+    keep = subst_pos >= 1
+    if mask is not None:
+        keep &= ~in_intervals(mask, subst_pos)
+    substitutions = {label: subst_df[label].to_numpy()[keep] for label in SUBST_COLS}
+    substitutions['Species'] = branch_species(substitutions['Branch'])
+
+    branches, code = np.unique(substitutions['Branch'].astype(str),
+                               return_inverse = True)
+    output = {'Branch': branches,
+              'Species': branch_species(branches),
+              'Positions': np.bincount(code, minlength = len(branches))}
+    for label in ['N', 'S']:
+        output[label] = np.bincount(code, minlength = len(branches),
+                                    weights = substitutions[label].astype(float))
+
+    # Expected sites per species, over the positions kept above
+    cstat_pos = cstat_df.AA_pos.to_numpy()
+    cstat_keep = cstat_pos >= 1
+    if mask is not None:
+        cstat_keep &= ~in_intervals(mask, cstat_pos)
+    species, species_code = np.unique(cstat_df.Species.to_numpy(dtype = str)[cstat_keep],
+                                      return_inverse = True)
+
+    found = np.searchsorted(species, output['Species'])
+    inside = found < len(species)
+    inside[inside] = species[found[inside]] == output['Species'][inside]
+    for label in ['E[N]', 'E[S]']:
+        sums = np.bincount(species_code, minlength = len(species),
+                           weights = cstat_df[label].to_numpy(dtype = float)[cstat_keep])
+        output[label] = np.full(len(branches), np.nan)
+        output[label][inside] = sums[found[inside]]
+
+    return substitutions, output
+
+def get_branch_arrays(fb_id, dir_path, exclude_masked = False):
+    '''
+    Per-gene task for aggregate.aggregate_branches: reads the gene's
+    variant_inRefProt.tsv and codonStats file and counts them with
+    count_branches. Genes without a codonStats file get no expected sites.
+    '''
+    variant_path = branch_paths(fb_id, dir_path)[0]
+    cstat_path = dir_path + '/' + fb_id + '/' + fb_id + '.codonStats.UniProt.bed'
+
+    subst_df = read_branch_tsv(variant_path, SUBST_COLS)
+    if os.path.isfile(cstat_path):
+        cstat_df = cstat_parser(cstat_path, ['AA_pos', 'Species', 'E[N]', 'E[S]'])
+    else:
+        cstat_df = cstat_parser(os.devnull, ['AA_pos', 'Species', 'E[N]', 'E[S]'])
+
+    mask = None
+    if exclude_masked:
+        mask = load_mask(interval_paths(fb_id, dir_path)[0])
+
+    return count_branches(subst_df, cstat_df, mask)
+
+# %% Output table
+def add_branch_ratios(df):
+    '''
+    Adds dN, dS and dN/dS from the summed substitutions and expected sites.
+    '''
+    df['dN'] = df['N'] / df['E[N]']
+    df['dS'] = df['S'] / df['E[S]']
+    df['dN/dS'] = df.dN / df.dS
+
+    return df
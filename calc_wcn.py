@@ -17,48 +17,126 @@ Author: Benjamin R. Jack
 '''
 
 # %% Initialize
+import io
 import os
 import csv
 import warnings
 import argparse
 import textwrap
 from Bio.Data import PDBData
-from Bio.PDB import PDBParser
-from Bio.PDB import is_aa
-from matplotlib import pyplot as plt
+import numpy as np
 import pandas as pd
 
 file = './FBgn0000015/refprot/FBgn0000015.pdb'
 name = 'ADBD_DROME'
-# %% Inverse square distance
-def inv_sq_distance(coord1, coord2):
+# %% Blocked WCN over a coordinate array
+def wcn_blocked(coords, block_size = 512, weights = None):
     '''
-    Returns the inverse squared distance between any two coordinates.
+    Returns the WCN of every row of an (N,3) coordinate array. Pairwise inverse
+    squared distances are computed in square tiles of block_size residues, and
+    only tiles on or above the diagonal are evaluated. Each off-diagonal tile
+    contributes to both of its residue blocks, so every pair is computed once
+    and peak memory is bounded by block_size**2 rather than N**2. If weights
+    are given, each neighbour's contribution is multiplied by its weight.
     '''
-    distance = 0.0
-    for i, j in zip(coord1, coord2):
-        distance += (i-j)**2
-    return 1/distance
+    coords = np.asarray(coords, dtype = np.float64)
+    n = len(coords)
+    wcn = np.zeros(n)
+    for i in range(0, n, block_size):
+        block_i = coords[i:i + block_size]
+        for j in range(i, n, block_size):
+            block_j = coords[j:j + block_size]
+            diff = block_i[:, None, :] - block_j[None, :, :]
+            sq_dist = np.einsum('ijk,ijk->ij', diff, diff)
+            if i == j:
+                # Diagonal tile is symmetric and holds the self-pairs
+                np.fill_diagonal(sq_dist, np.inf)
+            inv_sq = 1/sq_dist
+            if weights is None:
+                wcn[i:i + block_size] += inv_sq.sum(axis = 1)
+                if i != j:
+                    wcn[j:j + block_size] += inv_sq.sum(axis = 0)
+            else:
+                wcn[i:i + block_size] += inv_sq @ weights[j:j + block_size]
+                if i != j:
+                    wcn[j:j + block_size] += weights[i:i + block_size] @ inv_sq
+    return wcn
+
+# %% KD-tree WCN with a distance cutoff
+def wcn_cutoff(coords, cutoff, weights = None):
+    '''
+    Returns the WCN of every row of an (N,3) coordinate array, counting only
+    pairs closer than cutoff (in Angstroms). Pairs are found with a KD-tree, so
+    the cost scales with the number of contacts rather than N**2. Useful for
+    very large structures where distant pairs contribute little to WCN.
+    weights are applied as in wcn_blocked.
+    '''
+    from scipy.spatial import cKDTree
+
+    coords = np.asarray(coords, dtype = np.float64)
+    pairs = cKDTree(coords).query_pairs(cutoff, output_type = 'ndarray')
+    diff = coords[pairs[:, 0]] - coords[pairs[:, 1]]
+    inv_sq = 1/np.einsum('ij,ij->i', diff, diff)
+    if weights is None:
+        weight_0 = weight_1 = inv_sq
+    else:
+        weight_0 = inv_sq*weights[pairs[:, 1]]
+        weight_1 = inv_sq*weights[pairs[:, 0]]
+    wcn = np.bincount(pairs[:, 0], weights = weight_0, minlength = len(coords)) \
+        + np.bincount(pairs[:, 1], weights = weight_1, minlength = len(coords))
+    return wcn
 
 # %% WCN
-def calculate_wcn(residues):
-    '''
-    Calculates weighted contact number (WCN).
-    '''
-    for residue in residues:
-        wcn_ca = 0
-        wcn_sc = 0
-        for other_residue in residues:
-            if residue != other_residue:
-                wcn_ca += inv_sq_distance(residue['coord_ca'],
-                                          other_residue['coord_ca'])
-                wcn_sc += inv_sq_distance(residue['sidechain_center'],
-                                          other_residue['sidechain_center'])
-        residue['wcn_ca'] = wcn_ca
-        residue['wcn_sc'] = wcn_sc
+def calculate_wcn(residues, cutoff = None, block_size = 512, min_plddt = None,
+                  plddt_weight = False):
+    '''
+    Calculates weighted contact number (WCN) for a residue table. Both WCN
+    flavours are computed from the (N,3) coord_ca and sidechain_center blocks
+    with wcn_blocked, or with wcn_cutoff if a cutoff is given, and added to the
+    table as wcn_ca and wcn_sc.
+    
+    For AlphaFold models, residues with pLDDT below min_plddt are left out of
+    the calculation entirely (their WCN is NaN and they do not count as
+    neighbours of other residues). With plddt_weight, each neighbour's
+    contribution is scaled by its pLDDT/100.
+    '''
+    n = len(residues['pdb_position'])
+    keep = np.ones(n, dtype = bool)
+    if min_plddt is not None:
+        keep = residues['pLDDT'] >= min_plddt
+    weights = None
+    if plddt_weight:
+        weights = residues['pLDDT'][keep].astype(np.float64)/100
+
+    for label, coord_label in [('wcn_ca', 'coord_ca'), ('wcn_sc', 'sidechain_center')]:
+        wcn = np.full(n, np.nan)
+        if keep.any():
+            coords = residues[coord_label][keep]
+            if cutoff is None:
+                wcn[keep] = wcn_blocked(coords, block_size, weights)
+            else:
+                wcn[keep] = wcn_cutoff(coords, cutoff, weights)
+        residues[label] = wcn
 
     return residues
 
+# %% Residue table
+def residue_table(pdb_aa, pdb_position, chain, coord_ca, sidechain_center,
+                  plddt):
+    '''
+    Returns a residue table, a dict of per-residue arrays: categorical pdb_aa
+    and chain, str pdb_position, (N,3) float32 coord_ca and sidechain_center,
+    and float pLDDT (the B-factor of the alpha-carbon, which is where AlphaFold
+    stores pLDDT).
+    '''
+    return {'pdb_aa': pd.Categorical(pdb_aa),
+            'pdb_position': np.asarray(pdb_position, dtype = str),
+            'chain': pd.Categorical(chain),
+            'coord_ca': np.asarray(coord_ca, dtype = np.float32).reshape(-1, 3),
+            'sidechain_center': np.asarray(sidechain_center, 
+                                           dtype = np.float32).reshape(-1, 3),
+            'pLDDT': np.asarray(plddt, dtype = np.float64)}
+
 # %% Gets center-of-mass by residue
 def process_residue(residue):
     '''
@@ -79,8 +157,9 @@ def process_residue(residue):
     for atom in residue:
         atoms_seen.append(atom.name)
         if atom.name == 'CA':
-            # Save alpha-carbon coordinates
+            # Save alpha-carbon coordinates and pLDDT
             output_dict['coord_ca'] = atom.get_coord()
+            output_dict['pLDDT'] = atom.get_bfactor()
         if atom.name not in ['C', 'CA', 'O', 'N']:
             # Must be a sidechain atom...
             sidechain_coords.append(atom.get_coord())
@@ -116,48 +195,167 @@ def process_residue(residue):
 def collect_coordinates(structure):
     '''
     Loops over all residues in a structure and collects coordinates for alpha-
-    carbons and sidechain center-of-mass. Returns a list of dictionaries, where
-    each dictionary corresponds to residue in the structure.
+    carbons and sidechain center-of-mass. Returns a residue table with one row
+    per amino acid residue in the structure.
     '''
-    output_list = []
+    from Bio.PDB import is_aa
+
+    labels = ['pdb_aa', 'pdb_position', 'chain', 'coord_ca', 'sidechain_center',
+              'pLDDT']
+    columns = {label : [] for label in labels}
     for residue in structure.get_residues():
         if is_aa(residue):
-            output_list.append(process_residue(residue))
-    return output_list
+            output_dict = process_residue(residue)
+            for label in labels:
+                columns[label].append(output_dict[label])
+    return residue_table(*[columns[label] for label in labels])
+
+# %% Collect coordinates without Bio.PDB
+def collect_coordinates_array(file):
+    '''
+    Fast path for collect_coordinates: reads the first model of a PDB file
+    (optionally gzipped) with pdb_reader and computes alpha-carbon and
+    sidechain center coordinates with grouped reductions over all atoms.
+    Returns the same residue table, with the same missing-atom warnings and
+    errors as process_residue.
+    '''
+    from pdb_reader import read_atoms
+
+    return residues_from_atoms(read_atoms(file))
+
+def residues_from_atoms(atoms):
+    '''
+    Returns the residue table of the amino acid residues of pdb_reader atom
+    arrays, see collect_coordinates_array.
+    '''
+    from Bio.PDB import is_aa
+    from pdb_reader import residue_starts
+
+    amino = [resname for resname in np.unique(atoms['resname']) if is_aa(resname)]
+    keep = np.isin(atoms['resname'], amino)
+    atoms = {label: values[keep] for label, values in atoms.items()}
+    if len(atoms['name']) == 0:
+        return residue_table([], [], [], [], [], [])
+
+    starts = residue_starts(atoms)
+    name = atoms['name']
+    has_atom = {atom: np.logical_or.reduceat(name == atom, starts)
+                for atom in ['N', 'C', 'O', 'CA']}
+
+    # Last CA of every residue, as process_residue keeps overwriting it
+    ca_index = np.maximum.reduceat(np.where(name == 'CA', np.arange(len(name)), -1), starts)
+    coord_ca = atoms['coord'][ca_index]
+
+    # Sidechain atoms are summed in file order, one atom rank at a time, so the
+    # float32 sums match process_residue exactly
+    sidechain = np.flatnonzero(~np.isin(name, ['C', 'CA', 'O', 'N']))
+    residue = np.searchsorted(starts, sidechain, side = 'right') - 1
+    n_sidechain = np.bincount(residue, minlength = len(starts))
+    rank = np.arange(len(sidechain)) - (np.cumsum(n_sidechain) - n_sidechain)[residue]
+    sidechain_sum = np.zeros((len(starts), 3), dtype = np.float32)
+    for k in range(n_sidechain.max(initial = 0)):
+        at_rank = rank == k
+        sidechain_sum[residue[at_rank]] += atoms['coord'][sidechain[at_rank]]
+
+    resname = atoms['resname'][starts]
+    pdb_aa = np.array([PDBData.protein_letters_3to1[entry] for entry in resname],
+                      dtype = str)
+    pdb_position = np.char.add(atoms['resseq'][starts].astype(str), 
+                               atoms['icode'][starts])
+
+    # No sidechain atoms: use CA instead, as process_residue does
+    has_sc = n_sidechain > 0
+    coord_sc = coord_ca.copy()
+    coord_sc[has_sc] = sidechain_sum[has_sc]/n_sidechain[has_sc, None].astype(np.float32)
+
+    # Warnings and errors in residue order, only residues with missing atoms
+    no_sc = ~has_sc & (pdb_aa != 'G')
+    incomplete = ~(has_atom['N'] & has_atom['C'] & has_atom['O'] & has_atom['CA']) | no_sc
+    for i in np.flatnonzero(incomplete):
+        warning_message = "Missing {} in residue (" + \
+                            str(pdb_position[i]) + ", " + \
+                            str(pdb_aa[i]) + ")"
+
+        for mainchain_atom in ['N', 'C', 'O']:
+            if not has_atom[mainchain_atom][i]:
+                warnings.warn(warning_message.format(mainchain_atom),
+                              RuntimeWarning)
+        if not has_atom['CA'][i]:
+            raise RuntimeError(warning_message.format('CA') +
+                               '. Cannot calculate C-alpha WCN.')
+        if no_sc[i]:
+            warnings.warn(warning_message.format('sidechain') +
+                          '. Using CA instead.', RuntimeWarning)
+
+    return residue_table(pdb_aa, pdb_position, atoms['chain'][starts],
+                         coord_ca, coord_sc, atoms['bfactor'][ca_index])
 
 # %% Get WCN using above code (mimics main())
-def get_wcn(name, file):
+def get_wcn(name, file, cutoff = None, fast = False, min_plddt = None,
+            plddt_weight = False):
+    '''
+    Returns the residue table of a PDB file with WCN added. With fast = True the file
+    is read with collect_coordinates_array instead of Bio.PDB. Gzipped files
+    are read either way. min_plddt and plddt_weight are passed to
+    calculate_wcn.
+    '''
+    if fast:
+        output_list = collect_coordinates_array(file)
+        return calculate_wcn(output_list, cutoff = cutoff, min_plddt = min_plddt,
+                             plddt_weight = plddt_weight)
+
+    from Bio.PDB import PDBParser
+    from pdb_reader import open_pdb
+
     p = PDBParser()
-    structure = p.get_structure(name, file)
+    if str(file).endswith('.gz'):
+        with open_pdb(file) as read:
+            structure = p.get_structure(name, io.TextIOWrapper(read))
+    else:
+        structure = p.get_structure(name, file)
     # Collect coordinate information
     output_list = collect_coordinates(structure)
     # Calculate WCN from coordinates
-    output_list = calculate_wcn(output_list)
+    output_list = calculate_wcn(output_list, cutoff = cutoff, min_plddt = min_plddt,
+                                plddt_weight = plddt_weight)
     
     return output_list
     
-# %% Convert WCN list to dataframe
-def make_wcn_df(input_dict):
-    
-    labels = ['pdb_aa',
-              'pdb_position',
-              'chain',
-              'coord_ca',
-              'sidechain_center',
-              'wcn_ca',
-              'wcn_sc']
-    
-    frame_dict = {label : [] for label in labels}
-    
-    for residue in input_dict:
-        for key in residue.keys():
-            frame_dict[key].append(residue[key])
-            
+# %% Convert residue table to dataframe
+def make_wcn_df(residues):
+    '''
+    Returns a residue table as a dataframe. The (N,3) coordinate blocks are
+    expanded into float columns ca_x, ca_y, ca_z and sc_x, sc_y, sc_z,
+    followed by pLDDT and the WCN columns.
+    '''
+    frame_dict = {'pdb_aa': residues['pdb_aa'],
+                  'pdb_position': residues['pdb_position'],
+                  'chain': residues['chain']}
+    for prefix, label in [('ca', 'coord_ca'), ('sc', 'sidechain_center')]:
+        for axis, coord in zip('xyz', residues[label].T):
+            frame_dict[prefix + '_' + axis] = coord
+    for label in ['pLDDT', 'wcn_ca', 'wcn_sc']:
+        if label in residues:
+            frame_dict[label] = residues[label]
+
     df = pd.DataFrame(frame_dict)
     
     return df
+
 # %% Plot
-input_dict = get_wcn(name, file)
-df = make_wcn_df(input_dict)
-df.plot('wcn_ca', 'wcn_sc', 'scatter')
+def plot_wcn(name = name, file = file):
+    '''
+    Demo: computes WCN for one structure and plots wcn_ca against wcn_sc.
+    '''
+    from matplotlib import pyplot as plt
+
+    input_dict = get_wcn(name, file)
+    df = make_wcn_df(input_dict)
+    df.plot('wcn_ca', 'wcn_sc', 'scatter')
+    plt.show()
+
+    return df
+
+if __name__ == '__main__':
+    plot_wcn()
 
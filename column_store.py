@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Append-only columnar store for large per-residue tables. A store is a
+directory holding one raw binary file per column and a schema.json with the
+column names, dtypes, categories and row count. String columns are stored as
+int32 category codes, with missing strings as code -1. Nullable integer,
+float and boolean columns (Int64, Float64, boolean) are stored as their NumPy
+dtype plus a boolean mask file of missing values. Rows are appended in batches without rewriting earlier
+data, and columns are read back through np.memmap, so only the requested
+columns and rows are loaded.
+
+A store can be keyed by a gene column (e.g. UniProt_ID or FBgn_id). The
+schema then also holds a gene offset index, the first row of every gene, so
+one gene's rows are a single slice of every column. Each gene's rows must be
+contiguous and appended in one batch.
+'''
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+SCHEMA = 'schema.json'
+
+# Array type of each nullable column, by NumPy kind of its values
+NULLABLE_ARRAYS = {'i': pd.arrays.IntegerArray,
+                   'u': pd.arrays.IntegerArray,
+                   'f': pd.arrays.FloatingArray,
+                   'b': pd.arrays.BooleanArray}
+
+# %% Schema
+def read_schema(path):
+    '''
+    Returns the schema of a store, or None if the store does not exist yet.
+    '''
+    schema_path = os.path.join(path, SCHEMA)
+    if not os.path.isfile(schema_path):
+        return None
+    with open(schema_path) as read:
+        return json.load(read)
+
+def write_schema(path, schema):
+    '''
+    Writes the schema atomically. The schema is written after the column data,
+    so rows past n_rows left by an interrupted append are never read.
+    '''
+    tmp_path = os.path.join(path, SCHEMA + '.tmp')
+    with open(tmp_path, 'w') as write:
+        json.dump(schema, write, indent = 1)
+    os.replace(tmp_path, os.path.join(path, SCHEMA))
+
+def make_schema(df, key = None):
+    '''
+    Derives a schema from a dataframe. NumPy numeric and boolean columns keep
+    their dtype, nullable columns keep their NumPy dtype and get a mask file;
+    everything else is stored as categories. If key is given, the schema gets
+    an empty gene offset index on that column.
+    '''
+    columns = []
+    for i, label in enumerate(df.columns):
+        dtype = df[label].dtype
+        numpy_dtype = getattr(dtype, 'numpy_dtype', None)
+        if isinstance(dtype, np.dtype) and dtype.kind in 'iufb':
+            columns.append({'name': label, 'file': 'col_' + str(i) + '.bin',
+                            'dtype': dtype.str})
+        elif numpy_dtype is not None and numpy_dtype.kind in NULLABLE_ARRAYS:
+            columns.append({'name': label, 'file': 'col_' + str(i) + '.bin',
+                            'dtype': numpy_dtype.str, 'nullable': dtype.name,
+                            'mask': 'col_' + str(i) + '.mask.bin'})
+        else:
+            columns.append({'name': label, 'file': 'col_' + str(i) + '.bin',
+                            'dtype': np.dtype(np.int32).str, 'categories': []})
+    schema = {'columns': columns, 'n_rows': 0}
+    if key is not None:
+        schema['index'] = {'key': key, 'genes': [], 'starts': []}
+    return schema
+
+# %% Gene index
+def gene_runs(values):
+    '''
+    Returns the genes of a key column in order of appearance and the row
+    offset of each, raising ValueError if a gene's rows are not contiguous.
+    '''
+    values = np.asarray(values, dtype = str)
+    new = np.ones(len(values), dtype = bool)
+    new[1:] = values[1:] != values[:-1]
+    starts = np.flatnonzero(new)
+    genes = values[starts]
+    if len(np.unique(genes)) != len(genes):
+        raise ValueError('Rows of each gene must be contiguous')
+    return genes, starts
+
+def gene_offsets(schema):
+    '''
+    Returns {gene: (start, stop)} from the gene offset index of a schema.
+    '''
+    index = schema['index']
+    stops = index['starts'][1:] + [schema['n_rows']]
+    return {gene: (start, stop)
+            for gene, start, stop in zip(index['genes'], index['starts'], stops)}
+
+# %% Write
+def append_columns(path, df, key = None):
+    '''
+    Appends the rows of df to the store at path, creating it if needed. Columns
+    must match the store's columns. A store created with a key column keeps a
+    gene offset index: appended genes must not already be in the store.
+    Returns the row offset of the first appended row.
+    '''
+    os.makedirs(path, exist_ok = True)
+    schema = read_schema(path)
+    if schema is None:
+        schema = make_schema(df, key)
+
+    names = [column['name'] for column in schema['columns']]
+    if list(df.columns) != names:
+        raise ValueError('Columns do not match store: ' + str(names))
+    index = schema.get('index')
+    if key is not None and (index is None or index['key'] != key):
+        raise ValueError('Store is not keyed by ' + key)
+
+    offset = schema['n_rows']
+    if index is not None:
+        genes, starts = gene_runs(df[index['key']])
+        stored = set(index['genes']).intersection(genes.tolist())
+        if len(stored) > 0:
+            raise ValueError('Genes already in store: ' + str(sorted(stored)[:5]))
+        index['genes'] += genes.tolist()
+        index['starts'] += (starts + offset).tolist()
+
+    for column in schema['columns']:
+        values = df[column['name']]
+        missing = values.isna().to_numpy()
+        if 'categories' in column:
+            # New categories are added at the end so existing codes stay valid
+            categories = pd.Index(column['categories'])
+            strings = values[~missing].astype(str)
+            new = pd.Index(strings.unique()).difference(categories)
+            categories = categories.append(new)
+            column['categories'] = categories.tolist()
+            codes = np.full(len(values), -1, dtype = column['dtype'])
+            codes[~missing] = pd.Categorical(strings, categories = categories).codes
+            data = codes
+        elif 'nullable' in column:
+            data = values.to_numpy(dtype = column['dtype'], na_value = 0)
+        else:
+            data = values.to_numpy(dtype = column['dtype'])
+
+        # Truncate any rows left over from an interrupted append
+        files = [(column['file'], data)]
+        if 'mask' in column:
+            files.append((column['mask'], missing))
+        for file_name, array in files:
+            with open(os.path.join(path, file_name), 'ab') as write:
+                write.truncate(offset*array.itemsize)
+                array.tofile(write)
+
+    schema['n_rows'] = offset + len(df)
+    write_schema(path, schema)
+
+    return offset
+
+def write_columns(path, df, key = None):
+    '''
+    Writes df as a new store at path, replacing any store already there. The
+    store is built next to path and moved into place, so readers see either
+    the old store or the complete new one.
+    '''
+    tmp_path = path.rstrip(os.sep) + '.' + str(os.getpid()) + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    append_columns(tmp_path, df, key)
+
+    if read_schema(path) is not None:
+        old_path = tmp_path + '.old'
+        os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, path)
+
+# %% Read
+def map_file(path, file_name, dtype, n_rows):
+    '''
+    Returns the first n_rows values of a column file as a read-only memmap.
+    '''
+    if n_rows == 0:
+        return np.array([], dtype = dtype)
+    return np.memmap(os.path.join(path, file_name), mode = 'r', dtype = dtype,
+                     shape = (n_rows,))
+
+def read_column(path, name, start = 0, stop = None, schema = None):
+    '''
+    Returns rows start:stop of one column. Numeric columns are memory-mapped
+    arrays (zero-copy); string columns are categoricals over mapped codes and
+    nullable columns are masked arrays over mapped values and mask.
+    '''
+    schema = read_schema(path) if schema is None else schema
+    column = [column for column in schema['columns'] if column['name'] == name]
+    if len(column) == 0:
+        raise KeyError(name)
+    column = column[0]
+
+    data = map_file(path, column['file'], column['dtype'], schema['n_rows'])[start:stop]
+    if 'categories' in column:
+        return pd.Categorical.from_codes(data, categories = column['categories'])
+    if 'nullable' in column:
+        mask = map_file(path, column['mask'], bool, schema['n_rows'])[start:stop]
+        return NULLABLE_ARRAYS[data.dtype.kind](data, mask)
+    return data
+
+def read_columns(path, columns = None, start = 0, stop = None, schema = None):
+    '''
+    Returns rows start:stop of the given columns (all by default) as a
+    dataframe.
+    '''
+    schema = read_schema(path) if schema is None else schema
+    if schema is None:
+        raise FileNotFoundError(os.path.join(path, SCHEMA))
+    if columns is None:
+        columns = [column['name'] for column in schema['columns']]
+
+    return pd.DataFrame({name: read_column(path, name, start, stop, schema)
+                         for name in columns}, copy = False)
+
+def read_gene(path, gene, columns = None, schema = None):
+    '''
+    Returns the rows of one gene of a keyed store as a dataframe, one slice of
+    each mapped column. Raises KeyError if the gene is not in the store.
+    '''
+    schema = read_schema(path) if schema is None else schema
+    if schema is None:
+        raise FileNotFoundError(os.path.join(path, SCHEMA))
+    start, stop = gene_offsets(schema)[gene]
+    return read_columns(path, columns, start, stop, schema)
+
+def read_genes(path, genes, columns = None):
+    '''
+    Returns the rows of several genes of a keyed store, in the order given.
+    '''
+    schema = read_schema(path)
+    frame = [read_gene(path, gene, columns, schema) for gene in genes]
+    if len(frame) == 0:
+        return read_columns(path, columns, 0, 0, schema)
+    return pd.concat(frame, ignore_index = True)
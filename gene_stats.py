@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Per-gene correlations and least-squares fits of an evolutionary rate (e.g.
+dN/dS) against structural columns (wcn_sc, wcn_ca, RASA_Wilke, ...) for all
+genes of a join_engine table at once. Rows are grouped by gene code, and every
+per-gene quantity (counts, means, centered cross-products) is a bincount over
+the codes, so the cost is a few passes over the table however many genes
+there are. Spearman ranks are taken within genes from one (gene, value) sort
+per column, using the sorted group offsets.
+
+Rows with a missing or infinite value are dropped per statistic: per pair of
+columns for Pearson and Spearman, and over all columns for partial
+correlations and fits. Genes with too few rows get NaN.
+'''
+
+import numpy as np
+import pandas as pd
+
+STRUCT_COLS = ['wcn_sc', 'wcn_ca', 'RASA_Wilke']
+
+# %% Grouped reductions
+def gene_codes(df, by = 'UniProt_ID'):
+    '''
+    Returns the sorted genes of df and the gene code of every row.
+    '''
+    code, genes = pd.factorize(df[by].astype(str), sort = True)
+    return np.asarray(genes, dtype = str), code
+
+def numeric(df, columns):
+    '''
+    Returns the columns of df as an (N, k) float array, with non-numeric
+    values ('NA') and infinities as NaN.
+    '''
+    values = np.column_stack([pd.to_numeric(df[column], errors = 'coerce')
+                              .to_numpy(dtype = float) for column in columns])
+    values[~np.isfinite(values)] = np.nan
+    return values
+
+def cross_products(values, code, n_genes):
+    '''
+    Returns the per-gene row count n (G,), means (G, k) and centered
+    cross-product sums (G, k, k) of the rows of values, which must have no
+    NaN. Values are centered on their gene means before the products are
+    summed, which keeps the sums accurate.
+    '''
+    n = np.bincount(code, minlength = n_genes)
+    k = values.shape[1]
+    with np.errstate(invalid = 'ignore'):
+        means = np.column_stack([np.bincount(code, weights = values[:, i],
+                                             minlength = n_genes) / n
+                                 for i in range(k)]).reshape(n_genes, k)
+    centered = values - means[code]
+
+    products = np.empty((n_genes, k, k))
+    for i in range(k):
+        for j in range(i, k):
+            products[:, i, j] = np.bincount(code, weights = centered[:, i]*centered[:, j],
+                                            minlength = n_genes)
+            products[:, j, i] = products[:, i, j]
+    return n, means, products
+
+def value_order(values, code):
+    '''
+    Returns the row order by (gene, value): rows are sorted by value, then
+    stably by gene. Dropping rows from the order keeps it sorted, so one
+    order per column serves every subset of rows.
+    '''
+    order = np.argsort(values, kind = 'stable')
+    return order[np.argsort(code[order], kind = 'stable')]
+
+def group_ranks(values, code, order):
+    '''
+    Returns the rank of every row in order within its gene, 1-based, with
+    ties given their average rank; rows not in order get NaN. order lists
+    rows by (gene, value), see value_order. Runs of equal (gene, value) are
+    averaged with bincount.
+    '''
+    sorted_code, sorted_values = code[order], values[order]
+
+    new = np.ones(len(order), dtype = bool)
+    new[1:] = (sorted_code[1:] != sorted_code[:-1]) | (sorted_values[1:] != sorted_values[:-1])
+    run = np.cumsum(new) - 1
+
+    gene_start = np.ones(len(order), dtype = bool)
+    gene_start[1:] = sorted_code[1:] != sorted_code[:-1]
+    offsets = np.flatnonzero(gene_start)
+    position = np.arange(len(order)) - np.repeat(offsets, np.diff(np.append(offsets, len(order)))) + 1
+    average = np.bincount(run, weights = position) / np.bincount(run)
+
+    ranks = np.full(len(values), np.nan)
+    ranks[order] = average[run]
+    return ranks
+
+def pair_corr(x, y, code, n_genes, orders = None):
+    '''
+    Returns the per-gene number of complete (x, y) pairs and their Pearson
+    correlation, or their Spearman correlation if the value_order of x and y
+    is given as orders.
+    '''
+    complete = ~(np.isnan(x) | np.isnan(y))
+    if orders is not None:
+        x, y = [group_ranks(values, code, order[complete[order]])
+                for values, order in zip([x, y], orders)]
+    x, y, code = x[complete], y[complete], code[complete]
+
+    n, means, products = cross_products(np.column_stack([x, y]), code, n_genes)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        r = products[:, 0, 1] / np.sqrt(products[:, 0, 0]*products[:, 1, 1])
+    r[n < 3] = np.nan
+    return n, r
+
+# %% Correlations
+def gene_corr(df, target = 'dN/dS', columns = STRUCT_COLS, by = 'UniProt_ID',
+              methods = ('pearson', 'spearman', 'partial')):
+    '''
+    Per-gene correlations of target with each of columns. 'partial' is the
+    Pearson correlation with one column controlling for the other columns,
+    from the inverse of each gene's correlation matrix. Returns a tidy table
+    with one row per (gene, column, method) and the number of rows n used.
+    '''
+    genes, code = gene_codes(df, by)
+    values = numeric(df, [target] + list(columns))
+
+    orders = None
+    if 'spearman' in methods:
+        orders = [value_order(values[:, i], code) for i in range(values.shape[1])]
+
+    frame = []
+    for method in methods:
+        if method == 'partial':
+            continue
+        for i, column in enumerate(columns):
+            pair_orders = [orders[0], orders[i + 1]] if method == 'spearman' else None
+            n, r = pair_corr(values[:, 0], values[:, i + 1], code, len(genes),
+                             pair_orders)
+            frame.append(pd.DataFrame({by: genes, 'column': column, 'method': method,
+                                       'n': n, 'r': r}))
+
+    if 'partial' in methods:
+        complete = ~np.isnan(values).any(axis = 1)
+        n, means, products = cross_products(values[complete], code[complete], len(genes))
+        precision = np.full(products.shape, np.nan)
+        valid = n > values.shape[1]
+        if valid.any():
+            precision[valid] = np.linalg.pinv(products[valid])
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            partial = -precision[:, 0, 1:] / np.sqrt(precision[:, :1, 0]
+                                                      *np.diagonal(precision, axis1 = 1, axis2 = 2)[:, 1:])
+        for i, column in enumerate(columns):
+            frame.append(pd.DataFrame({by: genes, 'column': column, 'method': 'partial',
+                                       'n': n, 'r': partial[:, i]}))
+
+    output = pd.concat(frame, ignore_index = True)
+    return output.sort_values([by, 'method', 'column'], kind = 'stable',
+                              ignore_index = True)
+
+# %% Least squares
+def gene_fit(df, target = 'dN/dS', columns = STRUCT_COLS, by = 'UniProt_ID'):
+    '''
+    Per-gene least-squares fit of target on columns with an intercept, from
+    each gene's centered cross-products. Returns one row per gene with the
+    number of complete rows n, the intercept, one coefficient per column and
+    R^2. Genes with no more rows than parameters get NaN.
+    '''
+    genes, code = gene_codes(df, by)
+    values = numeric(df, [target] + list(columns))
+    complete = ~np.isnan(values).any(axis = 1)
+    n, means, products = cross_products(values[complete], code[complete], len(genes))
+
+    k = len(columns)
+    coef = np.full((len(genes), k), np.nan)
+    valid = n > k + 1
+    if valid.any():
+        coef[valid] = (np.linalg.pinv(products[valid, 1:, 1:])
+                       @ products[valid, 1:, :1])[:, :, 0]
+    intercept = means[:, 0] - (coef*means[:, 1:]).sum(axis = 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        r2 = (coef*products[:, 0, 1:]).sum(axis = 1) / products[:, 0, 0]
+
+    output = pd.DataFrame({by: genes, 'n': n, 'intercept': intercept})
+    for i, column in enumerate(columns):
+        output[column] = coef[:, i]
+    output['R2'] = r2
+    return output
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Interval index over the {FbID}.mask.UniProt.bed and {FbID}.features.UniProt.bed
+files. Intervals are 0-based and end-exclusive, like the AA_pos column of the
+Poly and codonStats files (SLAC AA_pos is 1-based, i.e. the BED end). Mask
+intervals are merged into sorted, disjoint ranges so a position lookup is one
+searchsorted call; features may overlap and are looked up per feature with
+searchsorted over the sorted positions. All lookups take a whole array of
+positions, so a gene is annotated in one vectorized pass.
+'''
+
+import os
+import numpy as np
+from bed_parser import read_features_bed, read_mask_bed
+
+# %% Interval index
+def merge_intervals(starts, ends):
+    '''
+    Returns sorted, disjoint (starts, ends) covering the same positions as the
+    input intervals. Overlapping and adjacent intervals are merged.
+    '''
+    starts = np.asarray(starts, dtype = np.int64)
+    ends = np.asarray(ends, dtype = np.int64)
+    if len(starts) == 0:
+        return starts, ends
+
+    order = np.argsort(starts, kind = 'stable')
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+
+    # A new range starts where an interval begins past everything before it
+    new = np.ones(len(starts), dtype = bool)
+    new[1:] = starts[1:] > reach[:-1]
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(starts)) - 1
+    return starts[first], reach[last]
+
+def in_intervals(index, positions):
+    '''
+    Returns True for every position inside one of the merged (starts, ends)
+    of index.
+    '''
+    starts, ends = index
+    positions = np.asarray(positions, dtype = np.int64)
+    i = np.searchsorted(starts, positions, side = 'right') - 1
+    inside = i >= 0
+    inside[inside] = positions[inside] < ends[i[inside]]
+    return inside
+
+def feature_membership(features, positions):
+    '''
+    Returns an (N positions, N features) boolean matrix, True where a
+    position lies inside a feature. Each feature is a contiguous slice of the
+    sorted positions, found with two searchsorted calls.
+    '''
+    positions = np.asarray(positions, dtype = np.int64)
+    order = np.argsort(positions, kind = 'stable')
+    sorted_pos = positions[order]
+
+    lo = np.searchsorted(sorted_pos, features.AA_start.to_numpy(), side = 'left')
+    hi = np.searchsorted(sorted_pos, features.AA_end.to_numpy(), side = 'left')
+
+    membership = np.zeros((len(positions), len(features)), dtype = bool)
+    for k in range(len(features)):
+        membership[order[lo[k]:hi[k]], k] = True
+    return membership
+
+def feature_labels(features):
+    '''
+    Returns the label of every feature: 'Feature_type:Description', or just
+    the type if there is no description (e.g. 'Region:Disordered', 'Helix').
+    '''
+    types = features.Feature_type.to_numpy(dtype = str)
+    descriptions = features.Description.to_numpy(dtype = str)
+    return np.where(descriptions == '', types,
+                    np.char.add(np.char.add(types, ':'), descriptions))
+
+# %% Per-gene intervals
+def interval_paths(fb_id, dir_path):
+
+    mask_path = dir_path + '/' + fb_id + '/' + fb_id + '.mask.UniProt.bed'
+    features_path = dir_path + '/' + fb_id + '/' + fb_id + '.features.UniProt.bed'
+
+    return mask_path, features_path
+
+def load_mask(file_path, missing_ok = True):
+    '''
+    Returns the merged mask index of a mask file. A missing file is an empty
+    mask, or raises FileNotFoundError if missing_ok is False.
+    '''
+    if not os.path.isfile(file_path):
+        if not missing_ok:
+            raise FileNotFoundError(file_path)
+        return merge_intervals([], [])
+    df = read_mask_bed(file_path, ['AA_start', 'AA_end'])
+    return merge_intervals(df.AA_start.to_numpy(), df.AA_end.to_numpy())
+
+def load_features(file_path, missing_ok = True):
+    '''
+    Returns the features dataframe of a features file, with a Label column.
+    A missing file gives no features, or raises FileNotFoundError if
+    missing_ok is False.
+    '''
+    if os.path.isfile(file_path):
+        df = read_features_bed(file_path)
+    elif missing_ok:
+        df = read_features_bed(os.devnull)
+    else:
+        raise FileNotFoundError(file_path)
+    df['Label'] = feature_labels(df)
+    return df
+
+def annotate(positions, mask, features):
+    '''
+    Annotates 0-based positions with their mask status and the '|'-joined
+    labels of all features containing them. Returns a dict of arrays
+    'Masked' (bool) and 'Features' (str).
+    '''
+    membership = feature_membership(features, positions)
+    labels = features.Label.to_numpy(dtype = str)
+    joined = np.array(['|'.join(labels[row]) for row in membership], dtype = str)
+    if len(joined) == 0:
+        joined = np.array([], dtype = str)
+
+    return {'Masked': in_intervals(mask, positions),
+            'Features': joined}
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Inventory of the per-gene input files. Every gene directory (and its
+refprot/, macse/branch/ and group/<clade>/ subdirectories) is listed once with
+os.scandir, and the files found are recorded as a bitmask of FILE_KINDS plus
+their sizes. Directories are scanned concurrently in a thread pool, since the
+work is filesystem metadata rather than CPU. The inventory is a dict keyed by
+FBgn_id, so checking which files a gene has is one lookup and one bitwise and.
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Known files, by kind, and the bit of each kind in a gene's mask
+FILE_KINDS = ['synonymous.Poly',
+              'missense.Poly',
+              'codonStats',
+              'features',
+              'SLAC',
+              'pdb',
+              'mask',
+              'mask.tsv',
+              'allPoly',
+              'synonymous.ADJ.Poly',
+              'missense.ADJ.Poly',
+              'asymMK',
+              'branch.variant',
+              'branch.nonsynonymous',
+              'group']
+
+KIND_BITS = {kind: 1 << i for i, kind in enumerate(FILE_KINDS)}
+
+# File name of each kind, after the FBgn_id
+SUFFIXES = {'.synonymous.Poly.UniProt.bed': 'synonymous.Poly',
+            '.missense.Poly.UniProt.bed': 'missense.Poly',
+            '.codonStats.UniProt.bed': 'codonStats',
+            '.features.UniProt.bed': 'features',
+            '.SLAC.UniProt.bed': 'SLAC',
+            '.mask.UniProt.bed': 'mask',
+            '.mask.tsv': 'mask.tsv',
+            '.allPoly.UniProt.bed': 'allPoly',
+            '.synonymous.ADJ.Poly.UniProt.bed': 'synonymous.ADJ.Poly',
+            '.missense.ADJ.Poly.UniProt.bed': 'missense.ADJ.Poly',
+            '.asymMK.UniProt.stats': 'asymMK'}
+
+BRANCH_FILES = {'variant_inRefProt.tsv': 'branch.variant',
+                'nonsynonymous_inRefProt.tsv': 'branch.nonsynonymous'}
+
+# %% Bitmasks
+def kind_mask(kinds):
+    '''
+    Returns the bitmask of a list of kinds.
+    '''
+    mask = 0
+    for kind in kinds:
+        mask |= KIND_BITS[kind]
+    return mask
+
+def has_files(record, kinds):
+    '''
+    True if the inventory record (of a gene or group) has all the kinds.
+    '''
+    mask = kind_mask(kinds)
+    return record['mask'] & mask == mask
+
+def select_genes(inventory, kinds):
+    '''
+    Returns the sorted FBgn_ids of the genes that have all the kinds.
+    '''
+    mask = kind_mask(kinds)
+    return [fb_id for fb_id, record in inventory.items()
+            if record['mask'] & mask == mask]
+
+# %% Directory scan
+def scan_files(dir_path, names):
+    '''
+    Lists one directory and returns {'mask', 'size'} of the files whose names
+    are in names ({file name: kind}), and the names of its subdirectories.
+    '''
+    record = {'mask': 0, 'size': {}}
+    subdirs = set()
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.add(entry.name)
+                continue
+            kind = names.get(entry.name)
+            if kind is not None and entry.is_file():
+                record['mask'] |= KIND_BITS[kind]
+                record['size'][kind] = entry.stat().st_size
+    return record, subdirs
+
+def scan_gene(fb_id, gene_dir):
+    '''
+    Returns the inventory record of one gene directory: the bitmask and sizes
+    of its files, including refprot/{FbID}.pdb and the macse/branch files,
+    and a record of the same form for every group/<clade> directory. The
+    'group' bit is set if the gene has at least one clade. Subdirectories are
+    only entered if the listing of their parent shows them, so a gene costs
+    one listing per existing directory and no other probes.
+    '''
+    names = {fb_id + suffix: kind for suffix, kind in SUFFIXES.items()}
+    record, subdirs = scan_files(gene_dir, names)
+    record['groups'] = {}
+
+    def add(found):
+        record['mask'] |= found['mask']
+        record['size'].update(found['size'])
+
+    if 'refprot' in subdirs:
+        add(scan_files(os.path.join(gene_dir, 'refprot'), {fb_id + '.pdb': 'pdb'})[0])
+    if 'macse' in subdirs:
+        macse_dir = os.path.join(gene_dir, 'macse')
+        if 'branch' in scan_files(macse_dir, {})[1]:
+            add(scan_files(os.path.join(macse_dir, 'branch'), BRANCH_FILES)[0])
+    if 'group' in subdirs:
+        group_root = os.path.join(gene_dir, 'group')
+        for clade in sorted(scan_files(group_root, {})[1]):
+            record['groups'][clade] = scan_files(os.path.join(group_root, clade), names)[0]
+        if len(record['groups']) > 0:
+            record['mask'] |= KIND_BITS['group']
+
+    return record
+
+def scan_inventory(dir_path = os.getcwd(), n_workers = 8):
+    '''
+    Returns {FBgn_id: record} for every gene directory under dir_path, sorted
+    by FBgn_id, see scan_gene. Gene directories are scanned by n_workers
+    threads.
+    '''
+    with os.scandir(dir_path) as genes:
+        genes = sorted((gene.name, gene.path) for gene in genes
+                       if 'FBgn' in gene.name and gene.is_dir())
+
+    if n_workers > 1 and len(genes) > 1:
+        with ThreadPoolExecutor(n_workers) as executor:
+            records = list(executor.map(lambda gene: scan_gene(*gene), genes))
+    else:
+        records = [scan_gene(*gene) for gene in genes]
+
+    return {fb_id: record for (fb_id, _), record in zip(genes, records)}
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Proteome-wide version of Bed_to_df.py. For every gene with a SLAC file and a
+refprot structure, SLAC dN/dS is joined with DSSP and WCN features by amino
+acid position, and all genes are written to one long per-residue table in a
+column_store keyed by UniProt_ID. Genes are processed in batches of about
+batch_size, so memory is bounded by one batch regardless of the number of
+genes. Genes are written in UniProt_ID order and residues in AA_pos order, so
+the table is sorted by (UniProt_ID, AA_pos) without a global sort.
+'''
+
+import os
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from bed_parser import read_slac_bed
+from column_store import append_columns, read_columns, read_schema
+from intervals import annotate, load_features, load_mask
+from inventory import has_files, scan_gene, scan_inventory, select_genes
+from lookup import take
+from struct_cache import CACHE_DIR, get_dssp_df, get_wcn_df
+
+SLAC_COLS = ['UniProt_ID', 'AA_pos', 'Codon_pos', 'E[S]', 'E[N]', 'DS', 'DN']
+
+JOIN_LABELS = ['UniProt_ID',
+               'AA_pos',
+               'FBgn_id',
+               'Codon_pos',
+               'E[S]',
+               'E[N]',
+               'DS',
+               'DN',
+               'dN/dS',
+               'DSSP_AA',
+               'Sec_Struct',
+               'RASA_Wilke',
+               'pdb_aa',
+               'pLDDT',
+               'wcn_ca',
+               'wcn_sc',
+               'Masked',
+               'Features']
+
+# %% Find genes
+def find_genes(root, inventory = None):
+    '''
+    Returns a list of (UniProt_ID, FBgn_id, SLAC path, pdb path) for every gene
+    under root with a non-empty SLAC file and a refprot structure, sorted by
+    UniProt_ID. Genes are taken from the inventory of root (scanned if not
+    given), and only the first line of each SLAC file is read.
+    '''
+    inventory = scan_inventory(root) if inventory is None else inventory
+    output = []
+    for fb_id in select_genes(inventory, ['SLAC', 'pdb']):
+        if inventory[fb_id]['size']['SLAC'] == 0:
+            continue
+        slac = os.path.join(root, fb_id, fb_id + '.SLAC.UniProt.bed')
+        pdb = os.path.join(root, fb_id, 'refprot', fb_id + '.pdb')
+        with open(slac) as read:
+            line = read.readline()
+        output.append((line.split('\t', 1)[0], fb_id, slac, pdb))
+    return sorted(output)
+
+# %% Join one gene
+def join_gene(fb_id, df_dnds, df_dssp, df_wcn, mask = None, features = None):
+    '''
+    Joins one gene's SLAC, DSSP and WCN tables on AA_pos and returns a typed
+    dataframe with JOIN_LABELS columns, sorted by AA_pos. DSSP and WCN columns
+    are looked up by position rather than merged, so no intermediate frames
+    are built. Positions are annotated with the gene's mask and features (see
+    intervals.py); without them, nothing is masked and Features is empty.
+    '''
+    df_dnds = df_dnds.sort_values('AA_pos', kind = 'stable')
+    keys = df_dnds.AA_pos.to_numpy()
+
+    # SLAC AA_pos is 1-based, intervals are 0-based
+    mask = load_mask(os.devnull) if mask is None else mask
+    features = load_features(os.devnull) if features is None else features
+    annotation = annotate(keys - 1, mask, features)
+
+    dssp_pos = df_dssp.DSSP_Index.to_numpy(dtype = np.int64)
+    wcn_pos = df_wcn.pdb_position.to_numpy(dtype = str)
+    wcn_pos = np.array([int(pos) if pos.isdigit() else -1 for pos in wcn_pos],
+                       dtype = np.int64)
+
+    E_S, E_N = df_dnds['E[S]'].to_numpy(), df_dnds['E[N]'].to_numpy()
+    DS, DN = df_dnds['DS'].to_numpy(), df_dnds['DN'].to_numpy()
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        dnds = (DN/E_N)/(DS/E_S)
+
+    return pd.DataFrame({
+        'UniProt_ID': df_dnds.UniProt_ID.to_numpy(),
+        'AA_pos': keys.astype(np.int32),
+        'FBgn_id': fb_id,
+        'Codon_pos': df_dnds.Codon_pos.str.slice(6).to_numpy(dtype = np.int32),
+        'E[S]': E_S,
+        'E[N]': E_N,
+        'DS': DS,
+        'DN': DN,
+        'dN/dS': dnds,
+        'DSSP_AA': take(keys, dssp_pos, df_dssp.AA.to_numpy(dtype = object), ''),
+        'Sec_Struct': take(keys, dssp_pos, df_dssp.Sec_Struct.to_numpy(dtype = object), ''),
+        'RASA_Wilke': take(keys, dssp_pos, pd.to_numeric(df_dssp.RASA_Wilke,
+                                                         errors = 'coerce').to_numpy()),
+        'pdb_aa': take(keys, wcn_pos, df_wcn.pdb_aa.to_numpy(dtype = object), ''),
+        'pLDDT': take(keys, wcn_pos, df_wcn.pLDDT.to_numpy(dtype = float)),
+        'wcn_ca': take(keys, wcn_pos, df_wcn.wcn_ca.to_numpy(dtype = float)),
+        'wcn_sc': take(keys, wcn_pos, df_wcn.wcn_sc.to_numpy(dtype = float)),
+        'Masked': annotation['Masked'],
+        'Features': annotation['Features']})
+
+def gene_annotation(fb_id, gene_dir, record = None):
+    '''
+    Returns the (mask, features) of a gene directory. The inventory record of
+    the gene (scanned if not given) says which of the two files it has. A
+    file the record lacks gives an empty annotation with a warning, so a
+    wrong fb_id or an incomplete gene directory does not pass silently; a
+    file the record has must exist.
+    '''
+    record = scan_gene(fb_id, gene_dir) if record is None else record
+    annotation = []
+    for kind, load in [('mask', load_mask), ('features', load_features)]:
+        if has_files(record, [kind]):
+            file_path = os.path.join(gene_dir, fb_id + '.' + kind + '.UniProt.bed')
+            annotation.append(load(file_path, missing_ok = False))
+        else:
+            warnings.warn(fb_id + ' has no ' + kind + ' file in ' + gene_dir +
+                          ', positions are not annotated', RuntimeWarning)
+            annotation.append(load(os.devnull))
+    return tuple(annotation)
+
+def gene_task(fb_id, slac, pdb, cache_dir = CACHE_DIR, min_plddt = None,
+              plddt_weight = False, exclude_masked = False, record = None):
+    gene_dir = os.path.dirname(slac)
+    df_dnds = read_slac_bed(slac, usecols = SLAC_COLS)
+    df_dssp = get_dssp_df(fb_id, pdb, cache_dir, min_plddt = min_plddt)
+    df_wcn = get_wcn_df(fb_id, pdb, cache_dir, min_plddt = min_plddt, 
+                        plddt_weight = plddt_weight)
+    mask, features = gene_annotation(fb_id, gene_dir, record)
+    df = join_gene(fb_id, df_dnds, df_dssp, df_wcn, mask, features)
+    if exclude_masked:
+        df = df[~df.Masked].reset_index(drop = True)
+    return df
+
+# %% Batch join
+def build_join(root, output_path, batch_size = 200, cache_dir = CACHE_DIR,
+               min_plddt = None, plddt_weight = False, exclude_masked = False):
+    '''
+    Joins all genes under root and appends them, batch_size genes at a time, to
+    the column_store at output_path, keyed by UniProt_ID. A batch is extended
+    so that genes sharing a UniProt_ID are appended together, as the gene
+    offset index requires. A gene that fails is skipped with a warning.
+    Returns a dataframe of failed genes. output_path must not already
+    hold a store. min_plddt and plddt_weight are applied to DSSP and WCN, see
+    calc_wcn.calculate_wcn. With exclude_masked, masked positions are dropped.
+    '''
+    if read_schema(output_path) is not None:
+        raise FileExistsError(output_path)
+
+    inventory = scan_inventory(root)
+    genes = find_genes(root, inventory)
+    failures = []
+
+    start = 0
+    while start < len(genes):
+        stop = min(start + batch_size, len(genes))
+        while stop < len(genes) and genes[stop][0] == genes[stop - 1][0]:
+            stop += 1
+        frame = []
+        for uniprot_id, fb_id, slac, pdb in genes[start:stop]:
+            try:
+                frame.append(gene_task(fb_id, slac, pdb, cache_dir, min_plddt,
+                                       plddt_weight, exclude_masked,
+                                       inventory[fb_id]))
+            except Exception as error:
+                warnings.warn(fb_id + ' failed: ' + repr(error), RuntimeWarning)
+                failures.append((fb_id, repr(error)))
+
+        if len(frame) > 0:
+            append_columns(output_path, pd.concat(frame, ignore_index = True),
+                           key = 'UniProt_ID')
+        start = stop
+
+    return pd.DataFrame(failures, columns = ['FBgn_id', 'error'])
+
+def read_join(output_path, columns = None):
+    '''
+    Reads the joined table, indexed by (UniProt_ID, AA_pos).
+    '''
+    if columns is not None:
+        columns = ['UniProt_ID', 'AA_pos'] + \
+            [label for label in columns if label not in ('UniProt_ID', 'AA_pos')]
+    df = read_columns(output_path, columns)
+    return df.set_index(['UniProt_ID', 'AA_pos'])
+
+def main():
+    '''
+    Join SLAC, DSSP and WCN for all genes under a directory.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Per-residue dN/dS, DSSP and WCN table for all FBgn* genes.')
+    parser.add_argument('root', metavar='<root dir>', type=str,
+                        help='directory containing FBgn* gene directories')
+    parser.add_argument('-o', metavar='<output dir>', type=str,
+                        default='structure_join',
+                        help='output column store')
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help='genes held in memory at once')
+    parser.add_argument('--cache-dir', type=str, default=CACHE_DIR,
+                        help='structural feature cache directory')
+    parser.add_argument('--min-plddt', type=float, default=None,
+                        help='drop residues below this pLDDT from DSSP and WCN')
+    parser.add_argument('--plddt-weight', action='store_true',
+                        help='weight WCN neighbours by pLDDT/100')
+    parser.add_argument('--exclude-masked', action='store_true',
+                        help='drop positions in mask.UniProt.bed')
+    args = parser.parse_args()
+
+    failures = build_join(args.root, args.o, args.batch_size, args.cache_dir,
+                          args.min_plddt, args.plddt_weight, args.exclude_masked)
+    if len(failures) > 0:
+        print(failures.to_string(index = False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Per-lineage pN/pS and dN/dS. Besides the top-level files (group 'all'), each
+gene may have group/<clade>/ directories (e.g. Drosophila, Sophophora) with
+their own SLAC, codonStats, Poly and mask files. scan_lineages takes the
+groups and their files from the inventory (see inventory.scan_inventory);
+the per-gene task then counts every group of the gene from those records,
+so no directory is listed twice and no file is probed. Positions are 0-based like the
+Poly and codonStats files; SLAC rows are matched by their BED start.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+from bed_parser import read_slac_bed
+from intervals import annotate, in_intervals, load_features, load_mask, merge_intervals
+from inventory import has_files, scan_inventory
+from lookup import take
+from pnps_calc import CSTAT_COLS, VAR_COLS, count_pnps, cstat_parser, var_parser
+
+ALL_GROUP = 'all'
+
+LINEAGE_LABELS = ['FBgn_id',
+                  'Group',
+                  'UniProt_ID',
+                  'AA_pos',
+                  'Species_count',
+                  'E[N]',
+                  'E[S]',
+                  'PN',
+                  'PS',
+                  'E[N]_SLAC',
+                  'E[S]_SLAC',
+                  'DN',
+                  'DS',
+                  'Masked']
+
+SLAC_COLS = ['UniProt_ID', 'Unknown', 'E[S]', 'E[N]', 'DS', 'DN']
+
+# %% Groups
+def scan_lineages(dir_path, inventory = None, n_workers = 8):
+    '''
+    Returns {FBgn_id: {group: (group directory, inventory record)}} for every
+    gene of the inventory of dir_path (scanned if not given), with the
+    top-level directory as group 'all' and every group/<clade> directory as
+    group <clade>.
+    '''
+    if inventory is None:
+        inventory = scan_inventory(dir_path, n_workers)
+
+    output = {}
+    for fb_id, record in inventory.items():
+        gene_dir = os.path.join(dir_path, fb_id)
+        groups = {ALL_GROUP: (gene_dir, record)}
+        for clade, group_record in record['groups'].items():
+            groups[clade] = (os.path.join(gene_dir, 'group', clade), group_record)
+        output[fb_id] = groups
+    return output
+
+def group_files(fb_id, group_dir):
+    '''
+    Returns the paths of the files of one group, keyed by kind.
+    '''
+    kinds = ['synonymous.Poly', 'missense.Poly', 'codonStats', 'SLAC', 'mask']
+    return {kind: os.path.join(group_dir, fb_id + '.' + kind + '.UniProt.bed')
+            for kind in kinds}
+
+# %% Per-gene task
+def count_group(fb_id, files, mask, record):
+    '''
+    Returns the LINEAGE_LABELS arrays (except FBgn_id and Group) of one group:
+    pN/pS counts at the codonStats positions joined with SLAC DN/DS at the same
+    positions. Positions in only one of the two tables get NaN (or 0 counts)
+    for the other. record is the group's inventory record, which says which
+    files exist.
+    '''
+    columns = {'UniProt_ID': np.array([], dtype = str),
+               'AA_pos': np.array([], dtype = np.int64)}
+
+    if has_files(record, ['synonymous.Poly', 'missense.Poly', 'codonStats']):
+        syn_df = var_parser(files['synonymous.Poly'], VAR_COLS)
+        mis_df = var_parser(files['missense.Poly'], VAR_COLS)
+        cstat_df = cstat_parser(files['codonStats'], CSTAT_COLS)
+        columns = count_pnps(mis_df, syn_df, cstat_df)
+
+    slac = None
+    if has_files(record, ['SLAC']):
+        slac = read_slac_bed(files['SLAC'], SLAC_COLS)
+
+    slac_pos = np.array([], dtype = np.int64) if slac is None \
+        else slac.Unknown.to_numpy(dtype = np.int64)
+    positions = np.union1d(columns['AA_pos'], slac_pos)
+
+    # Genes have one UniProt_ID; take it from whichever table has rows
+    uniprot_id = ''
+    if len(columns['UniProt_ID']) > 0:
+        uniprot_id = columns['UniProt_ID'][0]
+    elif slac is not None and len(slac) > 0:
+        uniprot_id = str(slac.UniProt_ID.iloc[0])
+
+    output = {'UniProt_ID': np.full(len(positions), uniprot_id, dtype = object),
+              'AA_pos': positions}
+    for label, fill in [('Species_count', 0), ('E[N]', np.nan), ('E[S]', np.nan),
+                        ('PN', 0), ('PS', 0)]:
+        values = columns.get(label, np.array([]))
+        output[label] = take(positions, columns['AA_pos'],
+                             np.asarray(values, dtype = float), fill)
+    for label, slac_label in [('E[N]_SLAC', 'E[N]'), ('E[S]_SLAC', 'E[S]'),
+                              ('DN', 'DN'), ('DS', 'DS')]:
+        values = np.array([]) if slac is None else slac[slac_label].to_numpy(dtype = float)
+        output[label] = take(positions, slac_pos, values)
+    output['Masked'] = in_intervals(mask, positions)
+
+    return output
+
+def get_lineage_arrays(entry, dir_path = None, exclude_masked = False,
+                       with_features = False):
+    '''
+    Per-gene task for aggregate.aggregate_lineages. entry is (FBgn_id, groups)
+    from scan_lineages. Each group uses its own mask file, falling back to the
+    top-level mask; features are loaded once per gene and shared by all
+    groups. Returns the LINEAGE_LABELS arrays of all groups, concatenated.
+    '''
+    fb_id, groups = entry
+    top_dir = groups[ALL_GROUP][0]
+    top_mask = load_mask(group_files(fb_id, top_dir)['mask'])
+    features = None
+    if with_features:
+        features = load_features(os.path.join(top_dir, fb_id + '.features.UniProt.bed'))
+
+    frame = []
+    for group, (group_dir, record) in groups.items():
+        files = group_files(fb_id, group_dir)
+        mask = load_mask(files['mask']) if has_files(record, ['mask']) else top_mask
+        columns = count_group(fb_id, files, mask, record)
+        if exclude_masked:
+            keep = ~columns['Masked']
+            columns = {label: values[keep] for label, values in columns.items()}
+        if features is not None:
+            columns['Features'] = annotate(columns['AA_pos'],
+                                           merge_intervals([], []),
+                                           features)['Features']
+        n = len(columns['AA_pos'])
+        columns['FBgn_id'] = np.full(n, fb_id, dtype = object)
+        columns['Group'] = np.full(n, group, dtype = object)
+        frame.append(columns)
+
+    labels = LINEAGE_LABELS + (['Features'] if with_features else [])
+    return {label: np.concatenate([columns[label] for columns in frame])
+            for label in labels}
+
+# %% Output table
+def lineage_df(columns):
+    '''
+    Makes the long per-lineage table from concatenated LINEAGE_LABELS arrays,
+    indexed by (FBgn_id, Group, AA_pos), with pN/pS and dN/dS added.
+    '''
+    df = pd.DataFrame(columns)
+    df = df.astype({'FBgn_id': str,
+                    'Group': str,
+                    'UniProt_ID': str,
+                    'AA_pos': int,
+                    'Species_count': int,
+                    'Masked': bool})
+
+    df['pN'] = df['PN'] / df['E[N]']
+    df['pS'] = df['PS'] / df['E[S]']
+    df['pN/pS'] = df.pN / df.pS
+    df['dN/dS'] = (df['DN'] / df['E[N]_SLAC']) / (df['DS'] / df['E[S]_SLAC'])
+
+    return df.set_index(['FBgn_id', 'Group', 'AA_pos'])
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Position lookups shared by the per-residue joins (join_engine, lineage).
+'''
+
+import numpy as np
+
+def take(keys, positions, values, fill = np.nan):
+    '''
+    Left join of keys onto (positions, values): returns the value at the row of
+    positions equal to each key, or fill where there is none. positions need
+    not be sorted.
+    '''
+    values = np.asarray(values)
+    order = np.argsort(positions, kind = 'stable')
+    sorted_pos = positions[order]
+    
+    idx = np.searchsorted(sorted_pos, keys)
+    found = idx < len(sorted_pos)
+    found[found] = sorted_pos[idx[found]] == keys[found]
+    
+    out = np.full(len(keys), fill, dtype = values.dtype)
+    out[found] = values[order][idx[found]]
+    return out
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Manifest of per-gene input files and cached per-gene results, used to make
+aggregation incremental. For every gene the manifest records the size, mtime
+and SHA-256 of each input file. A file whose size and mtime are unchanged is
+assumed unchanged; otherwise it is re-hashed, so touching a file without
+changing it does not force a recompute. Per-gene results are stored next to
+the manifest as .npz files of the count_pnps arrays.
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+
+MANIFEST = 'manifest.json'
+
+# %% File records
+def file_hash(file_path):
+    '''
+    Returns the SHA-256 hex digest of a file's contents.
+    '''
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as read:
+        for block in iter(lambda: read.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def file_record(file_path, old_record = None):
+    '''
+    Returns {'size', 'mtime_ns', 'sha256'} for a file. The hash is reused from
+    old_record if size and mtime have not changed. Optional inputs that do not
+    exist get a record of Nones.
+    '''
+    if not os.path.isfile(file_path):
+        return {'size': None, 'mtime_ns': None, 'sha256': None}
+    stat = os.stat(file_path)
+    record = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if old_record is not None and old_record['size'] == record['size'] \
+            and old_record['mtime_ns'] == record['mtime_ns']:
+        record['sha256'] = old_record['sha256']
+    else:
+        record['sha256'] = file_hash(file_path)
+    return record
+
+def gene_records(file_paths, old_records = None):
+    '''
+    Returns the file records of one gene's inputs, keyed by file name.
+    '''
+    old_records = {} if old_records is None else old_records
+    return {os.path.basename(path): file_record(path, old_records.get(os.path.basename(path)))
+            for path in file_paths}
+
+def same_content(records, old_records):
+    '''
+    True if two sets of file records have the same files and hashes.
+    '''
+    if old_records is None or records.keys() != old_records.keys():
+        return False
+    return all(records[name]['sha256'] == old_records[name]['sha256']
+               for name in records)
+
+# %% Manifest
+def load_manifest(manifest_dir):
+    '''
+    Returns the manifest in manifest_dir, or an empty one. The manifest maps
+    a result kind (e.g. 'pnps') to {FBgn_id: file records}.
+    '''
+    manifest_path = os.path.join(manifest_dir, MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as read:
+        return json.load(read)
+
+def save_manifest(manifest_dir, manifest):
+    '''
+    Writes the manifest atomically.
+    '''
+    os.makedirs(manifest_dir, exist_ok = True)
+    tmp_path = os.path.join(manifest_dir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as write:
+        json.dump(manifest, write)
+    os.replace(tmp_path, os.path.join(manifest_dir, MANIFEST))
+
+# %% Per-gene results
+def result_path(manifest_dir, kind, fb_id):
+    return os.path.join(manifest_dir, kind, fb_id + '.npz')
+
+def save_result(manifest_dir, kind, fb_id, arrays):
+    '''
+    Stores a dict of arrays for one gene.
+    '''
+    path = result_path(manifest_dir, kind, fb_id)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+def load_result(manifest_dir, kind, fb_id):
+    '''
+    Returns the stored dict of arrays for one gene, or None if missing.
+    '''
+    path = result_path(manifest_dir, kind, fb_id)
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+def remove_result(manifest_dir, kind, fb_id):
+    path = result_path(manifest_dir, kind, fb_id)
+    if os.path.isfile(path):
+        os.remove(path)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Fixed-column PDB reader that parses ATOM/HETATM records straight into NumPy
+arrays, without building a Bio.PDB structure. Meant for single-model files
+such as the AlphaFold refprot models; only the first model is read. Files
+ending in .gz are decompressed on the fly.
+'''
+
+import gzip
+import numpy as np
+
+# (start, stop) of the fixed PDB columns, 0-based
+ATOM_FIELDS = {'record': (0, 6),
+               'name': (12, 16),
+               'altloc': (16, 17),
+               'resname': (17, 20),
+               'chain': (21, 22),
+               'resseq': (22, 26),
+               'icode': (26, 27),
+               'x': (30, 38),
+               'y': (38, 46),
+               'z': (46, 54),
+               'occupancy': (54, 60),
+               'bfactor': (60, 66),
+               'element': (76, 78)}
+
+LINE_WIDTH = 80
+
+# %% Read
+def open_pdb(file):
+    '''
+    Opens a PDB file for reading in binary mode, gunzipping .gz files.
+    '''
+    if str(file).endswith('.gz'):
+        return gzip.open(file, 'rb')
+    return open(file, 'rb')
+
+def atom_lines(file):
+    '''
+    Returns the ATOM/HETATM lines of the first model as an (N, 80) array of
+    single bytes, each line padded or cut to 80 columns.
+    '''
+    lines = []
+    with open_pdb(file) as read:
+        for line in read:
+            if line.startswith((b'ATOM  ', b'HETATM')):
+                lines.append(line.rstrip(b'\r\n').ljust(LINE_WIDTH)[:LINE_WIDTH])
+            elif line.startswith(b'ENDMDL'):
+                break
+    return np.frombuffer(b''.join(lines), dtype = 'S1').reshape(-1, LINE_WIDTH)
+
+def field(lines, label):
+    '''
+    Returns one fixed-width column of atom_lines as a 1D bytes array.
+    '''
+    start, stop = ATOM_FIELDS[label]
+    return np.ascontiguousarray(lines[:, start:stop]).view('S' + str(stop - start)).ravel()
+
+def read_atoms(file):
+    '''
+    Returns a dict of per-atom arrays: str name, altloc, resname, chain, icode
+    and element, bool hetatm, int resseq, float32 (N,3) coord, and float
+    occupancy and bfactor. For atoms with alternate
+    locations only the one with the highest occupancy is kept, as Bio.PDB
+    does.
+    '''
+    lines = atom_lines(file)
+
+    # Chain and residue name are kept unstripped, as in Bio.PDB
+    atoms = {label: np.char.strip(field(lines, label)).astype(str)
+             for label in ['name', 'altloc', 'icode', 'element']}
+    atoms['resname'] = field(lines, 'resname').astype(str)
+    atoms['chain'] = field(lines, 'chain').astype(str)
+    atoms['hetatm'] = field(lines, 'record') == b'HETATM'
+    atoms['resseq'] = field(lines, 'resseq').astype(np.int64)
+    atoms['coord'] = np.stack([field(lines, label).astype(np.float32)
+                               for label in ['x', 'y', 'z']], axis = 1)
+
+    # Blank occupancy is read as 1.0 and blank B-factor as 0.0, as in Bio.PDB
+    for label, default in [('occupancy', 1.0), ('bfactor', 0.0)]:
+        values = np.char.strip(field(lines, label))
+        atoms[label] = np.full(len(values), default)
+        filled = values != b''
+        atoms[label][filled] = values[filled].astype(np.float64)
+
+    if (atoms['altloc'] != '').any():
+        atoms = first_altloc(atoms)
+
+    return atoms
+
+def first_altloc(atoms):
+    '''
+    Keeps one copy of every atom with alternate locations: the one with the
+    highest occupancy, or the first one listed on ties.
+    '''
+    residue = residue_index(atoms)
+    keys = np.char.add(np.char.add(residue.astype(str), ':'), atoms['name'])
+    order = np.lexsort((np.arange(len(keys)), -atoms['occupancy'], keys))
+    first = np.ones(len(order), dtype = bool)
+    first[1:] = keys[order][1:] != keys[order][:-1]
+    keep = np.sort(order[first])
+    return {label: values[keep] for label, values in atoms.items()}
+
+# %% Residues
+def residue_index(atoms):
+    '''
+    Returns the residue number (0, 1, 2, ...) of every atom. A new residue
+    starts wherever chain, resSeq, insertion code or residue name changes
+    from the previous atom.
+    '''
+    n = len(atoms['resseq'])
+    new = np.ones(n, dtype = bool)
+    if n > 0:
+        new[1:] = (atoms['chain'][1:] != atoms['chain'][:-1]) \
+            | (atoms['resseq'][1:] != atoms['resseq'][:-1]) \
+            | (atoms['icode'][1:] != atoms['icode'][:-1]) \
+            | (atoms['resname'][1:] != atoms['resname'][:-1])
+    return np.cumsum(new) - 1
+
+def residue_starts(atoms):
+    '''
+    Returns the index of the first atom of every residue.
+    '''
+    residue = residue_index(atoms)
+    return np.flatnonzero(np.diff(residue, prepend = -1))
+
+# %% pLDDT filtering
+def write_confident_pdb(file, output_path, min_plddt):
+    '''
+    Writes a copy of a PDB file without the ATOM/HETATM records of residues
+    whose alpha-carbon B-factor (pLDDT in AlphaFold models) is below
+    min_plddt. All other records are copied unchanged.
+    '''
+    atoms = read_atoms(file)
+    low = (atoms['name'] == 'CA') & (atoms['bfactor'] < min_plddt)
+    drop = set(zip(atoms['chain'][low], atoms['resseq'][low].tolist(), 
+                   atoms['icode'][low]))
+
+    with open_pdb(file) as read, open(output_path, 'wb') as write:
+        for line in read:
+            if line.startswith((b'ATOM  ', b'HETATM')):
+                key = (line[21:22].decode(), int(line[22:26]), 
+                       line[26:27].decode().strip())
+                if key in drop:
+                    continue
+            write.write(line)
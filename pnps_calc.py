@@ -1,62 +1,122 @@
+import numpy as np
 import pandas as pd
+from bed_parser import read_allpoly_bed, read_var_bed, read_adj_var_bed, read_cstat_bed
+from column_store import append_columns
+from intervals import in_intervals, interval_paths, load_mask
 
 
-# Parse variant list file into a dataframe
-def var_parser(file_path):
-    frame = []
+# Columns of the variant and codonstat files needed to count pN, pS
+VAR_COLS = ['AA_pos']
+CSTAT_COLS = ['UniProt_ID', 'AA_pos', 'Codon_index', 'E[N]', 'E[S]']
 
-    labels = ['UniProt_ID',
-              'AA_pos',
-              'AA_pos_end',
-              'Data']
+# Columns of the ADJ.Poly files needed for weighted pN, pS
+ADJ_VAR_COLS = ['AA_pos', 'Weight']
 
-    with open(file_path) as read:
-        for line in read:
-            entry = line.split() # Split by tabs
-            
-            if len(entry) != len(labels):# In case of missing data
-                print('Missing data')
-                raise ValueError
-                
-            frame.append(entry)
+# Parse variant list file into a dataframe
+def var_parser(file_path, usecols = None):
+    return read_var_bed(file_path, usecols)
 
-    df = pd.DataFrame(frame, columns = labels)
-    df = df.astype({"AA_pos": int, "AA_pos_end": int})
-    
-    return df
+# Parse adjusted (ADJ.Poly) variant list file into a dataframe
+'''
+Includes Weight and, unless info_keys = None, the ANC, DER and SP INFO fields.
+'''
+def adj_var_parser(file_path, usecols = None, info_keys = ['ANC', 'DER', 'SP']):
+    return read_adj_var_bed(file_path, usecols, info_keys)
+
+# Parse allPoly variant list file into a dataframe
+'''
+By default only the SP species and the first ANN consequence (ANN_effect) are
+extracted from INFO, see bed_parser.parse_info.
+'''
+def allpoly_parser(file_path, usecols = VAR_COLS, info_keys = ['SP', 'ANN_effect']):
+    return read_allpoly_bed(file_path, usecols, info_keys)
 
 # Parse codonstat list file into a dataframe
-def cstat_parser(file_path):
-    frame = []
-    
-    labels = ['UniProt_ID',
-              'AA_pos',
-              'AA_pos_end',
-              'Species',
-              'Codon_index',
-              'AA',
-              'Codon',
-              'E[N]',
-              'E[S]']
-    
-    with open(file_path) as read:
-        for line in read:
-            entry = line.split() # Split by tabs
-            data = entry[-1].split(":") # Split data entry by :
-            data = [data[0]] + data[1].split(",") # Split data entry by ,
-            
-            entry = entry[:-1] + data # Stitch together
-
-            if len(entry) != len(labels):# In case of missing data
-                print('Missing data')
-                raise ValueError
-        
-            frame.append(entry)
+def cstat_parser(file_path, usecols = None):
+    return read_cstat_bed(file_path, usecols)
 
-    df = pd.DataFrame(frame, columns = labels)
-    df = df.astype({'AA_pos': int, 'AA_pos_end': int, 'E[N]': float, 'E[S]': float})
-                   
-    return df
+# Count variants per position
+'''
+Returns an array where entry i is the number of variants at AA_pos = i, for
+positions 0 to n_pos - 1. Variants outside that range are not counted. If
+weights are given, entry i is the sum of the weights of those variants.
+'''
+def count_positions(var_pos, n_pos, weights = None):
+    inside = (var_pos >= 0) & (var_pos < n_pos)
+    if weights is not None:
+        weights = weights[inside]
+    return np.bincount(var_pos[inside], minlength = n_pos, weights = weights)
+
+# Per-variant weights of a variant table
+'''
+Adjusted (ADJ.Poly) tables have a Weight column; plain tables count 1 per line.
+'''
+def var_weights(var_df):
+    if 'Weight' in var_df:
+        return var_df['Weight'].to_numpy(dtype = float)
+    return None
+
+# Count PN, PS, E[N], E[S]
+'''
+Counts variants and expected sites per position and returns them as a dict of
+arrays, one per label in PNPS_LABELS. Each table is reduced once with bincount
+over AA_pos, skipping the first pos (AA_pos = 0). Arrays are compact to pass
+between processes, see aggregate.aggregate_pnps. If a mask index is given (see
+intervals.load_mask), masked positions are dropped as well. If the variant
+tables are adjusted ones (with a Weight column), PN and PS are weighted sums.
+'''
+PNPS_LABELS = ['UniProt_ID', 
+               'AA_pos', 
+               'Codon_index',
+               'Species_count',
+               'E[N]', 
+               'E[S]', 
+               'PN', 
+               'PS']
+
+def count_pnps(mis_df, syn_df, cstat_df, mask = None):
+    
+    # Catches cases where there is no data
+    if len(cstat_df) == 0:
+        return {'UniProt_ID': np.array([], dtype = str),
+                'AA_pos': np.array([], dtype = np.int64),
+                'Codon_index': np.array([], dtype = str),
+                'Species_count': np.array([], dtype = np.int64),
+                'E[N]': np.array([], dtype = float),
+                'E[S]': np.array([], dtype = float),
+                'PN': np.array([], dtype = np.int64),
+                'PS': np.array([], dtype = np.int64)}
+    
+    cstat_pos = cstat_df.AA_pos.to_numpy()
+    n_pos = cstat_pos.max() + 1
+    keep = cstat_pos >= 1
+    if mask is not None:
+        keep &= ~in_intervals(mask, cstat_pos)
+    
+    # Get expected missense (E_N) and synonymous (E_S) by summing across species
+    species_count = np.bincount(cstat_pos[keep], minlength = n_pos)
+    E_N = np.bincount(cstat_pos[keep], minlength = n_pos,
+                      weights = cstat_df['E[N]'].to_numpy(dtype = float)[keep])
+    E_S = np.bincount(cstat_pos[keep], minlength = n_pos,
+                      weights = cstat_df['E[S]'].to_numpy(dtype = float)[keep])
+    
+    # Get observed missense (PN) and synonymous (PS)
+    PN = count_positions(mis_df.AA_pos.to_numpy(), n_pos, var_weights(mis_df))
+    PS = count_positions(syn_df.AA_pos.to_numpy(), n_pos, var_weights(syn_df))
+    
+    # Masked positions (cstat missing) are dropped; ID and codon are taken 
+    # from the first codonStat row of each remaining position
+    positions, first = np.unique(cstat_pos[keep], return_index = True)
+    first = np.flatnonzero(keep)[first]
+    
+    return {'UniProt_ID': cstat_df.UniProt_ID.to_numpy(dtype = str)[first],
+            'AA_pos': positions,
+            'Codon_index': cstat_df.Codon_index.to_numpy(dtype = str)[first],
+            'Species_count': species_count[positions],
+            'E[N]': E_N[positions],
+            'E[S]': E_S[positions],
+            'PN': PN[positions],
+            'PS': PS[positions]}
 
 # Calculate pN, pS
 '''
@@ -71,69 +131,30 @@ outputs just the PN, PS, E[N], E[S] values as a nested list.
 def calc_pnps(mis_df, syn_df, cstat_df, iterate = False):
     frame = []
     
-    labels = ['UniProt_ID', 
-              'AA_pos', 
-              'Codon_index',
-              'Species_count',
-              'E[N]', 
-              'E[S]', 
-              'PN', 
-              'PS']
-    
     # Catches cases where there is no data
     if len(cstat_df) == 0:
         
         if iterate == True:
             return frame
         
-        labels = ['UniProt_ID', 
-                  'AA_pos', 
-                  'Codon_index',
-                  'Species_count',
-                  'E[N]', 
-                  'E[S]', 
-                  'PN', 
-                  'PS',
-                  'pN',
-                  'pS',
-                  'pN/pS']
+        labels = PNPS_LABELS + ['pN', 'pS', 'pN/pS']
         df = pd.DataFrame(columns = labels)
         
         return df 
     
     # If there is data, count variants
-    for i in range(1, max(cstat_df.AA_pos)+1): # Skips first pos
-    
-        # Get observed missense (PN) and synonymous (PS)
-        PN = len(mis_df[mis_df.AA_pos == i])
-        PS = len(syn_df[syn_df.AA_pos == i])
-        
-        # Get expected missense (E_N) and synonymous (E_S) by summing across species
-        cstat = cstat_df[cstat_df.AA_pos == i]
-        E_N = sum(cstat['E[N]'])
-        E_S = sum(cstat['E[S]'])
-        
-        # Check if this is a masked position (cstat missing)
-        if len(cstat) == 0:
-            continue
-        
-        # Stitch and add to frame
-        entry = [cstat.UniProt_ID[:1].item(),
-                 i,
-                 cstat.Codon_index[:1].item(),
-                 len(cstat),
-                 E_N,
-                 E_S,
-                 PN,
-                 PS]
-        frame.append(entry)
+    columns = count_pnps(mis_df, syn_df, cstat_df)
     
     # Exit here and return frame if iterate = True
     if iterate == True:
-        return frame
+        columns = [columns[label].tolist() for label in PNPS_LABELS]
+        return [list(entry) for entry in zip(*columns)]
     
-    # If returning dataframe for a single, calculate additional values
-    df = pd.DataFrame(frame, columns = labels)
+    return pnps_df(columns)
+
+# Make pN/pS dataframe from count_pnps arrays
+def pnps_df(columns):
+    df = pd.DataFrame({label: columns[label] for label in PNPS_LABELS})
     df = df.astype({'AA_pos': int,
                     'Species_count': int,
                     'E[N]': float, 
@@ -141,6 +162,11 @@ def calc_pnps(mis_df, syn_df, cstat_df, iterate = False):
                     'PN': float,
                     'PS': float})
     
+    return add_ratios(df)
+
+# Add pN, pS and pN/pS from summed counts
+def add_ratios(df):
+    
     df['pN'] = df['PN'] / df['E[N]']
     df['pS'] = df['PS'] / df['E[S]']
     df['pN/pS'] = df.pN / df.pS
@@ -162,6 +188,28 @@ def get_single_pnps_csv(fb_id, dir_path, output_filepath):
 
     return df
 
+# Get pnps for a single fb_id and append it to a column store
+'''
+Like get_single_pnps_csv, but the gene's rows are appended to the column_store
+at store_path, keyed by an FBgn_id column added in front, so all genes share
+one store and each is read back with column_store.read_gene. Genes without
+data are not written.
+'''
+def get_single_pnps_store(fb_id, dir_path, store_path):
+    
+    syn_path = dir_path + '/' + fb_id + '/' + fb_id + '.synonymous.Poly.UniProt.bed'
+    mis_path = dir_path + '/' + fb_id + '/' + fb_id + '.missense.Poly.UniProt.bed'
+    cstat_path = dir_path + '/' + fb_id + '/' + fb_id + '.codonStats.UniProt.bed'
+    
+    syn_df, mis_df, cstat_df = var_parser(syn_path), var_parser(mis_path), cstat_parser(cstat_path)
+    df = calc_pnps(mis_df, syn_df, cstat_df)
+    
+    if len(df) > 0:
+        df.insert(0, 'FBgn_id', fb_id)
+        append_columns(store_path, df, key = 'FBgn_id')
+
+    return df
+
 # Get PN, PS, E[N], E[S]
 '''
 This function will feed into the aggregate function to calculate pnps
@@ -173,8 +221,209 @@ def get_poly_vals(fb_id, dir_path):
     mis_path = dir_path + '/' + fb_id + '/' + fb_id + '.missense.Poly.UniProt.bed'
     cstat_path = dir_path + '/' + fb_id + '/' + fb_id + '.codonStats.UniProt.bed'
     
-    syn_df, mis_df, cstat_df = var_parser(syn_path), var_parser(mis_path), cstat_parser(cstat_path)
+    # Only the columns used by calc_pnps are materialized
+    syn_df, mis_df = var_parser(syn_path, VAR_COLS), var_parser(mis_path, VAR_COLS)
+    cstat_df = cstat_parser(cstat_path, CSTAT_COLS)
     frame = calc_pnps(mis_df, syn_df, cstat_df, iterate = True)
     
     return frame
-    
\ No newline at end of file
+
+# Get PN, PS, E[N], E[S] as arrays
+'''
+Same as get_poly_vals, but returns the count_pnps dict of arrays. This is the
+per-gene task run by worker processes in aggregate.aggregate_pnps. With
+exclude_masked, positions in the gene's mask.UniProt.bed are dropped. With
+adjusted, variants are read from the ADJ.Poly files and weighted. INFO is not
+parsed, so this runs at the same speed as the unadjusted path.
+'''
+def get_poly_arrays(fb_id, dir_path, exclude_masked = False, adjusted = False):
+    
+    syn_path, mis_path, cstat_path = poly_paths(fb_id, dir_path, adjusted)
+    
+    if adjusted:
+        syn_df = adj_var_parser(syn_path, ADJ_VAR_COLS, info_keys = None)
+        mis_df = adj_var_parser(mis_path, ADJ_VAR_COLS, info_keys = None)
+    else:
+        syn_df, mis_df = var_parser(syn_path, VAR_COLS), var_parser(mis_path, VAR_COLS)
+    cstat_df = cstat_parser(cstat_path, CSTAT_COLS)
+    
+    mask = None
+    if exclude_masked:
+        mask = load_mask(interval_paths(fb_id, dir_path)[0])
+    
+    return count_pnps(mis_df, syn_df, cstat_df, mask)
+
+# Input files of get_poly_arrays
+def poly_paths(fb_id, dir_path, adjusted = False):
+    
+    poly = '.ADJ.Poly.UniProt.bed' if adjusted else '.Poly.UniProt.bed'
+    syn_path = dir_path + '/' + fb_id + '/' + fb_id + '.synonymous' + poly
+    mis_path = dir_path + '/' + fb_id + '/' + fb_id + '.missense' + poly
+    cstat_path = dir_path + '/' + fb_id + '/' + fb_id + '.codonStats.UniProt.bed'
+    
+    return syn_path, mis_path, cstat_path
+
+# Input files of get_poly_arrays with exclude_masked = True
+def masked_poly_paths(fb_id, dir_path, adjusted = False):
+    
+    return poly_paths(fb_id, dir_path, adjusted) + interval_paths(fb_id, dir_path)[:1]
+
+# Count PN, PS, E[N], E[S] per species
+'''
+Same as count_pnps, but per (species, position): E[N] and E[S] come from the
+codonStats rows of each species, and PN and PS are the weighted counts of the
+ADJ.Poly variants whose SP is that species. Each table is reduced with one
+bincount over a combined species*n_pos + AA_pos key. Only (species, position)
+pairs with a codonStats row are returned.
+'''
+SPECIES_LABELS = ['UniProt_ID',
+                  'AA_pos',
+                  'Species',
+                  'E[N]',
+                  'E[S]',
+                  'PN',
+                  'PS']
+
+def count_species_pnps(mis_df, syn_df, cstat_df, mask = None):
+    
+    cstat_pos = cstat_df.AA_pos.to_numpy()
+    n_pos = cstat_pos.max(initial = 0) + 1
+    
+    keep = cstat_pos >= 1
+    if mask is not None:
+        keep &= ~in_intervals(mask, cstat_pos)
+    species, species_code = np.unique(cstat_df.Species.to_numpy(dtype = str)[keep], 
+                                      return_inverse = True)
+    
+    n_keys = len(species)*n_pos
+    cstat_key = species_code*n_pos + cstat_pos[keep]
+    E_N = np.bincount(cstat_key, minlength = n_keys,
+                      weights = cstat_df['E[N]'].to_numpy(dtype = float)[keep])
+    E_S = np.bincount(cstat_key, minlength = n_keys,
+                      weights = cstat_df['E[S]'].to_numpy(dtype = float)[keep])
+    
+    # Variants of species without codonStats rows are not counted
+    counts = []
+    for var_df in [mis_df, syn_df]:
+        matrix = species_position_matrix(var_df.SP.to_numpy(dtype = str), 
+                                         var_df.AA_pos.to_numpy(), species, n_pos,
+                                         var_weights(var_df))
+        counts.append(matrix.ravel())
+    
+    keys, first = np.unique(cstat_key, return_index = True)
+    
+    return {'UniProt_ID': cstat_df.UniProt_ID.to_numpy(dtype = str)[keep][first],
+            'AA_pos': keys % n_pos,
+            'Species': species[keys // n_pos],
+            'E[N]': E_N[keys],
+            'E[S]': E_S[keys],
+            'PN': counts[0][keys],
+            'PS': counts[1][keys]}
+
+# Get per-species PN, PS, E[N], E[S] as arrays
+'''
+Per-gene task for aggregate.aggregate_species_pnps: reads the ADJ.Poly files
+with their SP field and counts them with count_species_pnps.
+'''
+def get_species_arrays(fb_id, dir_path, exclude_masked = False):
+    
+    syn_path, mis_path, cstat_path = poly_paths(fb_id, dir_path, adjusted = True)
+    
+    syn_df = adj_var_parser(syn_path, ADJ_VAR_COLS, info_keys = ['SP'])
+    mis_df = adj_var_parser(mis_path, ADJ_VAR_COLS, info_keys = ['SP'])
+    cstat_df = cstat_parser(cstat_path, CSTAT_COLS + ['Species'])
+    
+    mask = None
+    if exclude_masked:
+        mask = load_mask(interval_paths(fb_id, dir_path)[0])
+    
+    return count_species_pnps(mis_df, syn_df, cstat_df, mask)
+
+# Species x position count matrix
+'''
+Returns an (N species, n_pos) matrix where entry (s, i) is the number of
+entries of species[s] at position i, or the sum of their weights if weights
+are given. Entries of other species or outside 0 to n_pos - 1 are not
+counted. The matrix is filled with one bincount over species*n_pos + position.
+'''
+def species_position_matrix(entry_species, positions, species, n_pos, weights = None):
+    
+    entry_species = np.asarray(entry_species, dtype = str)
+    positions = np.asarray(positions, dtype = np.int64)
+    
+    code = np.searchsorted(species, entry_species)
+    found = code < len(species)
+    found[found] = species[code[found]] == entry_species[found]
+    found &= (positions >= 0) & (positions < n_pos)
+    if weights is not None:
+        weights = np.asarray(weights, dtype = float)[found]
+    
+    counts = np.bincount(code[found]*n_pos + positions[found],
+                         minlength = len(species)*n_pos, weights = weights)
+    return counts.reshape(len(species), n_pos)
+
+# Count PN, PS, E[N], E[S] per species from the allPoly file
+'''
+Species-resolved counts as species x position matrices. Variants come from
+the allPoly file and are split by the consequence of their first ANN
+annotation: missense_variant counts to PN and synonymous_variant to PS,
+including combined consequences such as
+splice_region_variant&synonymous_variant. E[N] and E[S] are the codonStats
+values of each species. Rows are the species with codonStats rows and
+columns the positions kept by count_pnps (AA_pos >= 1, not masked).
+'''
+def count_allpoly_matrices(allpoly_df, cstat_df, mask = None):
+    
+    cstat_pos = cstat_df.AA_pos.to_numpy()
+    n_pos = cstat_pos.max(initial = 0) + 1
+    
+    keep = cstat_pos >= 1
+    if mask is not None:
+        keep &= ~in_intervals(mask, cstat_pos)
+    cstat_species = cstat_df.Species.to_numpy(dtype = str)
+    species = np.unique(cstat_species[keep])
+    positions = np.unique(cstat_pos[keep])
+    
+    matrices = {}
+    for label in ['E[N]', 'E[S]']:
+        matrix = species_position_matrix(cstat_species[keep], cstat_pos[keep], 
+                                         species, n_pos,
+                                         cstat_df[label].to_numpy(dtype = float)[keep])
+        matrices[label] = matrix[:, positions]
+    
+    # Consequences may be combined with '&', e.g. missense_variant&splice_region_variant
+    effects = allpoly_df.ANN_effect.fillna('').to_numpy(dtype = str)
+    effects = np.char.add(np.char.add('&', effects), '&')
+    var_species = allpoly_df.SP.fillna('').to_numpy(dtype = str)
+    var_pos = allpoly_df.AA_pos.to_numpy()
+    for label, effect in [('PN', 'missense_variant'), ('PS', 'synonymous_variant')]:
+        is_effect = np.char.find(effects, '&' + effect + '&') >= 0
+        matrix = species_position_matrix(var_species[is_effect], var_pos[is_effect],
+                                         species, n_pos)
+        matrices[label] = matrix[:, positions]
+    
+    uniprot_id = cstat_df.UniProt_ID.iloc[0] if len(cstat_df) > 0 else ''
+    
+    return dict({'UniProt_ID': uniprot_id,
+                 'Species': species,
+                 'AA_pos': positions}, **matrices)
+
+# Get per-species PN, PS, E[N], E[S] matrices
+'''
+Per-gene species x position matrices from the allPoly and codonStats files,
+see count_allpoly_matrices. Summing a matrix over axis 1 gives per-species
+totals for species-specific pN/pS.
+'''
+def get_allpoly_matrices(fb_id, dir_path, exclude_masked = False):
+    
+    allpoly_path = dir_path + '/' + fb_id + '/' + fb_id + '.allPoly.UniProt.bed'
+    cstat_path = dir_path + '/' + fb_id + '/' + fb_id + '.codonStats.UniProt.bed'
+    
+    allpoly_df = allpoly_parser(allpoly_path)
+    cstat_df = cstat_parser(cstat_path, CSTAT_COLS + ['Species'])
+    
+    mask = None
+    if exclude_masked:
+        mask = load_mask(interval_paths(fb_id, dir_path)[0])
+    
+    return count_allpoly_matrices(allpoly_df, cstat_df, mask)
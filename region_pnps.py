@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Aggregates per-residue pN/pS and dN/dS over regions: UniProt features such as
+domains, sliding windows, and structural classes such as DSSP Sec_Struct or
+RASA bins. The summed labels are a parameter: SUM_LABELS (PN, PS, E[N], E[S])
+for the aggregate.aggregate_pnps table, DNDS_LABELS (DN, DS, E[N], E[S]) for a
+join_engine table and LINEAGE_DNDS_LABELS for the SLAC columns of a lineage
+table. Counts and expectations are summed over each region before the ratios
+are taken; missing values count as 0. Region sums come from prefix
+(cumulative) sums over all genes at once: residues are ordered by (gene,
+AA_pos), so the sum over any region is the difference of two prefix sums found
+by searchsorted, and every region costs O(log N) after one O(N) pass.
+
+Regions use the 0-based, end-exclusive coordinates of the BED files, which is
+also what AA_pos holds in the pN/pS and lineage tables. join_engine tables
+hold the 1-based SLAC position and go through join_table first. A lineage
+table has one row per (Group, AA_pos), so it is aggregated over regions one
+Group at a time, or with 'Group' in the by of class_pnps.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+from intervals import interval_paths, load_features
+from pnps_calc import add_ratios
+
+SUM_LABELS = ['PN', 'PS', 'E[N]', 'E[S]']
+DNDS_LABELS = ['DN', 'DS', 'E[N]', 'E[S]']
+LINEAGE_DNDS_LABELS = ['DN', 'DS', 'E[N]_SLAC', 'E[S]_SLAC']
+
+# %% Tables
+def join_table(df):
+    '''
+    Returns a join_engine table (indexed or not by UniProt_ID and AA_pos) with
+    AA_pos shifted from the 1-based SLAC position to the 0-based BED start.
+    '''
+    df = df.reset_index() if 'AA_pos' not in df.columns else df
+    return df.assign(AA_pos = df.AA_pos.astype(np.int64) - 1)
+
+def add_region_ratios(df, labels):
+    '''
+    Adds the ratios of the summed labels: pN, pS and pN/pS if PN and PS are
+    summed, dN, dS and dN/dS if DN and DS are. dN and dS are taken over
+    E[N]_SLAC and E[S]_SLAC if those are summed, else over E[N] and E[S].
+    '''
+    if 'PN' in labels:
+        df = add_ratios(df)
+    if 'DN' in labels:
+        suffix = '_SLAC' if 'E[N]_SLAC' in labels else ''
+        df['dN'] = df['DN'] / df['E[N]' + suffix]
+        df['dS'] = df['DS'] / df['E[S]' + suffix]
+        df['dN/dS'] = df.dN / df.dS
+    return df
+
+# %% Prefix sums
+def prefix_sums(df, labels = SUM_LABELS):
+    '''
+    Returns the prefix sums of labels over all residues of a table, ordered by
+    (UniProt_ID, AA_pos). Residues are addressed by a single int64 key, gene
+    code*stride + AA_pos, so regions of all genes can be looked up with one
+    searchsorted call.
+    '''
+    labels = list(labels)
+    df = df.reset_index() if 'AA_pos' not in df.columns else df
+    genes, codes = np.unique(df.UniProt_ID.to_numpy(dtype = str), 
+                             return_inverse = True)
+    positions = df.AA_pos.to_numpy(dtype = np.int64)
+    stride = positions.max(initial = 0) + 2
+    keys = codes.astype(np.int64)*stride + positions
+    order = np.argsort(keys, kind = 'stable')
+
+    prefix = {'genes': genes, 'stride': stride, 'keys': keys[order], 'labels': labels}
+    for label in ['n_pos'] + labels:
+        values = np.ones(len(df)) if label == 'n_pos' \
+            else np.nan_to_num(df[label].to_numpy(dtype = float)[order], nan = 0)
+        prefix[label] = np.concatenate([[0], np.cumsum(values)])
+    return prefix
+
+def region_sums(prefix, uniprot_ids, starts, ends):
+    '''
+    Returns a dict with the number of residues (n_pos) and the sums of the
+    labels of prefix over each region [start, end) of a gene. Genes missing
+    from the table give empty regions.
+    '''
+    genes, stride = prefix['genes'], prefix['stride']
+    uniprot_ids = np.asarray(uniprot_ids, dtype = str)
+    code = np.searchsorted(genes, uniprot_ids)
+    found = code < len(genes)
+    found[found] = genes[code[found]] == uniprot_ids[found]
+
+    starts = np.clip(np.asarray(starts, dtype = np.int64), 0, stride - 1)
+    ends = np.clip(np.asarray(ends, dtype = np.int64), 0, stride - 1)
+    lo = np.searchsorted(prefix['keys'], code*stride + starts, side = 'left')
+    hi = np.searchsorted(prefix['keys'], code*stride + ends, side = 'left')
+    hi = np.where(found & (ends > starts), hi, lo)
+
+    sums = {label: prefix[label][hi] - prefix[label][lo]
+            for label in ['n_pos'] + prefix['labels']}
+    sums['n_pos'] = sums['n_pos'].astype(np.int64)
+    return sums
+
+def region_pnps(df, regions, prefix = None, labels = SUM_LABELS):
+    '''
+    Returns the regions dataframe (UniProt_ID, AA_start, AA_end and any other
+    columns) with n_pos, the summed labels and their ratios added, see
+    add_region_ratios. A prefix from prefix_sums(df, labels) can be passed to
+    reuse it across calls.
+    '''
+    prefix = prefix_sums(df, labels) if prefix is None else prefix
+    sums = region_sums(prefix, regions.UniProt_ID, regions.AA_start, 
+                       regions.AA_end)
+    output = regions.reset_index(drop = True)
+    for label in ['n_pos'] + prefix['labels']:
+        output[label] = sums[label]
+    return add_region_ratios(output, prefix['labels'])
+
+# %% Regions
+def window_regions(df, width, step):
+    '''
+    Returns sliding windows [start, start + width) every step residues for
+    every gene in a pN/pS table, from position 0 to the last AA_pos. Genes
+    shorter than width get one window.
+    '''
+    df = df.reset_index() if 'AA_pos' not in df.columns else df
+    length = df.groupby('UniProt_ID', sort = True).AA_pos.max() + 1
+    n_windows = np.maximum(-(-(length.to_numpy() - width)//step), 0) + 1
+
+    gene = np.repeat(np.arange(len(length)), n_windows)
+    first = np.repeat(np.cumsum(n_windows) - n_windows, n_windows)
+    starts = (np.arange(n_windows.sum()) - first)*step
+
+    return pd.DataFrame({'UniProt_ID': length.index.to_numpy(dtype = str)[gene],
+                         'AA_start': starts,
+                         'AA_end': starts + width})
+
+def feature_regions(dir_path, fb_ids):
+    '''
+    Returns the features of all genes as one regions dataframe, with the
+    FBgn_id, feature type, description and label of each feature.
+    '''
+    frame = []
+    for fb_id in fb_ids:
+        features = load_features(interval_paths(fb_id, dir_path)[1])
+        features.insert(0, 'FBgn_id', fb_id)
+        frame.append(features)
+    if len(frame) == 0:
+        frame = [load_features(os.devnull)]
+    return pd.concat(frame, ignore_index = True)
+
+# %% Aggregations
+def window_pnps(df, width = 30, step = 10, labels = SUM_LABELS):
+    '''
+    pN/pS (or dN/dS, see labels) over sliding windows of every gene, see
+    window_regions.
+    '''
+    return region_pnps(df, window_regions(df, width, step), labels = labels)
+
+def domain_pnps(df, dir_path, fb_ids, labels = SUM_LABELS):
+    '''
+    pN/pS (or dN/dS, see labels) over every UniProt feature (domains,
+    regions, secondary structure, ...) of the given genes, see
+    feature_regions.
+    '''
+    return region_pnps(df, feature_regions(dir_path, fb_ids), labels = labels)
+
+def class_pnps(df, by, classes = None, labels = SUM_LABELS):
+    '''
+    pN/pS (or dN/dS, see labels) summed over residue classes, e.g. by =
+    ['UniProt_ID', 'Sec_Struct'] for per-gene secondary structure classes or
+    by = 'RASA_bin' (see rasa_bins) across all genes. df is a table whose
+    AA_pos is the 0-based BED start. The class columns are either already on
+    df (in that convention) or taken from classes, a join_engine table whose
+    AA_pos is the 1-based SLAC position; see join_classes.
+    '''
+    by = [by] if isinstance(by, str) else list(by)
+    df = df.reset_index() if 'AA_pos' not in df.columns else df
+    if classes is not None:
+        df = join_classes(df, classes, [label for label in by if label not in df])
+    grouped = df.groupby(by, observed = True, sort = True)
+    output = grouped[list(labels)].sum()
+    output.insert(0, 'n_pos', grouped.size())
+    return add_region_ratios(output.reset_index(), labels)
+
+def join_classes(df, classes, columns):
+    '''
+    Left-joins columns of a join_engine table (indexed or not by UniProt_ID
+    and AA_pos) onto a pN/pS table. join_engine AA_pos is the 1-based SLAC
+    position and pN/pS AA_pos the 0-based BED start of the same residue, so
+    classes are shifted down by one before matching.
+    '''
+    classes = classes.reset_index()[['UniProt_ID', 'AA_pos'] + list(columns)]
+    classes = classes.assign(AA_pos = classes.AA_pos.astype(np.int64) - 1,
+                             UniProt_ID = classes.UniProt_ID.astype(str))
+    keys = df[['UniProt_ID', 'AA_pos']].astype({'UniProt_ID': str, 'AA_pos': np.int64})
+    joined = keys.merge(classes, how = 'left', on = ['UniProt_ID', 'AA_pos'])
+    output = df.copy()
+    for label in columns:
+        output[label] = joined[label].to_numpy()
+    return output
+
+def rasa_bins(rasa, edges = (0, 0.05, 0.25, 0.5, 1.0)):
+    '''
+    Bins relative solvent accessibility into classes, e.g. buried (0-0.05],
+    intermediate and exposed. Non-numeric values ('NA') give NaN.
+    '''
+    rasa = pd.to_numeric(pd.Series(rasa), errors = 'coerce')
+    return pd.cut(rasa, edges, include_lowest = True)
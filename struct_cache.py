@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+On-disk cache of per-residue structural features (DSSP, WCN and packing
+dataframes). Entries are keyed by a hash of the PDB file contents plus the
+version of the tool that produced them, so a changed model or a new
+mkdssp/WCN version is a cache miss. Tables are stored as pandas pickles
+under cache_dir/<kind>/. The cache is bounded in size by evicting the least
+recently used entries, and can be cleared explicitly with clear_cache. An
+entry that cannot be read back (truncated, or pickled by another pandas
+version) is a cache miss and is overwritten.
+'''
+
+import os
+import glob
+import hashlib
+import subprocess
+import warnings
+from functools import lru_cache
+import pandas as pd
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'FlyProtEvol')
+MAX_BYTES = 2**30 # 1 GB
+LOW_WATER = 0.9 # Fraction of max_bytes left after an eviction
+
+# Running estimate of the size of each cache directory, per process
+SIZE_ESTIMATE = {}
+
+# Bump when calc_wcn output changes (2: residue table with float coordinate
+# columns, 3: pLDDT column)
+WCN_VERSION = 'calc_wcn-3'
+PACKING_VERSION = 'PackingDensity-2'
+
+# %% Keys
+def pdb_hash(file):
+    '''
+    Returns the SHA-256 hex digest of the contents of a PDB file.
+    '''
+    sha = hashlib.sha256()
+    with open(file, 'rb') as read:
+        for block in iter(lambda: read.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def cache_key(file, version):
+    '''
+    Returns the cache key of a PDB file for a given tool version. Keys start
+    with the PDB hash so all entries of one model can be found by prefix.
+    '''
+    version_hash = hashlib.sha256(version.encode()).hexdigest()[:16]
+    return pdb_hash(file) + '_' + version_hash
+
+def plddt_version(min_plddt = None, plddt_weight = False):
+    '''
+    Returns the part of a version string describing pLDDT filtering, so that
+    tables computed with different thresholds are cached separately.
+    '''
+    version = ''
+    if min_plddt is not None:
+        version += '/pLDDT>=' + str(float(min_plddt))
+    if plddt_weight:
+        version += '/pLDDT-weighted'
+    return version
+
+@lru_cache(maxsize = None)
+def mkdssp_version(dssp = 'mkdssp'):
+    '''
+    Returns the version string reported by mkdssp, or 'unknown' if it cannot
+    be run. Called once per process.
+    '''
+    try:
+        result = subprocess.run([dssp, '--version'], capture_output = True,
+                                text = True)
+    except OSError:
+        return 'unknown'
+    output = (result.stdout or result.stderr).strip()
+    return output.splitlines()[0] if output else 'unknown'
+
+# %% Read and write
+def cached(kind, file, version, compute, cache_dir = CACHE_DIR,
+           max_bytes = MAX_BYTES):
+    '''
+    Returns the dataframe cached for (kind, file, version), calling compute()
+    and storing its result on a miss. Hits refresh the entry's mtime, which
+    evict uses as the last-use time. An unreadable entry is a miss.
+    '''
+    path = os.path.join(cache_dir, kind, cache_key(file, version) + '.pkl')
+
+    # Entries may be evicted by another process at any time
+    try:
+        os.utime(path)
+        return pd.read_pickle(path)
+    except FileNotFoundError:
+        pass
+    except Exception as error:
+        warnings.warn('Unreadable cache entry ' + path + ' (' + repr(error) +
+                      '), recomputing', RuntimeWarning)
+
+    df = compute()
+
+    # Write to a temporary file first so readers never see partial entries
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    df.to_pickle(tmp_path)
+    size = os.path.getsize(tmp_path)
+    os.replace(tmp_path, path)
+
+    add_size(cache_dir, size, max_bytes)
+
+    return df
+
+# %% Eviction and invalidation
+def add_size(cache_dir, size, max_bytes = MAX_BYTES):
+    '''
+    Adds a written entry to the running size estimate of cache_dir and evicts
+    once the estimate passes max_bytes. The estimate starts from one scan of
+    the cache and is reset by every eviction, which leaves the cache at
+    LOW_WATER*max_bytes, so n writes scan the cache once plus once per
+    eviction rather than n times. Writes of other processes are counted at
+    the next scan, so the cache can exceed max_bytes by what they wrote since.
+    '''
+    if cache_dir not in SIZE_ESTIMATE:
+        SIZE_ESTIMATE[cache_dir] = cache_size(cache_dir) # Includes this entry
+    else:
+        SIZE_ESTIMATE[cache_dir] += size
+    if SIZE_ESTIMATE[cache_dir] > max_bytes:
+        SIZE_ESTIMATE[cache_dir] = evict(cache_dir, int(LOW_WATER*max_bytes))
+
+def cache_entries(cache_dir = CACHE_DIR):
+    '''
+    Returns (mtime, size, path) of every cache entry.
+    '''
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, '*', '*.pkl')):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError: # Evicted by another process
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+def cache_size(cache_dir = CACHE_DIR):
+    '''
+    Returns the total size of the cache entries in bytes.
+    '''
+    return sum(entry[1] for entry in cache_entries(cache_dir))
+
+def evict(cache_dir = CACHE_DIR, max_bytes = MAX_BYTES):
+    '''
+    Removes least recently used entries until the cache is at most max_bytes.
+    Returns the size of the cache left.
+    '''
+    entries = cache_entries(cache_dir)
+    total = sum(entry[1] for entry in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+def clear_cache(cache_dir = CACHE_DIR, kind = None, file = None):
+    '''
+    Removes cache entries. By default everything is removed; kind limits this
+    to one feature table ('dssp', 'wcn' or 'packing') and file to entries of
+    one PDB.
+    '''
+    kind = '*' if kind is None else kind
+    prefix = '*' if file is None else pdb_hash(file) + '_*'
+    for path in glob.glob(os.path.join(cache_dir, kind, prefix + '.pkl')):
+        os.remove(path)
+    SIZE_ESTIMATE.pop(cache_dir, None)
+
+# %% Cached feature tables
+def get_dssp_df(name, file, cache_dir = CACHE_DIR, max_bytes = MAX_BYTES,
+                min_plddt = None):
+    '''
+    Cached DSSP_output.run_dssp_df for a PDB file.
+    '''
+    import Bio
+
+    def compute():
+        from DSSP_output import run_dssp_df
+        return run_dssp_df(file, min_plddt = min_plddt)
+
+    # RSA normalization tables come from Biopython, so its version is keyed too
+    version = mkdssp_version() + '/biopython-' + Bio.__version__ \
+        + plddt_version(min_plddt)
+    return cached('dssp', file, version, compute, cache_dir, max_bytes)
+
+def get_wcn_df(name, file, cache_dir = CACHE_DIR, max_bytes = MAX_BYTES,
+               fast = False, min_plddt = None, plddt_weight = False):
+    '''
+    Cached calc_wcn.make_wcn_df for a PDB file. fast selects the pdb_reader
+    path of calc_wcn.get_wcn, which gives identical tables.
+    '''
+    def compute():
+        from calc_wcn import get_wcn, make_wcn_df
+        return make_wcn_df(get_wcn(name, file, fast = fast, min_plddt = min_plddt,
+                                   plddt_weight = plddt_weight))
+
+    version = WCN_VERSION + plddt_version(min_plddt, plddt_weight)
+    return cached('wcn', file, version, compute, cache_dir, max_bytes)
+
+def get_packing_df(name, file, cache_dir = CACHE_DIR, max_bytes = MAX_BYTES,
+                   min_plddt = None):
+    '''
+    Cached PackingDensity.make_packing_df for a PDB file.
+    '''
+    def compute():
+        from PackingDensity import get_packing, make_packing_df
+        return make_packing_df(get_packing(name, file, min_plddt = min_plddt))
+
+    version = PACKING_VERSION + plddt_version(min_plddt)
+    return cached('packing', file, version, compute, cache_dir, max_bytes)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Computes DSSP and WCN features for every {FbID}/refprot/*.pdb under a root
+directory and writes them to one per-residue table. mkdssp runs are subprocess
+bound, so they go through a thread pool; WCN is CPU bound and goes through a
+process pool. Both use the struct_cache so re-runs skip finished genes. Genes
+are written as soon as both of their features are done, with a bounded number
+of genes in flight, and a failure in one gene is recorded and skipped rather
+than aborting the run.
+'''
+
+import os
+import argparse
+import multiprocessing
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice
+import pandas as pd
+from struct_cache import CACHE_DIR, get_dssp_df, get_wcn_df
+
+DSSP_COLS = ['DSSP_Index', 'AA', 'Sec_Struct', 'RASA_Sander', 'RASA_Wilke',
+             'RASA_Miller']
+WCN_COLS = ['pdb_position', 'chain', 'pLDDT', 'wcn_ca', 'wcn_sc']
+
+# %% Find structures
+def find_pdbs(root):
+    '''
+    Returns a sorted list of (FBgn_id, pdb path) for every FBgn*/refprot/*.pdb
+    under root.
+    '''
+    output = []
+    with os.scandir(root) as genes:
+        for gene in genes:
+            if not (gene.name.startswith('FBgn') and gene.is_dir()):
+                continue
+            refprot = os.path.join(gene.path, 'refprot')
+            if not os.path.isdir(refprot):
+                continue
+            for filename in sorted(os.listdir(refprot)):
+                if filename.endswith('.pdb'):
+                    output.append((gene.name, os.path.join(refprot, filename)))
+    return sorted(output)
+
+# %% Per-gene tasks
+def dssp_task(fb_id, file, cache_dir = CACHE_DIR, min_plddt = None):
+    return get_dssp_df(fb_id, file, cache_dir, min_plddt = min_plddt)[DSSP_COLS]
+
+def wcn_task(fb_id, file, cache_dir = CACHE_DIR, min_plddt = None,
+             plddt_weight = False):
+    return get_wcn_df(fb_id, file, cache_dir, min_plddt = min_plddt,
+                      plddt_weight = plddt_weight)[WCN_COLS]
+
+def merge_features(fb_id, df_dssp, df_wcn):
+    '''
+    Joins DSSP and WCN tables of one gene on amino acid position, the same way
+    Bed_to_df.py matches them to SLAC positions.
+    '''
+    df_dssp = df_dssp.rename(columns = {'DSSP_Index' : 'AA_pos'})
+    df_wcn = df_wcn.rename(columns = {'pdb_position' : 'AA_pos'})
+    df_wcn = df_wcn.astype({'AA_pos': int})
+    df = pd.merge(df_dssp, df_wcn, how = 'outer', on = 'AA_pos')
+    df.insert(0, 'FBgn_id', fb_id)
+    return df
+
+# %% Batch
+def iter_structures(root, dssp_workers = 4, wcn_workers = None,
+                    cache_dir = CACHE_DIR, failures = None, min_plddt = None,
+                    plddt_weight = False, window = None):
+    '''
+    Yields (FBgn_id, per-residue dataframe) for every structure under root, in
+    FBgn_id order. Genes whose DSSP, WCN or merge step raises are left out
+    and, if a failures list is given, appended to it as (FBgn_id, step,
+    error). At most window genes (by default four per worker) are in flight
+    at once; the next gene is submitted as each one is yielded, so finished
+    tables do not pile up ahead of the consumer. min_plddt and plddt_weight
+    are applied as in join_engine.build_join.
+    '''
+    pdbs = iter(find_pdbs(root))
+    wcn_workers = os.cpu_count() if wcn_workers is None else wcn_workers
+    window = 4*max(dssp_workers, wcn_workers) if window is None else window
+
+    with ThreadPoolExecutor(dssp_workers) as dssp_pool, \
+         ProcessPoolExecutor(wcn_workers,
+                             mp_context = multiprocessing.get_context('spawn')) as wcn_pool:
+
+        def submit(fb_id, file):
+            return (fb_id,
+                    dssp_pool.submit(dssp_task, fb_id, file, cache_dir, min_plddt),
+                    wcn_pool.submit(wcn_task, fb_id, file, cache_dir, min_plddt,
+                                    plddt_weight))
+
+        pending = deque(submit(*entry) for entry in islice(pdbs, window))
+        while len(pending) > 0:
+            fb_id, dssp_future, wcn_future = pending.popleft()
+            for entry in islice(pdbs, 1):
+                pending.append(submit(*entry))
+            try:
+                step = 'dssp'
+                df_dssp = dssp_future.result()
+                step = 'wcn'
+                df_wcn = wcn_future.result()
+                step = 'merge'
+                df = merge_features(fb_id, df_dssp, df_wcn)
+            except Exception as error:
+                warnings.warn(fb_id + ' ' + step + ' failed: ' + repr(error),
+                              RuntimeWarning)
+                if failures is not None:
+                    failures.append((fb_id, step, repr(error)))
+                continue
+            yield fb_id, df
+
+def run_structures(root, output_path, dssp_workers = 4, wcn_workers = None,
+                   cache_dir = CACHE_DIR, min_plddt = None, plddt_weight = False):
+    '''
+    Writes the per-residue features of all structures under root to a single
+    csv, one gene at a time. Returns a dataframe of failed genes.
+    '''
+    failures = []
+    header = True
+    with open(output_path, 'w') as write:
+        for fb_id, df in iter_structures(root, dssp_workers, wcn_workers,
+                                         cache_dir, failures, min_plddt,
+                                         plddt_weight):
+            df.to_csv(write, header = header, index = False)
+            header = False
+
+    return pd.DataFrame(failures, columns = ['FBgn_id', 'step', 'error'])
+
+def main():
+    '''
+    Run DSSP and WCN over all refprot structures under a directory.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Per-residue DSSP and WCN features for all FBgn*/refprot/*.pdb.')
+    parser.add_argument('root', metavar='<root dir>', type=str,
+                        help='directory containing FBgn* gene directories')
+    parser.add_argument('-o', metavar='<output csv>', type=str,
+                        default='structure_features.csv',
+                        help='output per-residue table')
+    parser.add_argument('--dssp-workers', type=int, default=4,
+                        help='concurrent mkdssp runs')
+    parser.add_argument('--wcn-workers', type=int, default=None,
+                        help='WCN processes (default: number of CPUs)')
+    parser.add_argument('--cache-dir', type=str, default=CACHE_DIR,
+                        help='structural feature cache directory')
+    parser.add_argument('--min-plddt', type=float, default=None,
+                        help='drop residues below this pLDDT from DSSP and WCN')
+    parser.add_argument('--plddt-weight', action='store_true',
+                        help='weight WCN neighbours by pLDDT/100')
+    args = parser.parse_args()
+
+    failures = run_structures(args.root, args.o, args.dssp_workers,
+                              args.wcn_workers, args.cache_dir, args.min_plddt,
+                              args.plddt_weight)
+    if len(failures) > 0:
+        print(failures.to_string(index = False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def test_files():
+    '''
+    The test_files directory of per-gene inputs.
+    '''
+    return os.path.join(ROOT, 'test_files')
+
+@pytest.fixture
+def data_dir():
+    '''
+    Frozen outputs of the original implementations.
+    '''
+    return os.path.join(ROOT, 'tests', 'data')
@@ -0,0 +1,114 @@
+import os
+import shutil
+import pandas as pd
+import pytest
+import aggregate
+
+@pytest.fixture
+def gene_root(test_files, tmp_path):
+    # A copy of the per-gene inputs that can be edited
+    root = str(tmp_path / 'genes')
+    shutil.copytree(test_files, root, ignore = shutil.ignore_patterns('macse', 'group'))
+    return root
+
+@pytest.fixture
+def counted(monkeypatch):
+    # Genes passed to map_genes, i.e. actually counted, per call
+    calls = []
+    map_genes = aggregate.map_genes
+    def record(task, fb_ids, *args, **kwargs):
+        calls.append(list(fb_ids))
+        return map_genes(task, fb_ids, *args, **kwargs)
+    monkeypatch.setattr(aggregate, 'map_genes', record)
+    return calls
+
+def edit_gene(root, fb_id):
+    # Drop the second half of the missense variants and one synonymous variant
+    gene_dir = os.path.join(root, fb_id)
+    mis_path = os.path.join(gene_dir, fb_id + '.missense.Poly.UniProt.bed')
+    with open(mis_path) as read:
+        lines = read.readlines()
+    with open(mis_path, 'w') as write:
+        write.writelines(lines[:len(lines)//2])
+    syn_path = os.path.join(gene_dir, fb_id + '.synonymous.Poly.UniProt.bed')
+    with open(syn_path) as read:
+        lines = read.readlines()
+    with open(syn_path, 'w') as write:
+        write.writelines(lines[:10] + lines[11:])
+
+def assert_same_run(result, expected):
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    pd.testing.assert_frame_equal(result[1], expected[1])
+
+@pytest.mark.parametrize('options', [{}, {'exclude_masked': True}, {'adjusted': True}])
+def test_incremental_matches_full_run(gene_root, tmp_path, counted, options):
+    manifest_dir = str(tmp_path / 'manifest')
+    before = aggregate.aggregate_pnps(gene_root, manifest_dir = manifest_dir, **options)
+    assert_same_run(before, aggregate.aggregate_pnps(gene_root, **options))
+
+    edit_gene(gene_root, 'FBgn0000015')
+    if options.get('exclude_masked'):
+        mask_path = os.path.join(gene_root, 'FBgn0000018', 'FBgn0000018.mask.UniProt.bed')
+        with open(mask_path, 'a') as write:
+            write.write('Q9VKM4_DROME\t100\t140\n')
+
+    counted.clear()
+    after = aggregate.aggregate_pnps(gene_root, manifest_dir = manifest_dir, **options)
+    full = aggregate.aggregate_pnps(gene_root, **options)
+    assert_same_run(after, full)
+
+    # Only the edited genes were counted again
+    edited = ['FBgn0000015'] + (['FBgn0000018'] if options.get('exclude_masked') else [])
+    if options.get('adjusted'):
+        edited = [] # The ADJ.Poly files were not edited
+    assert counted[0] == edited
+    if len(edited) > 0:
+        assert not after[0].equals(before[0])
+
+def test_other_options_are_not_reused(gene_root, tmp_path, counted):
+    manifest_dir = str(tmp_path / 'manifest')
+    aggregate.aggregate_pnps(gene_root, manifest_dir = manifest_dir)
+    for options in [{'adjusted': True}, {'exclude_masked': True}]:
+        counted.clear()
+        result = aggregate.aggregate_pnps(gene_root, manifest_dir = manifest_dir, **options)
+        assert len(counted[0]) > 0
+        assert_same_run(result, aggregate.aggregate_pnps(gene_root, **options))
+
+    # Plain results are still cached, not overwritten by the other options
+    counted.clear()
+    result = aggregate.aggregate_pnps(gene_root, manifest_dir = manifest_dir)
+    assert counted[0] == []
+    assert_same_run(result, aggregate.aggregate_pnps(gene_root))
+
+# The original file probing of aggregate.file_check
+def old_file_check(dir_path):
+    suffixes = ['.synonymous.Poly.UniProt.bed', '.missense.Poly.UniProt.bed',
+                '.codonStats.UniProt.bed', '.features.UniProt.bed', '.SLAC.UniProt.bed']
+    frame = []
+    for entry in sorted(name for name in os.listdir(dir_path) if 'FBgn' in name):
+        flags = [int(os.path.isfile(dir_path + '/' + entry + '/' + entry + suffix))
+                 for suffix in suffixes]
+        flags.append(int(os.path.isfile(dir_path + '/' + entry + '/refprot/' + entry + '.pdb')))
+        frame.append([entry] + flags)
+    return pd.DataFrame(frame, columns = ['FBgn_id', 'synonymous.Poly?', 'missense.Poly?',
+                                          'codonStats?', 'features?', 'SLAC?', 'pdb?'])
+
+def test_file_check_matches_baseline(test_files, data_dir):
+    check_df = aggregate.aggregate_pnps(test_files)[1]
+    baseline = pd.read_csv(os.path.join(data_dir, 'file_checker_baseline.csv'))
+    pd.testing.assert_frame_equal(check_df, baseline, check_dtype = False)
+
+def test_file_check_matches_probing(gene_root):
+    # Remove files of genes that had them, and add a directory with no inputs
+    os.remove(os.path.join(gene_root, 'FBgn0000015', 'refprot', 'FBgn0000015.pdb'))
+    os.remove(os.path.join(gene_root, 'FBgn0000018', 'FBgn0000018.codonStats.UniProt.bed'))
+    os.remove(os.path.join(gene_root, 'FBgn0000053', 'FBgn0000053.features.UniProt.bed'))
+    os.makedirs(os.path.join(gene_root, 'FBgn0000099', 'refprot'))
+
+    expected = old_file_check(gene_root)
+    check_df = aggregate.file_check(gene_root)
+    pd.testing.assert_frame_equal(check_df, expected, check_dtype = False)
+
+    # Genes missing any Poly or codonStats file are not counted
+    check_df = aggregate.aggregate_pnps(gene_root)[1]
+    assert check_df.loc[check_df.pNpS_calc == 1, 'FBgn_id'].tolist() == ['FBgn0000015']
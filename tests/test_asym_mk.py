@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import asym_mk
+from aggregate import aggregate_mk
+
+def counts(alpha_x, Dn = 1000.0, Ds = 2000.0, Ps = 100.0):
+    # Pn per bin such that 1 - (Ds/Dn)(Pn/Ps) = alpha_x
+    alpha_x = np.asarray(alpha_x, dtype = float)
+    Pn = (1 - alpha_x)*(Dn/Ds)*Ps
+    return np.array([Dn]), np.array([Ds]), Pn[None, :], np.full((1, len(alpha_x)), Ps)
+
+def test_exponential_is_recovered():
+    x = (np.arange(asym_mk.N_BINS) + 0.5)/asym_mk.N_BINS
+    fit = asym_mk.fit_asymptotic(*counts(0.6 - 0.5*np.exp(-5*x)))
+    assert not fit['c_at_bound'][0]
+    assert fit['c'][0] == pytest.approx(5, rel = 1e-2)
+    assert fit['alpha_asymptotic'][0] == pytest.approx(0.6 - 0.5*np.exp(-5), abs = 1e-3)
+
+@pytest.mark.parametrize('slope', [0.2, -0.2])
+def test_linear_alpha_is_at_bound(slope):
+    # A straight line is only approached as c goes to 0
+    x = (np.arange(asym_mk.N_BINS) + 0.5)/asym_mk.N_BINS
+    fit = asym_mk.fit_asymptotic(*counts(0.3 + slope*x))
+    assert fit['c_at_bound'][0]
+    assert fit['c'][0] == asym_mk.C_GRID.min()
+    assert np.isnan(fit['alpha_asymptotic'][0])
+
+def test_degenerate_gene_is_flagged(test_files):
+    output = asym_mk.subset_mk(aggregate_mk(test_files), 'FBgn_id').set_index('FBgn_id')
+    assert output.c_at_bound.to_dict() == {'FBgn0000015': False, 'FBgn0000018': True}
+    assert np.isnan(output.alpha_asymptotic['FBgn0000018'])
+    assert np.isfinite(output.alpha_asymptotic['FBgn0000015'])
+    assert (output.c >= asym_mk.C_GRID.min()).all() and (output.c <= asym_mk.C_GRID.max()).all()
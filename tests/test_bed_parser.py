@@ -0,0 +1,62 @@
+import glob
+import os
+import pandas as pd
+import pytest
+from bed_parser import CSTAT_LABELS, VAR_LABELS, read_cstat_bed, read_var_bed
+
+# The original line-by-line parsers of pnps_calc
+def old_var_parser(file_path):
+    frame = []
+    with open(file_path) as read:
+        for line in read:
+            entry = line.split()
+            if len(entry) != len(VAR_LABELS):
+                raise ValueError
+            frame.append(entry)
+    df = pd.DataFrame(frame, columns = VAR_LABELS)
+    return df.astype({'AA_pos': int, 'AA_pos_end': int})
+
+def old_cstat_parser(file_path):
+    frame = []
+    with open(file_path) as read:
+        for line in read:
+            entry = line.split()
+            data = entry[-1].split(':')
+            data = [data[0]] + data[1].split(',')
+            entry = entry[:-1] + data
+            if len(entry) != len(CSTAT_LABELS):
+                raise ValueError
+            frame.append(entry)
+    df = pd.DataFrame(frame, columns = CSTAT_LABELS)
+    return df.astype({'AA_pos': int, 'AA_pos_end': int, 'E[N]': float, 'E[S]': float})
+
+def assert_same(df, expected):
+    assert list(df.columns) == list(expected.columns)
+    assert len(df) == len(expected)
+    for label in df.columns:
+        if pd.api.types.is_numeric_dtype(expected[label]):
+            assert (df[label].to_numpy() == expected[label].to_numpy()).all(), label
+        else:
+            assert df[label].astype(str).tolist() == expected[label].astype(str).tolist(), label
+
+@pytest.mark.parametrize('kind', ['missense', 'synonymous'])
+def test_var_bed_matches_old_parser(test_files, kind):
+    paths = glob.glob(os.path.join(test_files, '*', '*.' + kind + '.Poly.UniProt.bed'))
+    assert len(paths) > 0
+    for path in paths:
+        assert_same(read_var_bed(path, chunksize = 97), old_var_parser(path))
+
+def test_cstat_bed_matches_old_parser(test_files):
+    paths = glob.glob(os.path.join(test_files, '*', '*.codonStats.UniProt.bed'))
+    assert len(paths) > 0
+    for path in paths:
+        assert_same(read_cstat_bed(path, chunksize = 997), old_cstat_parser(path))
+
+def test_malformed_line_is_rejected(tmp_path):
+    # A short and a long line in the same chunk have the right total tab count
+    path = tmp_path / 'bad.bed'
+    path.write_text('Q1\t1\t2\tAF=0.1\n'
+                    'Q1\t2\t3\n'
+                    'Q1\t3\t4\tAF=0.2\textra\n')
+    with pytest.raises(ValueError):
+        read_var_bed(str(path))
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+import bootstrap
+from aggregate import aggregate_pnps, aggregate_pnps_ci
+
+@pytest.fixture
+def pnps_ci(test_files):
+    return aggregate_pnps_ci(test_files, n_reps = 500, seed = 3)
+
+def test_point_estimate_is_ratio_of_sums(test_files, pnps_ci):
+    gene_df, (ratio, low, high) = pnps_ci
+    df = aggregate_pnps(test_files)[0]
+    sums = df.groupby('UniProt_ID')[bootstrap.PNPS_SUMS].sum()
+    expected = (sums.PN/sums['E[N]'])/(sums.PS/sums['E[S]'])
+    np.testing.assert_allclose(gene_df.set_index('UniProt_ID').ratio, expected[gene_df.UniProt_ID])
+    assert gene_df.n_pos.tolist() == df.groupby('UniProt_ID').size()[gene_df.UniProt_ID].tolist()
+
+    total = df[bootstrap.PNPS_SUMS].sum()
+    assert ratio == pytest.approx((total.PN/total['E[N]'])/(total.PS/total['E[S]']))
+
+def test_interval_contains_estimate(pnps_ci):
+    gene_df, (ratio, low, high) = pnps_ci
+    assert len(gene_df) > 0
+    assert (gene_df.low <= gene_df.ratio).all() and (gene_df.ratio <= gene_df.high).all()
+    assert low <= ratio <= high
+
+def test_workers_give_same_intervals(test_files):
+    # Small max_bytes splits the genes over several chunks, so the pool is used
+    df = aggregate_pnps(test_files)[0]
+    kwargs = {'n_reps': 200, 'seed': 7, 'max_bytes': 200*8*2*300}
+    one = bootstrap.bootstrap_ratios(df, n_workers = 1, **kwargs)
+    two = bootstrap.bootstrap_ratios(df, n_workers = 2, **kwargs)
+    assert len(bootstrap.chunk_genes(one.n_pos.to_numpy(), 200, kwargs['max_bytes'])) > 1
+    pd.testing.assert_frame_equal(one, two)
+
+    gene_df, proteome = aggregate_pnps_ci(test_files, n_reps = 200, seed = 7, n_workers = 2)
+    expected_df, expected = aggregate_pnps_ci(test_files, n_reps = 200, seed = 7)
+    pd.testing.assert_frame_equal(gene_df, expected_df)
+    assert proteome == expected
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from calc_wcn import get_wcn, make_wcn_df, wcn_blocked, wcn_cutoff
+
+@pytest.fixture
+def pdb_file(test_files):
+    return os.path.join(test_files, 'FBgn0000015', 'refprot', 'FBgn0000015.pdb')
+
+@pytest.fixture
+def baseline(data_dir):
+    # Output of the original per-residue loop, which summed in float32
+    return pd.read_csv(os.path.join(data_dir, 'FBgn0000015_wcn.csv'),
+                       dtype = {'pdb_position': str})
+
+def test_wcn_matches_baseline(pdb_file, baseline):
+    df = make_wcn_df(get_wcn('ADBD_DROME', pdb_file))
+    for label in ['pdb_aa', 'pdb_position', 'chain']:
+        assert df[label].astype(str).tolist() == baseline[label].astype(str).tolist()
+    for label in ['wcn_ca', 'wcn_sc']:
+        np.testing.assert_allclose(df[label], baseline[label], rtol = 1e-5)
+
+def test_blocked_matches_brute_force():
+    coords = np.random.default_rng(0).normal(scale = 20, size = (300, 3))
+    sq_dist = ((coords[:, None] - coords[None])**2).sum(axis = 2)
+    np.fill_diagonal(sq_dist, np.inf)
+    expected = (1/sq_dist).sum(axis = 1)
+    for block_size in [7, 64, 512]:
+        np.testing.assert_allclose(wcn_blocked(coords, block_size), expected)
+
+def test_cutoff_matches_brute_force():
+    coords = np.random.default_rng(1).normal(scale = 20, size = (300, 3))
+    sq_dist = ((coords[:, None] - coords[None])**2).sum(axis = 2)
+    np.fill_diagonal(sq_dist, np.inf)
+    expected = np.where(sq_dist < 15**2, 1/sq_dist, 0).sum(axis = 1)
+    np.testing.assert_allclose(wcn_cutoff(coords, 15), expected)
+
+def test_fast_path_matches_biopython(pdb_file, tmp_path):
+    import gzip
+    import shutil
+    gz_file = str(tmp_path / 'model.pdb.gz')
+    with open(pdb_file, 'rb') as read, gzip.open(gz_file, 'wb') as write:
+        shutil.copyfileobj(read, write)
+
+    expected = make_wcn_df(get_wcn('ADBD_DROME', pdb_file))
+    for file in [pdb_file, gz_file]:
+        df = make_wcn_df(get_wcn('ADBD_DROME', file, fast = True))
+        pd.testing.assert_frame_equal(df, expected, check_exact = True)
+
+def test_residue_table_matches_per_residue_dicts(pdb_file, data_dir):
+    # Coordinates of the original list of per-residue dicts, float32
+    expected = pd.read_csv(os.path.join(data_dir, 'FBgn0000015_coords.csv'),
+                           dtype = {'pdb_position': str})
+    residues = get_wcn('ADBD_DROME', pdb_file)
+    assert residues['pdb_position'].tolist() == expected.pdb_position.tolist()
+    for label, prefix in [('coord_ca', 'ca'), ('sidechain_center', 'sc')]:
+        assert residues[label].dtype == np.float32
+        columns = [prefix + '_' + axis for axis in 'xyz']
+        np.testing.assert_array_equal(residues[label],
+                                      expected[columns].to_numpy().astype(np.float32))
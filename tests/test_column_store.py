@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+import column_store
+
+def batch(genes, start):
+    n = len(genes)
+    return pd.DataFrame({
+        'UniProt_ID': genes,
+        'AA_pos': np.arange(start, start + n, dtype = np.int32),
+        'dN/dS': np.where(np.arange(n) % 3 == 0, np.nan, np.arange(n)/7),
+        'Masked': np.arange(n) % 2 == 0,
+        'Species_count': pd.array([None if i % 4 == 1 else i for i in range(n)], dtype = 'Int64'),
+        'Flag': pd.array([None if i % 3 == 2 else i % 2 == 0 for i in range(n)], dtype = 'boolean'),
+        'Sec_Struct': [None if i % 5 == 0 else 'HEC'[i % 3] for i in range(n)]})
+
+def assert_same(df, expected):
+    assert list(df.columns) == list(expected.columns)
+    for label in expected.columns:
+        if pd.api.types.is_string_dtype(expected[label]):
+            # String columns come back as categoricals
+            as_list = lambda values: [None if pd.isna(value) else value for value in values]
+            assert as_list(df[label]) == as_list(expected[label]), label
+        elif isinstance(expected[label].dtype, np.dtype):
+            assert df[label].dtype == expected[label].dtype, label
+            np.testing.assert_array_equal(df[label].to_numpy(), expected[label].to_numpy())
+        else:
+            pd.testing.assert_extension_array_equal(df[label].array, expected[label].array)
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'store')
+    first = batch(['Q1']*3 + ['Q2']*4, 0)
+    second = batch(['Q3']*5, 10)
+    assert column_store.append_columns(path, first, key = 'UniProt_ID') == 0
+    assert column_store.append_columns(path, second, key = 'UniProt_ID') == 7
+
+    expected = pd.concat([first, second], ignore_index = True)
+    assert_same(column_store.read_columns(path), expected)
+    assert_same(column_store.read_gene(path, 'Q2'), first[3:].reset_index(drop = True))
+    assert_same(column_store.read_genes(path, ['Q3', 'Q1']),
+                pd.concat([second, first[:3]], ignore_index = True))
+
+    # Missing strings are code -1, not a category
+    schema = column_store.read_schema(path)
+    column = [column for column in schema['columns'] if column['name'] == 'Sec_Struct'][0]
+    assert sorted(column['categories']) == ['C', 'E', 'H']
+
+def test_gene_in_two_batches_is_rejected(tmp_path):
+    path = str(tmp_path / 'store')
+    column_store.append_columns(path, batch(['Q1']*3, 0), key = 'UniProt_ID')
+    with pytest.raises(ValueError):
+        column_store.append_columns(path, batch(['Q1']*2, 3), key = 'UniProt_ID')
+
+def test_pnps_tables_round_trip(tmp_path, data_dir):
+    df = pd.read_csv(data_dir + '/pnps_baseline.csv', float_precision = 'round_trip')
+    df = df.sort_values(['UniProt_ID', 'AA_pos'], kind = 'stable', ignore_index = True)
+    column_store.write_columns(str(tmp_path / 'pnps'), df, key = 'UniProt_ID')
+    assert_same(column_store.read_columns(str(tmp_path / 'pnps')), df)
@@ -0,0 +1,24 @@
+import importlib
+import pathlib
+import pytest
+import DSSP_output
+
+# Bio.PDB.DSSP is also the name of the DSSP class
+dssp_module = importlib.import_module('Bio.PDB.DSSP')
+
+@pytest.fixture
+def fake_dssp(monkeypatch):
+    # mkdssp is not run; record which reader got which file
+    calls = []
+    monkeypatch.setattr(dssp_module, 'make_dssp_dict',
+                        lambda file: calls.append(('dssp', file)) or ({}, []))
+    monkeypatch.setattr(dssp_module, 'dssp_dict_from_pdb_file',
+                        lambda file, dssp, version: calls.append(('pdb', file)) or ({}, []))
+    monkeypatch.setattr(DSSP_output, 'dssp_version', lambda dssp: '4.4.0')
+    return calls
+
+@pytest.mark.parametrize('name, reader', [('model.pdb', 'pdb'), ('model.DSSP', 'dssp')])
+def test_path_input(tmp_path, fake_dssp, name, reader):
+    df = DSSP_output.run_dssp_df(pathlib.Path(tmp_path / name))
+    assert fake_dssp == [(reader, str(tmp_path / name))]
+    assert len(df) == 0
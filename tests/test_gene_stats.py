@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gene_stats import gene_corr, gene_fit
+
+COLUMNS = ['wcn_sc', 'wcn_ca', 'RASA_Wilke']
+
+@pytest.fixture
+def table():
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = pd.DataFrame({'UniProt_ID': rng.choice(['G' + str(i) for i in range(40)], n)})
+    for label in COLUMNS:
+        df[label] = rng.normal(size = n)
+    df['dN/dS'] = df.wcn_sc - 0.5*df.RASA_Wilke + rng.normal(size = n)
+    # Ties, missing values and a non-numeric RASA, as in join_engine tables
+    df['wcn_ca'] = df.wcn_ca.round(1)
+    df.loc[rng.random(n) < 0.05, 'dN/dS'] = np.nan
+    df.loc[rng.random(n) < 0.05, 'wcn_sc'] = np.inf
+    df['RASA_Wilke'] = df.RASA_Wilke.astype(object)
+    df.loc[rng.random(n) < 0.05, 'RASA_Wilke'] = 'NA'
+    # Genes too small to correlate or fit
+    small = pd.DataFrame({'UniProt_ID': ['tiny', 'tiny'], 'dN/dS': [1.0, 2.0],
+                          'wcn_sc': [1.0, 3.0], 'wcn_ca': [1.0, 0.0], 'RASA_Wilke': [0.1, 0.2]})
+    return pd.concat([df, small], ignore_index = True)
+
+def numeric(df):
+    values = df[['dN/dS'] + COLUMNS].apply(pd.to_numeric, errors = 'coerce')
+    return values.replace([np.inf, -np.inf], np.nan)
+
+def test_pair_correlations_match_pandas(table):
+    output = gene_corr(table, methods = ('pearson', 'spearman'))
+    values = numeric(table)
+    for (gene, column, method), row in output.set_index(['UniProt_ID', 'column', 'method']).iterrows():
+        pair = values[table.UniProt_ID == gene][['dN/dS', column]].dropna()
+        assert row.n == len(pair)
+        if len(pair) < 3:
+            assert np.isnan(row.r)
+        else:
+            assert row.r == pytest.approx(pair.corr(method = method).iloc[0, 1], abs = 1e-10)
+
+def test_partial_correlations_match_residuals(table):
+    output = gene_corr(table, methods = ('partial',)).set_index(['UniProt_ID', 'column'])
+    values = numeric(table)
+    for gene in table.UniProt_ID.unique():
+        rows = values[table.UniProt_ID == gene].dropna().to_numpy()
+        for i, column in enumerate(COLUMNS):
+            r = output.loc[(gene, column), 'r']
+            if len(rows) <= len(COLUMNS) + 1:
+                continue
+            # Correlation of the residuals of target and column on the other columns
+            others = np.column_stack([np.ones(len(rows))] +
+                                     [rows[:, j + 1] for j in range(len(COLUMNS)) if j != i])
+            residuals = [values - others @ np.linalg.lstsq(others, values, rcond = None)[0]
+                         for values in [rows[:, 0], rows[:, i + 1]]]
+            assert r == pytest.approx(np.corrcoef(*residuals)[0, 1], abs = 1e-10)
+
+def test_fit_matches_lstsq(table):
+    output = gene_fit(table).set_index('UniProt_ID')
+    values = numeric(table)
+    for gene in table.UniProt_ID.unique():
+        rows = values[table.UniProt_ID == gene].dropna().to_numpy()
+        fit = output.loc[gene]
+        assert fit.n == len(rows)
+        if len(rows) <= len(COLUMNS) + 1:
+            assert np.isnan(fit.intercept)
+            continue
+        design = np.column_stack([np.ones(len(rows)), rows[:, 1:]])
+        coef = np.linalg.lstsq(design, rows[:, 0], rcond = None)[0]
+        np.testing.assert_allclose(fit[['intercept'] + COLUMNS].to_numpy(dtype = float), coef,
+                                   atol = 1e-10)
+        residual = rows[:, 0] - design @ coef
+        r2 = 1 - (residual**2).sum()/((rows[:, 0] - rows[:, 0].mean())**2).sum()
+        assert fit.R2 == pytest.approx(r2, abs = 1e-10)
@@ -0,0 +1,74 @@
+import os
+import pandas as pd
+import pytest
+import Bed_to_df
+import join_engine
+
+@pytest.fixture
+def gene_dir(test_files):
+    return os.path.join(test_files, 'FBgn0000015')
+
+@pytest.fixture
+def no_dssp(monkeypatch, tmp_path):
+    # mkdssp is not needed for the annotation columns, and WCN is cached in tmp_path
+    empty = pd.DataFrame({'DSSP_Index': [], 'AA': [], 'Sec_Struct': [], 'RASA_Wilke': []})
+    get_wcn_df = join_engine.get_wcn_df
+    monkeypatch.setattr(join_engine, 'get_dssp_df', lambda *args, **kwargs: empty)
+    monkeypatch.setattr(join_engine, 'get_wcn_df',
+                        lambda name, file, cache_dir, **kwargs:
+                            get_wcn_df(name, file, str(tmp_path), **kwargs))
+
+def read_intervals(file_path):
+    with open(file_path) as read:
+        return [line.rstrip('\n').split('\t') for line in read if line.strip() != '']
+
+def naive_annotation(gene_dir, fb_id, positions):
+    # positions are SLAC AA_pos, 1-based; BED intervals are 0-based
+    mask = read_intervals(os.path.join(gene_dir, fb_id + '.mask.UniProt.bed'))
+    features = read_intervals(os.path.join(gene_dir, fb_id + '.features.UniProt.bed'))
+    masked, labels = [], []
+    for pos in positions - 1:
+        masked.append(any(int(entry[1]) <= pos < int(entry[2]) for entry in mask))
+        labels.append('|'.join(entry[3] + (':' + entry[4] if len(entry) > 4 and entry[4] != '' else '')
+                               for entry in features
+                               if int(entry[1]) <= pos < int(entry[2])))
+    return masked, labels
+
+def test_gene_task_annotation(gene_dir, tmp_path, no_dssp):
+    df = join_engine.gene_task('FBgn0000015',
+                               os.path.join(gene_dir, 'FBgn0000015.SLAC.UniProt.bed'),
+                               os.path.join(gene_dir, 'refprot', 'FBgn0000015.pdb'),
+                               cache_dir = str(tmp_path))
+    masked, labels = naive_annotation(gene_dir, 'FBgn0000015', df.AA_pos.to_numpy())
+    assert (df.FBgn_id == 'FBgn0000015').all()
+    assert df.Masked.tolist() == masked
+    assert df.Features.tolist() == labels
+    assert (df.Features != '').any()
+
+    # SLAC skips the masked codons of this gene, so check the loaded mask too
+    mask, features = join_engine.gene_annotation('FBgn0000015', gene_dir)
+    intervals = read_intervals(os.path.join(gene_dir, 'FBgn0000015.mask.UniProt.bed'))
+    assert mask[0].tolist() == [int(entry[1]) for entry in intervals]
+    assert mask[1].tolist() == [int(entry[2]) for entry in intervals]
+    assert len(features) == len(read_intervals(os.path.join(gene_dir,
+                                                            'FBgn0000015.features.UniProt.bed')))
+
+def test_bed_to_df_uses_fbgn_id(gene_dir, no_dssp, recwarn):
+    df = Bed_to_df.get_gene_df(os.path.join(gene_dir, 'FBgn0000015.SLAC.UniProt.bed'),
+                               os.path.join(gene_dir, 'refprot', 'FBgn0000015.pdb'))
+    masked, labels = naive_annotation(gene_dir, 'FBgn0000015', df.AA_pos.to_numpy())
+    assert (df.FBgn_id == 'FBgn0000015').all()
+    assert df.Masked.tolist() == masked
+    assert df.Features.tolist() == labels
+    assert not any(issubclass(warning.category, RuntimeWarning) for warning in recwarn)
+
+def test_missing_annotation_warns(gene_dir):
+    # The UniProt entry name is not the name of the gene's files
+    with pytest.warns(RuntimeWarning, match = 'has no'):
+        mask, features = join_engine.gene_annotation('ABDB_DROME', gene_dir)
+    assert len(mask[0]) == 0 and len(features) == 0
+
+def test_expected_file_must_exist(gene_dir):
+    record = {'mask': join_engine.scan_gene('FBgn0000015', gene_dir)['mask'], 'size': {}}
+    with pytest.raises(FileNotFoundError):
+        join_engine.gene_annotation('FBgn0000015', os.path.dirname(gene_dir), record)
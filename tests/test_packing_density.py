@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import pytest
+from Bio.PDB import is_aa
+import PackingDensity
+from pdb_reader import read_atoms
+
+@pytest.fixture
+def pdb_file(test_files):
+    return os.path.join(test_files, 'FBgn0000015', 'refprot', 'FBgn0000015.pdb')
+
+def pair_distances(coords):
+    coords = coords.astype(float)
+    dist = np.sqrt(((coords[:, None] - coords[None])**2).sum(axis = 2))
+    np.fill_diagonal(dist, np.inf)
+    return dist
+
+def test_metrics_match_brute_force(pdb_file):
+    residues = PackingDensity.get_packing('ADBD_DROME', pdb_file)
+    df = PackingDensity.make_packing_df(residues)
+    coord_ca, coord_sc = residues['coord_ca'], residues['sidechain_center'].astype(float)
+
+    dist_ca = pair_distances(coord_ca)
+    for cutoff in PackingDensity.CN_CUTOFFS:
+        np.testing.assert_array_equal(df['cn_' + str(cutoff)], (dist_ca < cutoff).sum(axis = 1))
+
+    dist_sc = pair_distances(coord_sc)
+    near = dist_sc < PackingDensity.NEIGHBOR_CUTOFF
+    for label, weight in PackingDensity.WCN_WEIGHTS.items():
+        np.testing.assert_allclose(df['wcn_sc_' + label],
+                                   np.where(near, weight(dist_sc), 0).sum(axis = 1), rtol = 1e-5)
+
+    atoms = read_atoms(pdb_file)
+    amino = [resname for resname in np.unique(atoms['resname']) if is_aa(resname)]
+    heavy = np.isin(atoms['resname'], amino) & (atoms['element'] != 'H')
+    atom_coords = atoms['coord'][heavy].astype(float)
+    radius = PackingDensity.ATOM_RADIUS
+    counts = (((coord_sc[:, None] - atom_coords[None])**2).sum(axis = 2) <= radius**2).sum(axis = 1)
+    np.testing.assert_allclose(df.atom_density*4/3*np.pi*radius**3, counts, rtol = 1e-5)
+
+    # Every residue of a single-chain model has a direction, and up + down
+    # is the CA contact number at the HSE radius
+    up_down = df.hse_up + df.hse_down
+    np.testing.assert_array_equal(up_down, (dist_ca < PackingDensity.HSE_RADIUS).sum(axis = 1))
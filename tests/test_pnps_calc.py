@@ -0,0 +1,38 @@
+import os
+import pandas as pd
+import pytest
+from aggregate import aggregate_pnps
+from pnps_calc import calc_pnps, cstat_parser, var_parser
+
+@pytest.fixture
+def baseline(data_dir):
+    # aggregate_pnps output of the original line-by-line implementation
+    return pd.read_csv(os.path.join(data_dir, 'pnps_baseline.csv'),
+                       dtype = {'UniProt_ID': str, 'Codon_index': str},
+                       float_precision = 'round_trip')
+
+def gene_inputs(test_files):
+    for fb_id in sorted(os.listdir(test_files)):
+        paths = [os.path.join(test_files, fb_id, fb_id + suffix)
+                 for suffix in ['.missense.Poly.UniProt.bed',
+                                '.synonymous.Poly.UniProt.bed',
+                                '.codonStats.UniProt.bed']]
+        if all(os.path.isfile(path) for path in paths):
+            yield var_parser(paths[0]), var_parser(paths[1]), cstat_parser(paths[2])
+
+def test_calc_pnps_matches_baseline(test_files, baseline):
+    frame = [calc_pnps(*inputs) for inputs in gene_inputs(test_files)]
+    df = pd.concat([entry for entry in frame if len(entry) > 0], ignore_index = True)
+    pd.testing.assert_frame_equal(df, baseline, check_exact = True)
+
+def test_calc_pnps_iterate_matches_baseline(test_files, baseline):
+    rows = sum([calc_pnps(*inputs, iterate = True) for inputs in gene_inputs(test_files)], [])
+    df = pd.DataFrame(rows, columns = baseline.columns[:8])
+    pd.testing.assert_frame_equal(df, baseline[baseline.columns[:8]], check_exact = True,
+                                  check_dtype = False)
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_aggregate_pnps_matches_baseline(test_files, baseline, n_workers):
+    df, check_df = aggregate_pnps(test_files, n_workers = n_workers)
+    pd.testing.assert_frame_equal(df, baseline, check_exact = True)
+    assert check_df.pNpS_calc.sum() == baseline.UniProt_ID.nunique()
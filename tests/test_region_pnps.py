@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import region_pnps
+from aggregate import aggregate_lineages
+from bed_parser import read_slac_bed
+
+@pytest.fixture
+def pnps_df(data_dir):
+    return pd.read_csv(os.path.join(data_dir, 'pnps_baseline.csv'),
+                       float_precision = 'round_trip')
+
+@pytest.fixture
+def lineage_df(test_files):
+    return aggregate_lineages(test_files).reset_index()
+
+@pytest.fixture
+def slac_df(test_files):
+    # A join_engine-like table: SLAC counts at the 1-based SLAC position
+    frame = []
+    for fb_id in ['FBgn0000015', 'FBgn0000018', 'FBgn0000052']:
+        path = os.path.join(test_files, fb_id, fb_id + '.SLAC.UniProt.bed')
+        frame.append(read_slac_bed(path, usecols = ['UniProt_ID', 'AA_pos', 'E[S]',
+                                                    'E[N]', 'DS', 'DN']))
+    return pd.concat(frame, ignore_index = True).set_index(['UniProt_ID', 'AA_pos'])
+
+def naive_sums(df, regions, labels):
+    # One boolean selection per region
+    frame = []
+    for entry in regions.itertuples():
+        rows = df[(df.UniProt_ID == entry.UniProt_ID) & (df.AA_pos >= entry.AA_start)
+                  & (df.AA_pos < entry.AA_end)]
+        frame.append([len(rows)] + [rows[label].sum() for label in labels])
+    return pd.DataFrame(frame, columns = ['n_pos'] + list(labels))
+
+def assert_sums(output, expected, labels):
+    assert output.n_pos.tolist() == expected.n_pos.tolist()
+    for label in labels:
+        np.testing.assert_allclose(output[label], expected[label], rtol = 1e-9, atol = 1e-9)
+
+@pytest.mark.parametrize('width, step', [(30, 10), (7, 7), (1000, 50)])
+def test_window_pnps_matches_naive(pnps_df, width, step):
+    output = region_pnps.window_pnps(pnps_df, width, step)
+    assert_sums(output, naive_sums(pnps_df, output, region_pnps.SUM_LABELS),
+                region_pnps.SUM_LABELS)
+    np.testing.assert_allclose(output['pN/pS'], (output.PN/output['E[N]'])
+                               / (output.PS/output['E[S]']))
+
+def test_window_dnds_of_join_table(slac_df):
+    labels = region_pnps.DNDS_LABELS
+    output = region_pnps.window_pnps(region_pnps.join_table(slac_df), 20, 5, labels)
+    df = slac_df.reset_index().assign(AA_pos = lambda df: df.AA_pos - 1)
+    assert_sums(output, naive_sums(df, output, labels), labels)
+    np.testing.assert_allclose(output['dN/dS'], (output.DN/output['E[N]'])
+                               / (output.DS/output['E[S]']))
+    assert (output.n_pos > 0).any()
+
+def test_domain_dnds_of_lineage_table(lineage_df, test_files):
+    labels = region_pnps.SUM_LABELS + region_pnps.LINEAGE_DNDS_LABELS
+    fb_ids = sorted(lineage_df.FBgn_id.unique())
+    for group, df in lineage_df.groupby('Group'):
+        output = region_pnps.domain_pnps(df, test_files, fb_ids, labels)
+        # Missing SLAC or Poly values count as 0, as in the prefix sums
+        assert_sums(output, naive_sums(df.fillna({label: 0 for label in labels}),
+                                       output, labels), labels)
+        np.testing.assert_allclose(output['dN/dS'], (output.DN/output['E[N]_SLAC'])
+                                   / (output.DS/output['E[S]_SLAC']))
+        assert 'pN/pS' in output
+
+def test_class_dnds_of_lineage_table(lineage_df):
+    labels = region_pnps.LINEAGE_DNDS_LABELS
+    output = region_pnps.class_pnps(lineage_df, ['Group', 'Masked'], labels = labels)
+    expected = lineage_df.groupby(['Group', 'Masked'])[labels].sum().reset_index()
+    assert_sums(output, expected.assign(n_pos = lineage_df.groupby(['Group', 'Masked']).size()
+                                        .to_numpy()), labels)
+    assert 'dN/dS' in output and 'pN/pS' not in output
@@ -0,0 +1,57 @@
+import os
+import pandas as pd
+import pytest
+import struct_cache
+
+@pytest.fixture
+def pdb_files(tmp_path):
+    # Distinct contents give distinct cache keys
+    paths = []
+    for i in range(40):
+        path = tmp_path / ('model_' + str(i) + '.pdb')
+        path.write_text('MODEL ' + str(i) + '\n')
+        paths.append(str(path))
+    return paths
+
+def table(i):
+    return pd.DataFrame({'pos': range(100), 'value': [float(i)]*100})
+
+def test_corrupt_entry_is_a_miss(tmp_path, pdb_files):
+    cache_dir = str(tmp_path / 'cache')
+    struct_cache.cached('wcn', pdb_files[0], 'v1', lambda: table(0), cache_dir)
+    path = os.path.join(cache_dir, 'wcn', struct_cache.cache_key(pdb_files[0], 'v1') + '.pkl')
+    with open(path, 'r+b') as write:
+        write.truncate(20)
+
+    with pytest.warns(RuntimeWarning, match = 'Unreadable cache entry'):
+        df = struct_cache.cached('wcn', pdb_files[0], 'v1', lambda: table(1), cache_dir)
+    pd.testing.assert_frame_equal(df, table(1))
+
+    # The entry was overwritten, so the next call is a hit
+    df = struct_cache.cached('wcn', pdb_files[0], 'v1', lambda: table(2), cache_dir)
+    pd.testing.assert_frame_equal(df, table(1))
+
+def test_writes_do_not_rescan(tmp_path, pdb_files, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    scans = []
+    cache_entries = struct_cache.cache_entries
+    monkeypatch.setattr(struct_cache, 'cache_entries',
+                        lambda cache_dir: scans.append(cache_dir) or cache_entries(cache_dir))
+
+    for i, path in enumerate(pdb_files):
+        struct_cache.cached('wcn', path, 'v1', lambda: table(i), cache_dir)
+    assert len(scans) == 1
+
+def test_cache_stays_bounded(tmp_path, pdb_files, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    scans = []
+    cache_entries = struct_cache.cache_entries
+    monkeypatch.setattr(struct_cache, 'cache_entries',
+                        lambda cache_dir: scans.append(cache_dir) or cache_entries(cache_dir))
+
+    table(0).to_pickle(str(tmp_path / 'probe.pkl'))
+    max_bytes = 10*os.path.getsize(str(tmp_path / 'probe.pkl'))
+    for i, path in enumerate(pdb_files):
+        struct_cache.cached('wcn', path, 'v1', lambda: table(i), cache_dir, max_bytes)
+        assert sum(entry[1] for entry in cache_entries(cache_dir)) <= max_bytes
+    assert len(scans) < len(pdb_files)/2